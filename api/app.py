@@ -1,11 +1,27 @@
+import click
+from compression import ResponseCompression
 from dotenv import load_dotenv
-from flask import Flask, jsonify
+from events import EventHub, create_broker
+from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from hashing import PasswordHasher
+from identity import AuthVersionCache
+from json_provider import get_json_provider_class
 from jwt import ExpiredSignatureError
-from models import db, RevokedToken
+from metrics import RequestMetrics
+from models import db
+from monitoring_views import monitoring_bp, get_pool_metrics
 import os
-from task_views import task_bp
+from pool import get_cpu_count, get_engine_options, get_server_threads, parse_database_uris
+from query_stats import QueryMonitor
+from replicas import ReplicaRouter, use_primary
+from revocation import RevocationCache, prune_revoked_tokens
+from search import rebuild_search_index
+from shards import ShardRouter, move_user_tasks, rebalance_shards
+from task_views import task_bp, prune_task_tombstones, rebuild_task_stats
+from upgrade import upgrade_database
+from user_deletion import UserDeletions, get_unfinished_deletion_ids, resume_user_deletions
 from user_views import user_bp, init_db
 from werkzeug.exceptions import HTTPException
 
@@ -13,7 +29,8 @@ def create_app(config_name="default"):
     """Creates and returns a new instance of Flask app."""
     load_dotenv()
     app = Flask(__name__)
-    CORS(app, supports_credentials=True, origins=os.getenv("FRONTEND_ORIGIN", "").split(","))
+    app.json = get_json_provider_class()(app)  # fast encoder with ISO dates
+    CORS(app, supports_credentials=True, origins=os.getenv("FRONTEND_ORIGIN", "").split(","), expose_headers=["ETag"])
 
     # Database settings
     if config_name == "testing":
@@ -22,24 +39,168 @@ def create_app(config_name="default"):
     else:
         app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("SQLALCHEMY_DATABASE_URI")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+    app.config["SQLALCHEMY_REPLICA_URIS"] = [] if config_name == "testing" \
+        else parse_database_uris(os.getenv("SQLALCHEMY_REPLICA_URIS"))
+    app.config["READ_YOUR_WRITES_WINDOW"] = int(os.getenv("TODOLIST_READ_YOUR_WRITES_WINDOW", "5"))
+    # Databases of tasks besides the primary one, in fixed order (see shards.py)
+    app.config["SQLALCHEMY_SHARD_URIS"] = [] if config_name == "testing" \
+        else parse_database_uris(os.getenv("SQLALCHEMY_SHARD_URIS"))
+    app.config["TASK_ID_BLOCK_SIZE"] = int(os.getenv("TODOLIST_TASK_ID_BLOCK_SIZE", "1000"))
 
     # JWT settings
     app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "changeme")
     app.config["JWT_TOKEN_LOCATION"] = ["cookies", "headers"]
+    app.config["AUTH_CACHE_TTL"] = int(os.getenv("TODOLIST_AUTH_CACHE_TTL", "60"))
+    app.config["ADMIN_AUTH_CACHE_TTL"] = int(os.getenv("TODOLIST_ADMIN_AUTH_CACHE_TTL", "5"))
+    app.config["REVOKED_TOKENS_CACHE_SIZE"] = int(os.getenv("TODOLIST_REVOKED_TOKENS_CACHE_SIZE", "100000"))
+    app.config["REVOKED_TOKENS_CACHE_TTL"] = int(os.getenv("TODOLIST_REVOKED_TOKENS_CACHE_TTL", "30"))
+    app.config["REVOKED_TOKENS_BLOOM_REFRESH"] = int(os.getenv("TODOLIST_REVOKED_TOKENS_BLOOM_REFRESH", "30"))
+
+    # Password hashing settings
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("TODOLIST_PASSWORD_HASH_METHOD", "scrypt")
+    app.config["HASHING_WORKERS"] = int(os.getenv("TODOLIST_HASHING_WORKERS", str(get_cpu_count())))
+    app.config["HASHING_QUEUE_SIZE"] = int(os.getenv("TODOLIST_HASHING_QUEUE_SIZE", "32"))
+    app.config["HASHING_RETRY_AFTER"] = int(os.getenv("TODOLIST_HASHING_RETRY_AFTER", "1"))
+    if config_name == "testing":
+        app.config["HASHING_WORKERS"] = 0  # hash in request thread, without extra processes
+
+    # Pagination settings
+    app.config["PAGE_SIZE"] = int(os.getenv("TODOLIST_PAGE_SIZE", "100"))
+    app.config["MAX_PAGE_SIZE"] = int(os.getenv("TODOLIST_MAX_PAGE_SIZE", "1000"))
+    app.config["STREAM_YIELD_PER"] = int(os.getenv("TODOLIST_STREAM_YIELD_PER", "1000"))
+    app.config["TASK_BATCH_MAX_SIZE"] = int(os.getenv("TODOLIST_BATCH_MAX_SIZE", "500"))
+    app.config["IMPORT_CHUNK_SIZE"] = int(os.getenv("TODOLIST_IMPORT_CHUNK_SIZE", "5000"))
+    app.config["TASK_SYNC_MARGIN"] = int(os.getenv("TODOLIST_SYNC_MARGIN", "5"))
+    app.config["TASK_TOMBSTONE_RETENTION_DAYS"] = int(os.getenv("TODOLIST_TOMBSTONE_RETENTION_DAYS", "30"))
+    app.config["USER_DELETION_CHUNK_SIZE"] = int(os.getenv("TODOLIST_USER_DELETION_CHUNK_SIZE", "1000"))
+    app.config["LEGACY_LIST_RESPONSES"] = os.getenv("TODOLIST_LEGACY_LIST_RESPONSES", "false").lower() == "true"
+
+    # Task events settings (stream served on its own port, see event_server.py)
+    app.config["EVENTS_PORT"] = int(os.getenv("TODOLIST_EVENTS_PORT", "8081"))
+    app.config["EVENTS_QUEUE_SIZE"] = int(os.getenv("TODOLIST_EVENTS_QUEUE_SIZE", "100"))
+    app.config["EVENTS_HEARTBEAT"] = int(os.getenv("TODOLIST_EVENTS_HEARTBEAT", "15"))
+    app.config["EVENTS_REDIS_URL"] = os.getenv("TODOLIST_EVENTS_REDIS_URL") or None
+
+    # Compression of responses (gzip, or brotli if installed)
+    app.config["COMPRESSION_MIN_SIZE"] = int(os.getenv("TODOLIST_COMPRESSION_MIN_SIZE", "1024"))
+    app.config["COMPRESSION_LEVEL"] = int(os.getenv("TODOLIST_COMPRESSION_LEVEL", "6"))
+
+    # Metrics settings (directory shared by all server processes, empty for single process)
+    app.config["METRICS_DIR"] = os.getenv("TODOLIST_METRICS_DIR") or None
+    app.config["METRICS_FLUSH_INTERVAL"] = int(os.getenv("TODOLIST_METRICS_FLUSH_INTERVAL", "5"))
+    app.config["QUERY_DEBUG_HEADERS"] = os.getenv("TODOLIST_QUERY_DEBUG_HEADERS", "false").lower() == "true"
+    app.config["QUERY_COUNT_THRESHOLD"] = int(os.getenv("TODOLIST_QUERY_COUNT_THRESHOLD", "20"))
+    app.config["SLOW_QUERY_MS"] = int(os.getenv("TODOLIST_SLOW_QUERY_MS", "200"))
 
     # Blueprints registration
     app.register_blueprint(user_bp)
     app.register_blueprint(task_bp)
+    app.register_blueprint(monitoring_bp)
 
     # Database and JWT initialization
     db.init_app(app)
     jwt = JWTManager(app)
+    app.extensions["auth_versions"] = AuthVersionCache(app.config["AUTH_CACHE_TTL"], app.config["ADMIN_AUTH_CACHE_TTL"])
+    app.extensions["password_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["HASHING_WORKERS"],
+        max_pending=app.config["HASHING_QUEUE_SIZE"],
+        retry_after=app.config["HASHING_RETRY_AFTER"],
+    )
+    app.extensions["revoked_tokens"] = RevocationCache(
+        max_size=app.config["REVOKED_TOKENS_CACHE_SIZE"],
+        negative_ttl=app.config["REVOKED_TOKENS_CACHE_TTL"],
+        bloom_refresh_interval=app.config["REVOKED_TOKENS_BLOOM_REFRESH"],
+        background=config_name != "testing",
+    )
+    app.extensions["user_deletions"] = UserDeletions(chunk_size=app.config["USER_DELETION_CHUNK_SIZE"],
+                                                     background=config_name != "testing")
+    app.extensions["events"] = EventHub(create_broker(app.config["EVENTS_REDIS_URL"]),
+                                        max_queue=app.config["EVENTS_QUEUE_SIZE"])
+    app.extensions["metrics"] = RequestMetrics(
+        metrics_dir=app.config["METRICS_DIR"],
+        flush_interval=app.config["METRICS_FLUSH_INTERVAL"],
+        collect=get_pool_metrics,
+    )
+    app.extensions["metrics"].init_app(app)
+    app.extensions["query_monitor"] = QueryMonitor(
+        count_threshold=app.config["QUERY_COUNT_THRESHOLD"],
+        slow_query_ms=app.config["SLOW_QUERY_MS"],
+        debug_headers=app.config["QUERY_DEBUG_HEADERS"],
+    )
+    app.extensions["query_monitor"].init_app(app)
+    app.extensions["replicas"] = ReplicaRouter(window=app.config["READ_YOUR_WRITES_WINDOW"])
+    app.extensions["replicas"].init_app(app)
+    app.extensions["shards"] = ShardRouter(id_block_size=app.config["TASK_ID_BLOCK_SIZE"])
+    app.extensions["shards"].init_app(app)
+    # Registered last, so it runs first after request and metrics see sizes of compressed bodies
+    app.extensions["compression"] = ResponseCompression(
+        min_size=app.config["COMPRESSION_MIN_SIZE"],
+        level=app.config["COMPRESSION_LEVEL"],
+    )
+    app.extensions["compression"].init_app(app)
 
     # Function to check if JWT token is revoked
     @jwt.token_in_blocklist_loader
     def check_if_token_revoked(jwt_header, jwt_payload):
-        token = db.session.get(RevokedToken, jwt_payload["jti"])
-        return token is not None
+        with use_primary():  # a replica may not have the revocation yet
+            # Requester of deletion of their own account polls its status with a token revoked by the deletion
+            check_user = request.endpoint != "user_bp.get_user_deletion"
+            return app.extensions["revoked_tokens"].is_token_revoked(jwt_payload, check_user)
+
+    # Command for cron job keeping revoked tokens table small
+    @app.cli.command("prune-revoked-tokens")
+    def prune_revoked_tokens_command():
+        """Delete revoked tokens that are already expired."""
+        removed = prune_revoked_tokens()
+        click.echo(f"Removed {removed} expired revoked tokens.")
+
+    # Command for cron job removing records of deletions older than clients may sync from
+    @app.cli.command("prune-task-tombstones")
+    def prune_task_tombstones_command():
+        """Delete tombstones of deleted tasks older than retention period."""
+        removed = prune_task_tombstones()
+        click.echo(f"Removed {removed} task tombstones.")
+
+    # Command creating search index in database created before search, or repairing it
+    @app.cli.command("rebuild-task-search-index")
+    def rebuild_task_search_index_command():
+        """Create missing full-text index of tasks and rebuild it."""
+        rebuild_search_index()
+        click.echo("Task search index rebuilt.")
+
+    # Command recounting task statistics from scratch, e.g. after tasks were changed outside the API
+    @app.cli.command("rebuild-task-stats")
+    def rebuild_task_stats_command():
+        """Recount task counters of all users."""
+        updated = rebuild_task_stats()
+        click.echo(f"Rebuilt task statistics of {updated} users.")
+
+    # Command finishing deletions of users interrupted by restart of the server
+    @app.cli.command("resume-user-deletions")
+    def resume_user_deletions_command():
+        """Run unfinished user deletion jobs."""
+        resumed = resume_user_deletions(app.extensions["user_deletions"])
+        click.echo(f"Finished {resumed} user deletions.")
+
+    # Command moving tasks of one user to another shard, while the user keeps working
+    @app.cli.command("move-user-tasks")
+    @click.argument("user_id", type=int)
+    @click.argument("shard", type=int)
+    @click.option("--chunk-size", default=1000, show_default=True, help="Tasks copied in one transaction.")
+    def move_user_tasks_command(user_id, shard, chunk_size):
+        """Move tasks of user USER_ID to SHARD (0 is the primary database)."""
+        moved = move_user_tasks(user_id, shard, chunk_size)
+        click.echo(f"Moved {moved} tasks of user {user_id} to shard {shard}.")
+
+    # Command moving users to shards given by consistent hash, e.g. after adding a shard
+    @app.cli.command("rebalance-task-shards")
+    @click.option("--chunk-size", default=1000, show_default=True, help="Tasks copied in one transaction.")
+    def rebalance_task_shards_command(chunk_size):
+        """Move users whose tasks are not in the shard of their consistent hash placement."""
+        moved = rebalance_shards(chunk_size)
+        click.echo(f"Moved tasks of {moved} users.")
 
     # Global error handler
     @app.errorhandler(Exception)
@@ -47,6 +208,9 @@ def create_app(config_name="default"):
         if isinstance(error, HTTPException):
             response = jsonify({"error": error.description})
             response.status_code = error.code
+            for name, value in error.get_headers():  # e.g. Retry-After or Allow
+                if name.lower() != "content-type":
+                    response.headers[name] = value
         elif isinstance(error, ExpiredSignatureError):
             response = jsonify({"error": "Token has expired"})
             response.status_code = 401
@@ -57,7 +221,11 @@ def create_app(config_name="default"):
 
     # Fill database by initial values (only if we are not testing)
     with app.app_context():
+        for engine in [*db.engines.values(), *app.extensions["replicas"].engines, *app.extensions["shards"].engines]:
+            app.extensions["query_monitor"].install(engine)
         db.create_all()
+        app.extensions["shards"].create_all()
+        upgrade_database()  # tables created by older versions of the app
         if config_name != "testing":
             init_db()
     return app
@@ -65,7 +233,14 @@ def create_app(config_name="default"):
 
 # Server start only if we run app directly
 if __name__ == "__main__":
+    from event_server import EventServer
     from waitress import serve
     app = create_app()
+    if app.config["EVENTS_PORT"]:
+        EventServer(app, app.extensions["events"], port=app.config["EVENTS_PORT"],
+                    heartbeat=app.config["EVENTS_HEARTBEAT"]).start()
+    with app.app_context():
+        for deletion_id in get_unfinished_deletion_ids():  # interrupted by restart, finished in the background
+            app.extensions["user_deletions"].submit(deletion_id)
     port = os.getenv("TODOLIST_PORT", "80")
-    serve(app, host="0.0.0.0", port=port)
+    serve(app, host="0.0.0.0", port=port, threads=get_server_threads())
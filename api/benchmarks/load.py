@@ -0,0 +1,265 @@
+"""Load benchmark of the API: throughput and latency percentiles of the main endpoints.
+
+The app is built by create_app against a file-backed SQLite database seeded with
+the requested number of tasks, and driven concurrently by threads - directly
+through the WSGI interface and through a local waitress server.
+
+Run from the api directory, e.g.:
+    python -m benchmarks.load --tasks 100000 --output bench.json
+    python -m benchmarks.load --tasks 100000 --baseline bench.json --max-regression 0.2
+
+With --baseline the run fails (exit code 1) when any endpoint is slower than the
+baseline by more than --max-regression (p95 latency up or throughput down).
+"""
+import argparse
+from datetime import datetime, timedelta
+import http.client
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+SCENARIOS = ("login", "list_tasks", "filter_tasks", "get_task", "create_task")
+MODES = ("wsgi", "waitress")
+USERS_COUNT = 100
+PASSWORD = "benchpass"
+
+
+# ============================================================
+# 🌱 1. DATABASE AND APP
+# ============================================================
+
+def build_app(database_path, tasks_count):
+    """Create app on SQLite file, seeding it first if the file does not exist yet."""
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{database_path}"
+    from app import create_app
+    from models import db
+    seeded = os.path.exists(database_path)
+    app = create_app()
+    if not seeded:
+        with app.app_context():
+            seed_database(db, tasks_count)
+    return app
+
+
+def seed_database(db, tasks_count, chunk_size=50000):
+    from models import Task, User
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    password_hash = generate_password_hash(PASSWORD)
+    users = [{"username": f"bench{n}", "email": f"bench{n}@example.com", "password": password_hash, "role": "User"}
+             for n in range(max(min(USERS_COUNT, tasks_count), 1))]  # every user has at least one task
+    db.session.execute(insert(User), users)
+    user_ids = db.session.scalars(db.select(User.id).where(User.username.like("bench%"))).all()
+    start = datetime(2025, 1, 1)
+    for chunk_start in range(0, tasks_count, chunk_size):
+        rows = [{"title": f"Task {n}", "description": "Benchmark task", "done": n % 3 == 0,
+                 "due_date": start + timedelta(minutes=n), "user_id": user_ids[n % len(user_ids)]}
+                for n in range(chunk_start, min(chunk_start + chunk_size, tasks_count))]
+        db.session.execute(insert(Task), rows)
+        db.session.commit()
+
+
+def prepare_context(app):
+    """Return users (id, token, task id) used by the scenarios."""
+    from flask_jwt_extended import create_access_token
+    from models import db, Task, User
+    context = []
+    with app.app_context():
+        users = db.session.execute(db.select(User.id, User.username, User.role, User.auth_version)
+                                   .where(User.username.like("bench%"))).all()
+        for user in users:
+            claims = {"role": user.role, "auth_version": user.auth_version}
+            token = create_access_token(identity=str(user.id), additional_claims=claims, expires_delta=False)
+            task_id = db.session.scalar(db.select(Task.id).where(Task.user_id == user.id).limit(1))
+            context.append({"id": user.id, "username": user.username, "token": token, "task_id": task_id})
+    return context
+
+
+def build_request(scenario, user, number):
+    """Return (method, path, body, headers) of one request of the scenario."""
+    headers = {"Authorization": f"Bearer {user['token']}", "Content-Type": "application/json"}
+    if scenario == "login":
+        body = {"username": user["username"], "password": PASSWORD}
+        return "POST", "/login", json.dumps(body), {"Content-Type": "application/json"}
+    if scenario == "list_tasks":
+        return "GET", f"/tasks/user/{user['id']}", None, headers
+    if scenario == "filter_tasks":
+        return "GET", f"/tasks/user/{user['id']}?done=0&due_after=2025-01-02T00:00&sort=-due_date", None, headers
+    if scenario == "get_task":
+        return "GET", f"/tasks/{user['task_id']}", None, headers
+    if scenario == "create_task":
+        body = {"title": f"Load {number}", "description": "", "due_date": "2025-06-01T12:00", "done": 0}
+        return "POST", "/tasks", json.dumps(body), headers
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+# ============================================================
+# 🏎️ 2. LOAD DRIVERS
+# ============================================================
+
+def run_scenario(send_factory, scenario, users, requests_count, concurrency):
+    """Send requests from concurrent threads and return latencies (seconds) and wall time."""
+    latencies, errors = [], []
+    counter = iter(range(requests_count))
+    lock = threading.Lock()
+
+    def worker():
+        send = send_factory()
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                return
+            method, path, body, headers = build_request(scenario, users[number % len(users)], number)
+            started = time.perf_counter()
+            status = send(method, path, body, headers)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def wsgi_sender(app):
+    def factory():
+        client = app.test_client()
+        def send(method, path, body, headers):
+            return client.open(path, method=method, data=body, headers=headers).status_code
+        return send
+    return factory
+
+
+def http_sender(port):
+    def factory():
+        connection = http.client.HTTPConnection("127.0.0.1", port)  # kept alive between requests
+        def send(method, path, body, headers):
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        return send
+    return factory
+
+
+def start_waitress(app, threads):
+    from waitress import create_server
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)  # queue depth warnings are expected here
+    server = create_server(app, host="127.0.0.1", port=0, threads=threads)
+
+    def run():
+        try:
+            server.run()
+        except OSError:
+            pass  # listening socket closed by stop_waitress
+    threading.Thread(target=run, daemon=True).start()
+    return server
+
+
+def stop_waitress(server):
+    server.task_dispatcher.shutdown()
+    server.close()
+
+
+def summarize(latencies, errors, wall_time):
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / wall_time, 1),
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p95_ms": round(percentiles[94] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+    }
+
+
+def run_benchmark(tasks_count, requests_count, concurrency, modes=MODES, scenarios=SCENARIOS, database_dir=None):
+    database_dir = database_dir or tempfile.gettempdir()
+    app = build_app(os.path.join(database_dir, f"todolist-bench-{tasks_count}.db"), tasks_count)
+    users = prepare_context(app)
+    results = {}
+    for mode in modes:
+        server = start_waitress(app, concurrency) if mode == "waitress" else None
+        send_factory = http_sender(server.effective_port) if server else wsgi_sender(app)
+        try:
+            results[mode] = {scenario: summarize(*run_scenario(send_factory, scenario, users, requests_count, concurrency))
+                             for scenario in scenarios}
+        finally:
+            if server:
+                stop_waitress(server)
+    return {
+        "config": {"tasks": tasks_count, "requests": requests_count, "concurrency": concurrency},
+        "results": results,
+    }
+
+
+# ============================================================
+# 📊 3. REPORT AND REGRESSION CHECK
+# ============================================================
+
+def find_regressions(current, baseline, max_regression):
+    """Return descriptions of endpoints slower than baseline by more than max_regression (fraction)."""
+    regressions = []
+    for mode, scenarios in baseline["results"].items():
+        for scenario, base in scenarios.items():
+            result = current["results"].get(mode, {}).get(scenario)
+            if result is None:
+                continue
+            if result["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+                regressions.append(f"{mode}/{scenario}: p95 {base['p95_ms']} ms -> {result['p95_ms']} ms")
+            if result["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+                regressions.append(f"{mode}/{scenario}: throughput {base['throughput_rps']} -> "
+                                   f"{result['throughput_rps']} req/s")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'mode':<9} {'scenario':<13} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for mode, scenarios in report["results"].items():
+        for scenario, result in scenarios.items():
+            print(f"{mode:<9} {scenario:<13} {result['throughput_rps']:>9} {result['p50_ms']:>9} "
+                  f"{result['p95_ms']:>9} {result['p99_ms']:>9} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000, help="number of seeded tasks, e.g. 1000, 100000, 1000000")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario and mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads (and waitress threads)")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated: wsgi, waitress")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenarios")
+    parser.add_argument("--database-dir", help="directory for seeded SQLite files (reused between runs)")
+    parser.add_argument("--output", help="save results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed slowdown against baseline")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.tasks, args.requests, args.concurrency, modes=args.modes.split(","),
+                           scenarios=args.scenarios.split(","), database_dir=args.database_dir)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(report, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
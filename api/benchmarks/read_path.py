@@ -0,0 +1,69 @@
+"""Micro-benchmark of list read paths: ORM objects + to_dict() against selected columns + row_to_dict().
+
+Run from the api directory:
+    python -m benchmarks.read_path --sizes 10000,100000
+"""
+import argparse
+from app import create_app
+from datetime import datetime, timedelta
+from models import db, row_to_dict, Task, User
+from sqlalchemy import insert, select
+import time
+import tracemalloc
+
+
+def orm_read_path():
+    return [task.to_dict() for task in Task.query.order_by(Task.id).all()]
+
+
+def projected_read_path():
+    statement = select(*Task.get_serialized_columns()).order_by(Task.id)
+    return [row_to_dict(row) for row in db.session.execute(statement)]
+
+
+def seed_tasks(count):
+    user = User(username="bench", email="bench@example.com", password="-", role="User")
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2025, 1, 1)
+    rows = [{"title": f"Task {n}", "description": "Benchmark task description", "done": n % 3 == 0,
+             "due_date": start + timedelta(minutes=n), "user_id": user.id} for n in range(count)]
+    db.session.execute(insert(Task), rows)
+    db.session.commit()
+
+
+def measure(read_path, repeats):
+    best_time = float("inf")
+    for _ in range(repeats):
+        db.session.remove()  # every run starts with empty identity map
+        started = time.perf_counter()
+        read_path()
+        best_time = min(best_time, time.perf_counter() - started)
+
+    db.session.remove()
+    tracemalloc.start()
+    result = read_path()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(result), best_time, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="comma separated numbers of tasks")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case (best one is reported)")
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'read path':<10} {'rows/sec':>12} {'peak allocated MiB':>19}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        app = create_app("testing")
+        with app.app_context():
+            seed_tasks(size)
+            for name, read_path in (("orm", orm_read_path), ("projected", projected_read_path)):
+                rows, seconds, peak = measure(read_path, args.repeats)
+                print(f"{rows:>8} {name:<10} {rows / seconds:>12,.0f} {peak / 2**20:>19.1f}")
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
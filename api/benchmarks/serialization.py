@@ -0,0 +1,74 @@
+"""Micro-benchmark of task list serialization: JSON providers and response compression.
+
+Compares Flask's default JSON provider with the providers of json_provider.py
+(serialization time of a list response) and bytes on the wire for identity,
+gzip and brotli (if installed) encodings of the same response.
+
+Run from the api directory:
+    python -m benchmarks.serialization --sizes 10000
+"""
+import argparse
+from app import create_app
+from benchmarks.read_path import projected_read_path, seed_tasks
+import compression
+from flask.json.provider import DefaultJSONProvider
+import json_provider
+from models import db
+import time
+
+
+def get_providers():
+    providers = {"flask": DefaultJSONProvider, "iso-json": json_provider.ISOJSONProvider}
+    if json_provider.orjson is not None:
+        providers["orjson"] = json_provider.OrjsonProvider
+    return providers
+
+
+def measure_serialization(provider, items, repeats):
+    best_time = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        body = provider.response({"items": items, "next_cursor": None}).get_data()
+        best_time = min(best_time, time.perf_counter() - started)
+    return best_time, body
+
+
+def measure_compression(body, encoding, level, repeats):
+    response_compression = compression.ResponseCompression(level=level)
+    best_time, compressed = float("inf"), b""
+    for _ in range(repeats):
+        compressor = response_compression._create_compressor(encoding)
+        started = time.perf_counter()
+        compressed = compressor.compress(body) + compressor.flush()
+        best_time = min(best_time, time.perf_counter() - started)
+    return best_time, len(compressed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000", help="comma separated numbers of tasks")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per case (best one is reported)")
+    parser.add_argument("--level", type=int, default=6, help="compression level")
+    args = parser.parse_args()
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        app = create_app("testing")
+        with app.app_context():
+            seed_tasks(size)
+            items = projected_read_path()
+            print(f"{size} tasks")
+            print(f"  {'provider':<10} {'ms':>8} {'bytes':>10}")
+            body = None
+            for name, provider_class in get_providers().items():
+                seconds, body = measure_serialization(provider_class(app), items, args.repeats)
+                print(f"  {name:<10} {seconds * 1000:>8.1f} {len(body):>10,}")
+            print(f"  {'encoding':<10} {'ms':>8} {'bytes':>10}")
+            encodings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+            for encoding in encodings:
+                seconds, compressed_size = measure_compression(body, encoding, args.level, args.repeats)
+                print(f"  {encoding:<10} {seconds * 1000:>8.1f} {compressed_size:>10,}")
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+from etags import with_coding
+from flask import request
+import zlib
+
+try:
+    import brotli  # optional, smaller responses for browsers which accept br
+except ImportError:
+    brotli = None
+
+# ============================================================
+# 🗜️ RESPONSE COMPRESSION
+# ============================================================
+# JSON responses over a size threshold are compressed with the best encoding
+# the client accepts: brotli (when the package is installed) or gzip. Streamed
+# lists are compressed chunk by chunk, so they stay streamed. Compressed
+# responses keep strong ETags with suffix of the coding (e.g. "task-5-12-gzip"),
+# as their bytes differ from the identity encoding; etags.py strips it to compare.
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/plain", "text/csv", "text/html"}
+
+
+class ResponseCompression:
+    def __init__(self, min_size=1024, level=6):
+        self.min_size = min_size
+        self.level = level  # gzip level 1-9 (brotli quality 0-11), 0 disables compression
+
+    def init_app(self, app):
+        app.after_request(self.compress_response)
+
+    def get_encoding(self):
+        """Return encoding negotiated from Accept-Encoding of request, None for identity."""
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def compress_response(self, response):
+        response.vary.add("Accept-Encoding")
+        if (not self.level or request.method == "HEAD" or response.status_code < 200
+                or response.status_code in (204, 304) or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough):
+            return response
+        if not response.is_streamed and response.content_length is not None \
+                and response.content_length < self.min_size:
+            return response
+        encoding = self.get_encoding()
+        if encoding is None:
+            return response
+
+        compressor = self._create_compressor(encoding)
+        if response.is_streamed:
+            response.response = _compress_chunks(response.response, compressor)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(with_coding(etag, encoding), weak=weak)
+        return response
+
+    def _create_compressor(self, encoding):
+        if encoding == "br":
+            return _BrotliCompressor(self.level)
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+
+
+class _BrotliCompressor:
+    # Same interface as zlib compression objects
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, mode=None):
+        if mode == zlib.Z_SYNC_FLUSH:
+            return self._compressor.flush()
+        return self._compressor.finish()
+
+
+def _compress_chunks(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            # Every chunk is flushed, so the client receives rows as they are read from the database
+            compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()  # e.g. ends database session of stream_with_context
@@ -0,0 +1,86 @@
+import hashlib
+from flask import abort, current_app, request
+from werkzeug.datastructures import ETags
+
+# ============================================================
+# 🏷️ ETAGS AND CONDITIONAL REQUESTS
+# ============================================================
+# ETags are built from version counters (e.g. per-user tasks version), so they
+# can be compared before any resource row is loaded or serialized. Conditional
+# updates also bump the version only if it is still the one compared, so of two
+# clients holding the same ETag only the first one succeeds.
+
+MODIFIED_MESSAGE = "Resource was modified by another request."
+CONTENT_CODINGS = ("gzip", "br")  # compressed responses have ETag of identity response with suffix of coding
+
+
+def make_etag(*parts):
+    """Return strong ETag value (without quotes) built from resource name and versions."""
+    return "-".join(str(part) for part in parts)
+
+
+def with_coding(etag, encoding):
+    """Return strong ETag of response compressed with encoding (e.g. task-5-12-gzip)."""
+    return f"{etag}-{encoding}"
+
+
+def query_digest():
+    # Lists with different filters or pages have different bodies
+    query = request.query_string + str(current_app.config["LEGACY_LIST_RESPONSES"]).encode()
+    return hashlib.sha1(query).hexdigest()[:16]
+
+
+def is_not_modified(etag):
+    return _without_coding(request.if_none_match).contains_weak(etag)
+
+
+def not_modified_response(etag):
+    response = current_app.response_class(status=304)
+    # Same ETag as the cached response, which may be the compressed one
+    cached = request.if_none_match.as_set(include_weak=True)
+    return with_etag(response, next((tag for tag in cached if _strip_coding(tag) == etag), etag))
+
+
+def with_etag(response, etag):
+    # Browser has to revalidate cached copy on every use, which is cheap thanks to ETag
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+
+def check_if_match(etag):
+    """Abort update if client does not hold current version of the resource."""
+    # Strong comparison; ETag of compressed response (see compression.py) is of the same representation
+    if request.if_match and not _without_coding(request.if_match).contains(etag):
+        abort(412, MODIFIED_MESSAGE)
+
+
+def get_expected_version(version):
+    """Return version compared by check_if_match, which the update has to bump, or None for unconditional update."""
+    return version if request.if_match and not request.if_match.star_tag else None
+
+
+def check_version_bumped(updated_rows):
+    """Abort conditional update whose version bump found the version already changed by another request."""
+    if not updated_rows:
+        abort(412, MODIFIED_MESSAGE)
+
+
+def prefers_minimal_response():
+    return "return=minimal" in request.headers.get("Prefer", "")
+
+
+def _strip_coding(etag):
+    for encoding in CONTENT_CODINGS:
+        if etag.endswith(f"-{encoding}"):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def _without_coding(etags):
+    # ETags of request header with ETags of compressed responses replaced by the ones of identity responses
+    strong_etags = etags.as_set()
+    weak_etags = etags.as_set(include_weak=True) - strong_etags
+    return ETags([_strip_coding(etag) for etag in strong_etags], [_strip_coding(etag) for etag in weak_etags],
+                 etags.star_tag)
@@ -0,0 +1,350 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from http import HTTPStatus
+from jwt import ExpiredSignatureError
+import logging
+from models import RevokedToken, db
+from revocation import token_expiration, user_tokens_key
+import re
+import selectors
+from sqlalchemy import select
+import socket
+import threading
+import time
+from user_views import validate_access
+from werkzeug.exceptions import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 📡 TASK EVENTS STREAM SERVER
+# ============================================================
+# GET /tasks/user/<id>/events is a Server-Sent Events stream, which stays open
+# for as long as the browser tab. Such connections are not served by waitress
+# (each would hold one of its worker threads), but by this small server on its
+# own port: one thread with a selector serves all open streams. It authenticates
+# the request with the same JWT checks as the API, subscribes the connection to
+# the event hub and writes events as they come. A connection whose client does
+# not read (output buffer over the limit) is dropped. Streams live longer than
+# their token, so on every heartbeat those whose token expired or was revoked
+# (e.g. by logout or deletion of the user) are closed; the browser reconnects and gets 401.
+# Checks which read the database (authentication and revocation) run on a small
+# pool of worker threads, so a slow database does not stall events of all streams;
+# their results come back to the selector thread through its wakeup socket.
+
+EVENTS_PATH = re.compile(r"^(?:/api)?/tasks/user/(\d+)/events$")
+MAX_REQUEST_SIZE = 16 * 1024
+REQUEST_TIMEOUT = 10  # seconds to send request headers and be authenticated
+REVOCATION_CHECK_CHUNK = 500  # tokens looked up by one query of revoked tokens
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.request = b""
+        self.output = bytearray()
+        self.subscriber = None
+        self.authenticating = False
+        self.token_jti = None
+        self.token_exp = None  # POSIX timestamp, None for tokens which never expire
+        self.token_user_key = None  # revoked together with all tokens of the user when they are deleted
+        self.closing = False  # close when output is sent
+        self.opened_at = time.monotonic()
+
+
+class EventServer:
+    def __init__(self, app, hub, host="0.0.0.0", port=8081, heartbeat=15, max_buffer=256 * 1024, sock=None,
+                 workers=4):
+        self.app = app
+        self.hub = hub
+        self.heartbeat = heartbeat
+        self.max_buffer = max_buffer
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="task-events-check")
+        self._listener = sock or socket.create_server((host, port))
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._ready = set()  # subscribers with new events, filled by publishing threads
+        self._ready_lock = threading.Lock()
+        self._callbacks = []  # results of worker threads to handle in the selector thread, under _ready_lock
+        self._revocation_check = None  # future of the running check, one at a time
+        self._streams = {}  # subscriber -> connection
+        self._event_id = 0
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._listener.getsockname()[1]
+
+    def start(self):
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="task-events-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wake()
+        self._thread.join()
+
+    def _run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat
+        while not self._stopped:
+            for key, mask in self._selector.select(max(next_heartbeat - time.monotonic(), 0)):
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wakeup_reader:
+                    self._handle_wakeup()
+                else:
+                    try:
+                        self._handle_io(key.data, mask)
+                    except Exception:  # one broken connection must not stop the others
+                        logger.exception("Error in task events stream")
+                        self._close(key.data)
+            if time.monotonic() >= next_heartbeat:
+                self._close_unauthorized_streams()
+                self._send_heartbeats()
+                next_heartbeat = time.monotonic() + self.heartbeat
+        self._workers.shutdown(wait=False, cancel_futures=True)
+        for key in list(self._selector.get_map().values()):
+            if isinstance(key.data, _Connection):
+                self._close(key.data)
+        self._selector.close()
+        self._listener.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    # Called by hub from the publishing thread
+    def _notify(self, subscriber):
+        with self._ready_lock:
+            self._ready.add(subscriber)
+        self._wake()
+
+    def _call_soon(self, callback):
+        # Called by worker threads, callback runs in the selector thread
+        with self._ready_lock:
+            self._callbacks.append(callback)
+        self._wake()
+
+    def _run_in_worker(self, function, on_done, *args):
+        future = self._workers.submit(function, *args)
+        future.add_done_callback(lambda future: self._call_soon(lambda: on_done(future)))
+        return future
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # loop is already going to wake up
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _handle_io(self, connection, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = connection.sock.recv(4096)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":  # client went away
+                self._close(connection)
+                return
+            if data and connection.subscriber is None and not connection.authenticating and not connection.closing:
+                connection.request += data
+                self._handle_request(connection)
+        if mask & selectors.EVENT_WRITE:
+            self._flush(connection)
+
+    def _handle_request(self, connection):
+        if b"\r\n\r\n" not in connection.request:
+            if len(connection.request) > MAX_REQUEST_SIZE:
+                self._respond_error(connection, 431, "Request headers too large.")
+            return
+        head = connection.request.split(b"\r\n\r\n", 1)[0].decode("latin-1")
+        request_line, *header_lines = head.split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            self._respond_error(connection, 400, "Invalid request.")
+            return
+        path = target.split("?", 1)[0]
+        match = EVENTS_PATH.match(path)
+        if method != "GET" or match is None:
+            self._respond_error(connection, 404, "Not found.")
+            return
+        headers = [tuple(part.strip() for part in line.split(":", 1)) for line in header_lines if ":" in line]
+        user_id = int(match.group(1))
+        connection.authenticating = True
+        self._run_in_worker(self._authenticate, lambda future: self._open_stream(connection, user_id, future),
+                            path, headers, user_id)
+
+    def _open_stream(self, connection, user_id, future):
+        connection.authenticating = False
+        if connection.sock.fileno() == -1:  # closed by client or request timeout meanwhile
+            return
+        error, token = future.result()
+        if error:
+            self._respond_error(connection, *error)
+            return
+
+        connection.token_jti, connection.token_exp = token["jti"], token.get("exp")
+        connection.token_user_key = user_tokens_key(token["sub"])
+        connection.subscriber = self.hub.subscribe(user_id, self._notify)
+        self._streams[connection.subscriber] = connection
+        self._send(connection, b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                               b"X-Accel-Buffering: no\r\nConnection: keep-alive\r\n\r\nretry: 3000\n\n")
+
+    def _authenticate(self, path, headers, user_id):
+        """Return (None, token claims) if request may read events of user, otherwise ((status, message), None)."""
+        # Same checks as endpoints of the API: token (header or cookie), revocation and access
+        with self.app.test_request_context(path, headers=headers):
+            try:
+                verify_jwt_in_request()
+                validate_access(user_id)
+                return None, get_jwt()
+            except HTTPException as error:
+                return (error.code, error.description), None
+            except ExpiredSignatureError:
+                return (401, "Token has expired"), None
+            except Exception as error:  # missing, invalid or revoked token
+                return (401, str(error) or "Invalid token."), None
+
+    def _close_unauthorized_streams(self):
+        # Expiration is in the token, revocation is read from the primary database (not from the cache of
+        # revoked tokens, whose negative entries would keep a revoked stream open for their TTL) by a worker
+        now = time.time()
+        for connection in list(self._streams.values()):
+            if connection.token_exp is not None and connection.token_exp <= now:
+                self._close(connection)
+        connections = list(self._streams.values())
+        if not connections or self._revocation_check is not None:  # previous check is still waiting for database
+            return
+        keys = sorted({key for connection in connections for key in (connection.token_jti, connection.token_user_key)})
+        self._revocation_check = self._run_in_worker(
+            self._read_revocations, lambda future: self._close_revoked_streams(connections, future), keys)
+
+    def _read_revocations(self, keys):
+        """Return {jti or user key: expiration of revocation} of revoked keys, None if database failed."""
+        revoked = {}
+        try:
+            with self.app.app_context():
+                for start in range(0, len(keys), REVOCATION_CHECK_CHUNK):
+                    chunk = keys[start:start + REVOCATION_CHECK_CHUNK]
+                    revoked.update(db.session.execute(select(RevokedToken.jti, RevokedToken.exp)
+                                                      .where(RevokedToken.jti.in_(chunk))).all())
+        except Exception:  # streams stay open until the database answers again
+            logger.exception("Failed to check revoked tokens of task event streams")
+            return None
+        return revoked
+
+    def _close_revoked_streams(self, connections, future):
+        self._revocation_check = None
+        revoked = future.result()
+        if revoked is None:
+            return
+        for connection in connections:
+            if _is_stream_revoked(connection, revoked):
+                self._close(connection)
+
+    def _respond_error(self, connection, status, message):
+        body = self.app.json.dumps({"error": message}).encode()
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        connection.closing = True
+        self._send(connection, head.encode() + body)
+
+    def _handle_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        with self._ready_lock:
+            ready, self._ready = self._ready, set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error in task events stream")
+        self._send_ready_events(ready)
+
+    def _send_ready_events(self, ready):
+        for subscriber in ready:
+            connection = self._streams.get(subscriber)
+            if connection is None:
+                continue
+            chunks = []
+            for event_type, data in subscriber.pop_events():
+                self._event_id += 1
+                chunks.append(f"id: {self._event_id}\nevent: {event_type}\ndata: {data}\n\n")
+            if subscriber.evicted:  # client should reconnect and catch up with delta sync
+                chunks.append("event: evicted\ndata: {}\n\n")
+                connection.closing = True
+            self._send(connection, "".join(chunks).encode())
+
+    def _send_heartbeats(self):
+        now = time.monotonic()
+        for key in list(self._selector.get_map().values()):
+            connection = key.data
+            if not isinstance(connection, _Connection):
+                continue
+            if connection.subscriber is not None:
+                self._send(connection, b": ping\n\n")  # keeps proxies from closing idle stream
+            elif now - connection.opened_at > REQUEST_TIMEOUT and not connection.closing:
+                self._close(connection)
+
+    def _send(self, connection, data):
+        connection.output += data
+        if len(connection.output) > self.max_buffer:  # client does not read, drop it
+            logger.info("Dropped slow event stream client of user %s", connection.subscriber and
+                        connection.subscriber.user_id)
+            self._close(connection)
+            return
+        self._flush(connection)
+
+    def _flush(self, connection):
+        if connection.sock.fileno() == -1:
+            return
+        try:
+            sent = connection.sock.send(connection.output) if connection.output else 0
+            del connection.output[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(connection)
+            return
+        if connection.closing and not connection.output:
+            self._close(connection)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.output else 0)
+        self._selector.modify(connection.sock, events, connection)
+
+    def _close(self, connection):
+        if connection.sock.fileno() == -1:
+            return
+        if connection.subscriber is not None:
+            self.hub.unsubscribe(connection.subscriber)
+            self._streams.pop(connection.subscriber, None)
+        self._selector.unregister(connection.sock)
+        connection.sock.close()
+
+
+def _is_stream_revoked(connection, revoked):
+    # revoked: {jti or user key: expiration of revocation}; the user revocation covers tokens issued before it
+    if connection.token_jti in revoked:
+        return True
+    user_revoked_until = revoked.get(connection.token_user_key)
+    return user_revoked_until is not None and \
+        (connection.token_exp is None or token_expiration({"exp": connection.token_exp}) <= user_revoked_until)
@@ -0,0 +1,147 @@
+from collections import deque
+import json
+import logging
+from per_process import PerProcess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 0.5  # seconds before the first attempt to subscribe again to Redis
+RECONNECT_MAX_DELAY = 30
+
+# ============================================================
+# 📣 TASK EVENTS
+# ============================================================
+# Writers publish task events after commit. The broker passes them to the hub
+# of every API process: LocalBroker within one process, RedisBroker (pub/sub)
+# between processes. The hub fans events out to subscribers of the user
+# (open event streams). Every subscriber has a bounded queue; a subscriber
+# which does not keep up is evicted instead of making the queue grow, and its
+# client reconnects and catches up using /tasks/user/<id>/changes.
+
+
+class Subscriber:
+    def __init__(self, user_id, max_queue, notify):
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.queue = deque()  # (event type, JSON data)
+        self.evicted = False
+        self.notify = notify  # called (from publishing thread) when queue changes
+
+    def pop_events(self):
+        events = []
+        while self.queue:
+            events.append(self.queue.popleft())
+        return events
+
+
+class EventHub:
+    def __init__(self, broker, max_queue):
+        self.broker = broker
+        self.max_queue = max_queue
+        self._subscribers = {}  # user id -> set of subscribers
+        self._lock = threading.Lock()
+        # Started on first use in every process, as threads of broker do not survive fork of server workers
+        self._broker_started = PerProcess(lambda: self.broker.start(self.deliver))
+
+    def subscribe(self, user_id, notify):
+        self._broker_started.get()
+        subscriber = Subscriber(user_id, self.max_queue, notify)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.user_id]
+
+    def publish(self, user_id, event_type, data):
+        """Send event to subscribers of user in all processes; data has to be JSON string."""
+        try:
+            self._broker_started.get()
+            self.broker.publish(int(user_id), event_type, data)
+        except Exception:  # the write is already committed, a lost event is caught up by delta sync
+            logger.exception("Failed to publish %s event", event_type)
+
+    def deliver(self, user_id, event_type, data):
+        """Fan out event to subscribers of user in this process."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            if len(subscriber.queue) >= subscriber.max_queue:
+                subscriber.evicted = True  # slow consumer
+                self.unsubscribe(subscriber)
+            else:
+                subscriber.queue.append((event_type, data))
+            subscriber.notify(subscriber)
+
+    def subscribers_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class LocalBroker:
+    """Broker delivering events only to subscribers in this process."""
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, user_id, event_type, data):
+        self._deliver(user_id, event_type, data)
+
+
+class RedisBroker:
+    """Broker sharing events between API processes through Redis pub/sub (requires redis package)."""
+
+    def __init__(self, url, channel="todolist:task-events"):
+        import redis  # optional dependency, needed only with TODOLIST_EVENTS_REDIS_URL
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def start(self, deliver):
+        pubsub = self._subscribe()  # before the first publish of this process
+        threading.Thread(target=self._listen, args=(pubsub, deliver), name="task-events-redis", daemon=True).start()
+
+    def _subscribe(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        return pubsub
+
+    def _listen(self, pubsub, deliver):
+        # Subscribes again after a lost connection, waiting twice as long after every failed attempt (up to
+        # RECONNECT_MAX_DELAY); events published in the meantime are caught up by clients with delta sync
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self._subscribe()
+                for message in pubsub.listen():
+                    delay = RECONNECT_DELAY
+                    try:
+                        user_id, event_type, data = json.loads(message["data"])
+                    except (ValueError, TypeError):
+                        logger.warning("Ignored malformed task event: %r", message["data"])
+                        continue
+                    deliver(user_id, event_type, data)
+            except Exception:
+                logger.exception("Task events subscription failed, subscribing again in %s s", delay)
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass  # connection is already broken
+                pubsub = None
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def publish(self, user_id, event_type, data):
+        self.client.publish(self.channel, json.dumps([user_id, event_type, data]))
+
+
+def create_broker(redis_url):
+    return RedisBroker(redis_url) if redis_url else LocalBroker()
@@ -0,0 +1,49 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from per_process import PerProcess
+import threading
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# ============================================================
+# 🔑 PASSWORD HASHING
+# ============================================================
+# Password hashes are deliberately slow and CPU-bound. They are computed in
+# a separate pool of processes, so a login storm does not hold the GIL of the
+# threads serving other requests. Number of hashes waiting or running at once
+# is bounded; above that limit requests fail fast with 503 and Retry-After.
+
+
+class PasswordHasher:
+    def __init__(self, method, workers, max_pending, retry_after):
+        self.method = method
+        self.workers = workers  # 0 computes hashes in the calling thread
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Spawned on first use in every process, as pools do not survive fork of server workers
+        self._executor = PerProcess(lambda: ProcessPoolExecutor(max_workers=self.workers,
+                                                                mp_context=multiprocessing.get_context("spawn")))
+        self._method_prefix = None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Check if hash was made with other method or work factor than the configured one."""
+        if self._method_prefix is None:
+            # Method with all parameters filled in by werkzeug, e.g. "scrypt:32768:8:1"
+            self._method_prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return password_hash.split("$", 1)[0] != self._method_prefix
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailable("Server is busy, try again later.", retry_after=self.retry_after)
+        try:
+            if self.workers == 0:
+                return function(*args)
+            return self._executor.get().submit(function, *args).result()
+        finally:
+            self._slots.release()
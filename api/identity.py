@@ -0,0 +1,38 @@
+import time
+
+# ============================================================
+# 🔐 AUTHORIZATION VERSION CACHE
+# ============================================================
+# Access tokens carry user role and authorization version as claims.
+# Every role change bumps the version, so a token is trusted only while its
+# version matches the current one known by this process. Other processes learn
+# about the change only when their entry expires, so a demoted user keeps the
+# old role there for up to the TTL. Tokens claiming the administrator role are
+# trusted for a shorter admin TTL, which bounds that window for admin checks.
+# Account removal deletes the row with the version, so it revokes all tokens of
+# the user instead (revocation.py), and task writes check that the owner exists.
+
+
+class AuthVersionCache:
+    """Process-wide map of user id to current authorization version, with expiring entries."""
+
+    def __init__(self, ttl, admin_ttl=None, max_size=100000):
+        self.ttl = ttl
+        self.admin_ttl = ttl if admin_ttl is None else min(admin_ttl, ttl)
+        self.max_size = max_size
+        self._versions = {}
+
+    def get(self, user_id, admin=False):
+        # Return cached version or None if it is unknown or older than the TTL (the admin TTL for admin claims)
+        entry = self._versions.get(user_id)
+        if entry is None or time.monotonic() - entry[1] > (self.admin_ttl if admin else self.ttl):
+            return None
+        return entry[0]
+
+    def set(self, user_id, version):
+        if len(self._versions) >= self.max_size:
+            self._versions.clear()
+        self._versions[user_id] = (version, time.monotonic())
+
+    def discard(self, user_id):
+        self._versions.pop(user_id, None)
@@ -0,0 +1,62 @@
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson  # optional, several times faster than json module
+except ImportError:
+    orjson = None
+
+# ============================================================
+# 🧾 JSON SERIALIZATION
+# ============================================================
+# All responses, streamed lists and task events are serialized by the JSON
+# provider of the app (app.json). Dates are written in ISO 8601 format
+# (e.g. "2025-03-20T12:00:00"), which browsers and the API itself can parse,
+# instead of the HTTP date format of Flask's default provider. When orjson is
+# installed it encodes dates natively, otherwise the json module is used.
+
+
+def iso_default(value):
+    """Serialize values unsupported by JSON encoder, dates in ISO format."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+class ISOJSONProvider(DefaultJSONProvider):
+    """Default Flask JSON provider writing dates in ISO format."""
+
+    default = staticmethod(iso_default)
+
+
+class OrjsonProvider(ISOJSONProvider):
+    """JSON provider using orjson; calls with json module options fall back to ISOJSONProvider."""
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=iso_default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:  # e.g. indent, only supported by json module
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)  # errors are ValueError, like in json module
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)  # pretty printed
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+
+def get_json_provider_class():
+    return OrjsonProvider if orjson is not None else ISOJSONProvider
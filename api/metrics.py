@@ -0,0 +1,273 @@
+import atexit
+from contextlib import contextmanager
+from flask import request
+import glob
+import json
+import os
+import threading
+import time
+try:
+    import fcntl  # POSIX only, where the prefork server runs
+except ImportError:
+    fcntl = None
+
+# ============================================================
+# 📈 REQUEST METRICS
+# ============================================================
+# Every thread records its requests in its own shard, so the hot path takes no
+# lock. Shards are summed only when metrics are scraped. When TODOLIST_METRICS_DIR
+# is set, each process also saves its totals there every few seconds, and
+# /metrics of any process reports the sum over all processes serving the app.
+# Counters of finished processes are folded into one file of retired processes,
+# so files do not pile up as workers are recycled.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class _Shard:
+    def __init__(self):
+        self.requests = {}  # (blueprint, route, method, status) -> count
+        self.latency = {}  # (blueprint, route, method) -> [bucket counts..., sum, count]
+        self.size = {}  # (blueprint, route, method) -> [bucket counts..., sum, count]
+        self.in_flight = 0
+
+
+def _observe(histograms, key, buckets, value):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(buckets) + 2)
+    for position, bound in enumerate(buckets):
+        if value <= bound:
+            histogram[position] += 1
+            break
+    histogram[-2] += value
+    histogram[-1] += 1
+
+
+def _add_histograms(total, histograms):
+    for key, histogram in histograms.items():
+        current = total.setdefault(key, [0] * len(histogram))
+        for position, value in enumerate(histogram):
+            current[position] += value
+
+
+class RequestMetrics:
+    def __init__(self, metrics_dir=None, flush_interval=5, collect=None):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        # Returns {name: (type, help, value)} of other metrics of this process, called in app context
+        self.collect = collect or (lambda: {})
+        self._collected = {}
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+            atexit.register(self.flush)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._shards_lock:  # once per thread
+                self._shards.append(shard)
+        return shard
+
+    def _before_request(self):
+        request.environ["todolist.started_at"] = time.perf_counter()
+        self._shard().in_flight += 1
+
+    def _after_request(self, response):
+        started_at = request.environ.get("todolist.started_at")
+        if started_at is None:
+            return response
+        rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+        key = (request.blueprint or "", rule, request.method)
+        shard = self._shard()
+        requests_key = key + (str(response.status_code),)
+        shard.requests[requests_key] = shard.requests.get(requests_key, 0) + 1
+        _observe(shard.latency, key, LATENCY_BUCKETS, time.perf_counter() - started_at)
+        _observe(shard.size, key, SIZE_BUCKETS, response.content_length or 0)  # streamed bodies count as 0
+        if self.metrics_dir and time.monotonic() - self._flushed_at > self.flush_interval:
+            self._flushed_at = time.monotonic()
+            self._collected = self.collect()
+            self.flush()
+        return response
+
+    def _teardown_request(self, error):
+        # Removed, so a teardown repeated for the same request does not count it twice
+        if request.environ.pop("todolist.started_at", None) is not None:
+            self._shard().in_flight -= 1
+
+    def snapshot(self):
+        """Return totals of this process, summed over all thread shards."""
+        while True:
+            try:
+                requests, latency, size, in_flight = {}, {}, {}, 0
+                for shard in list(self._shards):
+                    for key, count in list(shard.requests.items()):
+                        requests[key] = requests.get(key, 0) + count
+                    _add_histograms(latency, dict(shard.latency))
+                    _add_histograms(size, dict(shard.size))
+                    in_flight += shard.in_flight
+                return {"requests": requests, "latency": latency, "size": size, "in_flight": in_flight,
+                        "other": dict(self._collected)}
+            except RuntimeError:  # shard got a new key during iteration, try again
+                continue
+
+    def flush(self):
+        """Save totals of this process for other processes serving the app."""
+        _write_saved(self._path(os.getpid()), _to_saved(self.snapshot()))
+
+    def aggregate(self):
+        """Return totals of all processes (only this one when metrics directory is not set)."""
+        self._collected = self.collect()
+        total = self.snapshot()
+        if not self.metrics_dir:
+            return total
+        with self._files_lock():
+            for path in glob.glob(os.path.join(self.metrics_dir, "metrics-*.json")):
+                name = os.path.basename(path)[len("metrics-"):-len(".json")]
+                if name == str(os.getpid()):
+                    continue
+                data = _read_saved(path)
+                if data is not None:
+                    # Counters of finished processes stay, their gauges do not
+                    _add_saved(total, data, alive=name != "retired" and _is_alive(int(name)))
+        return total
+
+    def retire_process(self, pid):
+        """Fold saved totals of a finished process into the file of retired processes and remove its file.
+
+        The server parent calls it for every worker it reaps, before a new worker can reuse the pid.
+        """
+        if not self.metrics_dir:
+            return
+        path = self._path(pid)
+        with self._files_lock(exclusive=True):
+            data = _read_saved(path)
+            if data is None:
+                return
+            total = {"requests": {}, "latency": {}, "size": {}, "in_flight": 0, "other": {}}
+            retired = _read_saved(self._path("retired"))
+            if retired is not None:
+                _add_saved(total, retired, alive=False)
+            _add_saved(total, data, alive=False)
+            _write_saved(self._path("retired"), _to_saved(total))
+            os.remove(path)
+
+    def retire_finished_processes(self):
+        """Retire files left by processes which are not running, e.g. by a previous run of the server."""
+        for path in glob.glob(os.path.join(self.metrics_dir or "", "metrics-*.json")):
+            name = os.path.basename(path)[len("metrics-"):-len(".json")]
+            if name != "retired" and not _is_alive(int(name)):
+                self.retire_process(int(name))
+
+    def _path(self, name):
+        return os.path.join(self.metrics_dir, f"metrics-{name}.json")
+
+    @contextmanager
+    def _files_lock(self, exclusive=False):
+        # Retiring replaces two files, so readers must not see only one of the changes
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.metrics_dir, "metrics.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def render(self):
+        """Return metrics of all processes in Prometheus text format."""
+        total = self.aggregate()
+        lines = [
+            "# HELP todolist_http_requests_total Number of HTTP requests.",
+            "# TYPE todolist_http_requests_total counter",
+        ]
+        for (blueprint, route, method, status), count in sorted(total["requests"].items()):
+            labels = _labels(blueprint=blueprint, route=route, method=method, status=status)
+            lines.append(f"todolist_http_requests_total{{{labels}}} {count}")
+        lines += _render_histogram("todolist_http_request_duration_seconds", "HTTP request latency in seconds.",
+                                   total["latency"], LATENCY_BUCKETS)
+        lines += _render_histogram("todolist_http_response_size_bytes", "HTTP response body size in bytes.",
+                                   total["size"], SIZE_BUCKETS)
+        lines += [
+            "# HELP todolist_http_requests_in_flight Number of HTTP requests being served.",
+            "# TYPE todolist_http_requests_in_flight gauge",
+            f"todolist_http_requests_in_flight {total['in_flight']}",
+        ]
+        for name, (metric_type, help_text, value) in sorted(total["other"].items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _to_saved(total):
+    data = {name: [[list(key), value] for key, value in total[name].items()]
+            for name in ("requests", "latency", "size")}
+    data["in_flight"] = total["in_flight"]
+    data["other"] = total["other"]
+    return data
+
+
+def _read_saved(path):
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_saved(path, data):
+    with open(path + ".tmp", "w") as metrics_file:
+        json.dump(data, metrics_file)
+    os.replace(path + ".tmp", path)
+
+
+def _add_saved(total, data, alive):
+    # Add saved totals of another process; gauges only if it is still running
+    for key, count in data["requests"]:
+        total["requests"][tuple(key)] = total["requests"].get(tuple(key), 0) + count
+    _add_histograms(total["latency"], {tuple(key): value for key, value in data["latency"]})
+    _add_histograms(total["size"], {tuple(key): value for key, value in data["size"]})
+    if alive:
+        total["in_flight"] += data["in_flight"]
+    for name, (metric_type, help_text, value) in data["other"].items():
+        if alive or metric_type == "counter":
+            current = total["other"].get(name, (metric_type, help_text, 0))
+            total["other"][name] = (metric_type, help_text, current[2] + value)
+
+
+def _render_histogram(name, help_text, histograms, buckets):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (blueprint, route, method), histogram in sorted(histograms.items()):
+        labels = _labels(blueprint=blueprint, route=route, method=method)
+        cumulative = 0
+        for bound, count in zip(buckets, histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram[-1]}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram[-2]}")
+        lines.append(f"{name}_count{{{labels}}} {histogram[-1]}")
+    return lines
+
+
+def _labels(**labels):
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for name, value in labels.items()}
+    return ",".join(f'{name}="{value}"' for name, value in escaped.items())
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # process exists, but belongs to another user
+    return True
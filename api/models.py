@@ -1,6 +1,29 @@
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from replicas import RoutingSession
+from sqlalchemy import delete, select
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def utc_now():
+    """Current time as naive UTC datetime (format used in database)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def row_to_dict(row):
+    """Serialize result row of selected columns (e.g. get_serialized_columns) without ORM objects."""
+    return row._asdict()
+
+
+def delete_chunk(connection, model, condition, chunk_size):
+    """Delete up to chunk_size rows of model matching condition, by session or connection; return their number."""
+    # Ids are selected first, as MySQL does not allow LIMIT in subquery of DELETE ... IN
+    ids = connection.scalars(select(model.id).where(condition).order_by(model.id).limit(chunk_size)).all()
+    if ids:
+        connection.execute(delete(model).where(model.id.in_(ids)), execution_options={"synchronize_session": False})
+    return len(ids)
 
-db = SQLAlchemy()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -8,9 +31,21 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     role = db.Column(db.Enum('Administrator', 'User'), default='User')
     password = db.Column(db.String(162), nullable=False)
+    auth_version = db.Column(db.Integer, nullable=False, default=0)  # bumped when role changes
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every account change
+    tasks_version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every write to user's tasks
+    # Task counters for statistics, changed together with tasks_version
+    tasks_total = db.Column(db.Integer, nullable=False, default=0)
+    tasks_done = db.Column(db.Integer, nullable=False, default=0)
+    shard = db.Column(db.Integer, nullable=False, default=0)  # database of user's tasks (see shards.py)
 
     def to_dict(self):
         return {"id": self.id, "username": self.username, "email": self.email, "role": self.role}
+
+    @staticmethod
+    def get_serialized_columns():
+        # Columns of to_dict, for reads that skip loading User objects
+        return User.id, User.username, User.email, User.role
     
     @staticmethod
     def get_editable_fields():
@@ -22,7 +57,21 @@ class Task(db.Model):
     description = db.Column(db.Text)
     done = db.Column(db.Boolean, default=False)
     due_date = db.Column(db.DateTime)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # No foreign key, tasks may be in a shard database. Instead, every write of tasks checks that their owner
+    # exists, when it bumps the owner's version (bump_tasks_version)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    # Set by ORM and Core inserts and updates alike, read by delta sync
+    updated_at = db.Column(db.DateTime, nullable=False, default=utc_now, onupdate=utc_now)
+
+    # Indexes for server-side filtering and sorting of task lists
+    __table_args__ = (
+        db.Index('ix_task_user_done_due_date', 'user_id', 'done', 'due_date'),
+        db.Index('ix_task_user_due_date', 'user_id', 'due_date'),
+        db.Index('ix_task_done_due_date', 'done', 'due_date'),
+        db.Index('ix_task_user_updated_at', 'user_id', 'updated_at'),
+        # Full-text search index on MySQL, SQLite uses FTS5 table instead (see search.py)
+        db.Index('ft_task_title_description', 'title', 'description', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
 
     def to_dict(self):
         return {
@@ -32,10 +81,47 @@ class Task(db.Model):
             "due_date": self.due_date,
             "done": self.done,
         }
+
+    @staticmethod
+    def get_serialized_columns():
+        # Columns of to_dict, for reads that skip loading Task objects
+        return Task.id, Task.title, Task.description, Task.due_date, Task.done
     
     @staticmethod
     def get_editable_fields():
         return {"title", "description", "due_date", "done"}
 
+class TaskTombstone(db.Model):
+    # Record of deleted task, so clients syncing changes learn about the deletion
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=utc_now, index=True)
+
+    __table_args__ = (
+        db.Index('ix_task_tombstone_user_deleted_at', 'user_id', 'deleted_at'),
+    )
+
+class TaskIdSequence(db.Model):
+    # Single row with the next free task id, from which processes reserve blocks of ids when tasks are sharded
+    id = db.Column(db.Integer, primary_key=True)
+    next_id = db.Column(db.BigInteger, nullable=False)
+
 class RevokedToken(db.Model):
     jti = db.Column(db.String(100), primary_key=True)
+    exp = db.Column(db.DateTime, nullable=False, index=True)  # token expiration, after which row can be removed
+
+class UserDeletion(db.Model):
+    # Job deleting user account with their tasks, polled through /users/deletions/<id>
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)  # no foreign key, the job outlives the user
+    requested_by = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.Enum('pending', 'running', 'done', 'failed'), nullable=False, default='pending')
+    tasks_deleted = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {"id": self.id, "user_id": self.user_id, "status": self.status, "tasks_deleted": self.tasks_deleted,
+                "error": self.error, "created_at": self.created_at, "finished_at": self.finished_at}
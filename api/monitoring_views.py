@@ -0,0 +1,43 @@
+from flask import Blueprint, current_app, jsonify
+from models import db
+from pool import get_pool_stats
+
+monitoring_bp = Blueprint('monitoring_bp', __name__)
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ============================================================
+# 🚀 1. API ENDPOINTS (ROUTES)
+# ============================================================
+
+@monitoring_bp.route('/health', methods=['GET'])
+def health():
+    # Liveness check with live statistics of database connection pool
+    return jsonify({"status": "ok", "database_pool": get_pool_stats(db.engine)})
+
+
+@monitoring_bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Request and connection pool metrics of all server processes for Prometheus
+    body = current_app.extensions["metrics"].render()
+    return current_app.response_class(body, mimetype=PROMETHEUS_MIMETYPE)
+
+
+# ============================================================
+# 🔧 2. UTILITIES
+# ============================================================
+
+def get_pool_metrics():
+    """Return connection pool statistics of this process as {name: (type, help, value)}."""
+    stats = get_pool_stats(db.engine)
+    if stats is None:
+        return {}
+    return {
+        "todolist_db_pool_size": ("gauge", "Connections kept open by the pool.", stats["size"]),
+        "todolist_db_pool_checked_out": ("gauge", "Connections in use.", stats["checked_out"]),
+        "todolist_db_pool_overflow": ("gauge", "Connections open above the pool size.", stats["overflow"]),
+        "todolist_db_pool_checkouts_total": ("counter", "Connection checkouts.", stats["checkouts"]),
+        "todolist_db_pool_timeouts_total": ("counter", "Timeouts waiting for a connection.", stats["timeouts"]),
+        "todolist_db_pool_wait_seconds_total": ("counter", "Time spent waiting for a connection.",
+                                                stats["wait_seconds_total"]),
+    }
@@ -0,0 +1,141 @@
+import base64
+import json
+from datetime import datetime
+from flask import abort, current_app, jsonify, request
+import itertools
+from models import db
+from shards import merge_rows
+from sqlalchemy import and_, or_, DateTime, Float
+
+# ============================================================
+# 📄 KEYSET (CURSOR) PAGINATION
+# ============================================================
+# Pages are ordered by a list of key columns, where the last column is always
+# the unique primary key (e.g. [Task.id] or [Task.due_date, Task.id]).
+# The cursor is the key of the last row on the page, so the next page is
+# a range scan that starts right after it, no matter how deep the client is.
+
+
+def paginated_response(statement, serialize, key_columns, descending=False, all_shards=False):
+    """Return JSON response with one page of statement results and cursor of the next page.
+
+    With all_shards the statement runs on all task shards and their rows are merged.
+    """
+    if legacy_list_requested():
+        rows = _fetch(statement.order_by(*_ordering(key_columns, descending)), key_columns, descending, all_shards)
+        return jsonify([serialize(row) for row in rows])
+    rows, next_cursor = keyset_page(statement, key_columns, descending, all_shards)
+    return jsonify({"items": [serialize(row) for row in rows], "next_cursor": next_cursor})
+
+
+def keyset_page(statement, key_columns, descending=False, all_shards=False):
+    """Fetch one page of rows and return it together with the next page cursor (or None).
+
+    Statement has to select all key columns.
+    """
+    after = request.args.get("after")
+    values = decode_cursor(after, key_columns) if after else None
+    rows, last_key = fetch_page(statement, key_columns, values, get_page_limit(), descending, all_shards)
+    return rows, encode_cursor(last_key) if last_key else None
+
+
+def fetch_page(statement, key_columns, after, limit, descending=False, all_shards=False):
+    """Return up to limit rows after key values (or from the start) and key of the last row if more follow."""
+    if after is not None:
+        statement = statement.where(_after_condition(key_columns, after, descending))
+    statement = statement.order_by(*_ordering(key_columns, descending)).limit(limit + 1)
+    rows = _fetch(statement, key_columns, descending, all_shards, limit + 1)
+
+    # One extra row tells if there is anything after this page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, [getattr(rows[-1], column.key) for column in key_columns]
+
+
+def get_page_limit():
+    """Return requested page size, clamped to the server maximum."""
+    raw_limit = request.args.get("limit")
+    if raw_limit is None:
+        return current_app.config["PAGE_SIZE"]
+    try:
+        limit = int(raw_limit)
+    except ValueError:
+        abort(400, "Incorrect limit value. Expected positive integer.")
+    if limit < 1:
+        abort(400, "Incorrect limit value. Expected positive integer.")
+    return min(limit, current_app.config["MAX_PAGE_SIZE"])
+
+
+def legacy_list_requested():
+    # Old clients get the whole list as a bare JSON array when compatibility mode is on
+    return current_app.config["LEGACY_LIST_RESPONSES"] \
+        and "limit" not in request.args and "after" not in request.args
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def load_cursor(cursor, length):
+    """Return list of length JSON values encoded in cursor, or abort with 400."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        abort(400, "Invalid cursor.")
+    if not isinstance(values, list) or len(values) != length:
+        abort(400, "Invalid cursor.")
+    return values
+
+
+def decode_cursor(cursor, key_columns):
+    values = load_cursor(cursor, len(key_columns))
+    try:
+        decoded = []
+        for column, value in zip(key_columns, values):
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif value is not None and isinstance(column.type, Float):  # e.g. rank of search results
+                value = float(value)
+            elif value is not None and not isinstance(value, int):
+                raise ValueError
+            decoded.append(value)
+    except (ValueError, TypeError):
+        abort(400, "Invalid cursor.")
+    if decoded[-1] is None:
+        abort(400, "Invalid cursor.")
+    return decoded
+
+
+def _fetch(statement, key_columns, descending, all_shards, limit=None):
+    # Every shard returns its first rows in key order, the page takes the first of all of them
+    shards = current_app.extensions["shards"]
+    if all_shards and shards.enabled:
+        return list(itertools.islice(merge_rows(shards.scatter(statement), key_columns, descending), limit))
+    return db.session.execute(statement).all()
+
+
+def _ordering(key_columns, descending):
+    return [column.desc() if descending else column.asc() for column in key_columns]
+
+
+def _after_condition(key_columns, values, descending):
+    # Rows strictly after the cursor in (sort column, id) order.
+    # NULLs are the smallest values, which is the default ordering on SQLite and MySQL.
+    *sort_columns, id_column = key_columns
+    *sort_values, last_id = values
+    id_condition = id_column < last_id if descending else id_column > last_id
+    if not sort_columns:
+        return id_condition
+
+    column, value = sort_columns[0], sort_values[0]
+    if value is None:
+        if descending:
+            return and_(column.is_(None), id_condition)
+        return or_(column.is_not(None), and_(column.is_(None), id_condition))
+    tie = and_(column == value, id_condition)
+    if descending:
+        return or_(column < value, column.is_(None), tie)
+    return or_(column > value, tie)
@@ -0,0 +1,28 @@
+import os
+import threading
+
+# ============================================================
+# 🍴 PER-PROCESS RESOURCES
+# ============================================================
+# The prefork server (serve.py) creates the app once and forks workers from it.
+# Threads and process pools do not survive the fork, and state such as a block
+# of reserved task ids must not be shared by the workers that inherit it. Such
+# resources are created on first use in every process, by PerProcess.
+
+
+class PerProcess:
+    """Value created by factory on first use in every process (again after fork)."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
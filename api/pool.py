@@ -0,0 +1,149 @@
+import logging
+import math
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🏊 DATABASE CONNECTION POOL
+# ============================================================
+
+
+def get_server_threads():
+    """Number of waitress worker threads serving requests in one process."""
+    return int(os.getenv("TODOLIST_THREADS", "4"))
+
+
+def get_cpu_count():
+    """Number of CPUs the process may use: the container CPU limit or CPU affinity, not all CPUs of the node."""
+    count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    quota = _get_cgroup_cpu_quota()
+    if quota:
+        count = min(count, max(1, math.ceil(quota)))
+    return count
+
+
+def _get_cgroup_cpu_quota():
+    # CPUs allowed by the cgroup CPU quota (cgroup v2, then v1), None when unlimited or unknown
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as quota_file:
+            quota, period = quota_file.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as quota_file, \
+                open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as period_file:
+            quota, period = int(quota_file.read()), int(period_file.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def parse_database_uris(database_uris):
+    """Return list of comma separated database URIs (e.g. SQLALCHEMY_REPLICA_URIS)."""
+    return [uri.strip() for uri in (database_uris or "").split(",") if uri.strip()]
+
+
+def create_engines(database_uris):
+    """Return engines of additional databases (replicas, shards) with the pool of the primary one.
+
+    They are not Flask-SQLAlchemy binds, as binds would get their own copy of all tables.
+    """
+    return [create_engine(uri, **get_engine_options(uri)) for uri in database_uris]
+
+
+def get_engine_options(database_uri):
+    """Return SQLAlchemy engine options with connection pool configured from environment."""
+    if not database_uri or ":memory:" in database_uri:
+        return {}  # in-memory SQLite has a single shared connection
+    return {
+        "poolclass": MeteredQueuePool,
+        "pool_size": int(os.getenv("TODOLIST_DB_POOL_SIZE", str(get_server_threads()))),
+        "max_overflow": int(os.getenv("TODOLIST_DB_MAX_OVERFLOW", "2")),
+        "pool_timeout": int(os.getenv("TODOLIST_DB_POOL_TIMEOUT", "10")),  # Flask-SQLAlchemy coerces it to int
+        # Connections are replaced before MySQL (or a proxy in front of it) drops them as idle
+        "pool_recycle": int(os.getenv("TODOLIST_DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("TODOLIST_DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+class PoolStats:
+    """Counters of connection pool activity, updated by pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_created = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def increment(self, counter_name):
+        with self._lock:
+            setattr(self, counter_name, getattr(self, counter_name) + 1)
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "connections_created": self.connections_created,
+                "checkouts": self.checkouts,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool which measures how long requests wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        if "_dispatch" in kwargs:
+            return  # recreated pool, listeners were copied from the previous one
+        event.listen(self, "connect", lambda *args: self.stats.increment("connections_created"))
+        event.listen(self, "checkout", lambda *args: self.stats.increment("checkouts"))
+        event.listen(self, "invalidate", lambda *args: self.stats.increment("invalidations"))
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_wait(time.perf_counter() - started, timed_out=True)
+            logger.warning("Timed out waiting for database connection (pool status: %s)", self.status())
+            raise
+        self.stats.record_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # Pool is recreated on engine dispose, statistics survive it
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def get_pool_stats(engine):
+    """Return current statistics of engine connection pool, or None if pool is not metered."""
+    pool = engine.pool
+    if not isinstance(pool, MeteredQueuePool):
+        return None
+    return pool.stats.snapshot(pool)
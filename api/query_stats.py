@@ -0,0 +1,100 @@
+from collections import Counter
+from flask import has_request_context, request
+import logging
+import re
+from sqlalchemy import event
+import time
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔍 SQL QUERY ACCOUNTING
+# ============================================================
+# Every statement run by a request is counted and timed using cursor events of
+# the engines. Requests running more statements than the configured threshold
+# are logged with the repeated statements (typical sign of N+1 queries), and so
+# are statements slower than the threshold. With debug headers enabled,
+# responses carry the numbers in Server-Timing and X-Query-Count. Streamed
+# responses only count statements run before the body started streaming.
+
+STATS_KEY = "todolist.query_stats"
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Return statement with literals and IN lists replaced by placeholders, on one line."""
+    statement = _LITERALS.sub("?", statement)
+    statement = _IN_LISTS.sub("(?, ...)", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+class RequestQueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []  # normalized only when a request is logged
+
+
+class QueryMonitor:
+    def __init__(self, count_threshold, slow_query_ms, debug_headers=False):
+        self.count_threshold = count_threshold  # 0 disables logging of busy requests
+        self.slow_query_seconds = slow_query_ms / 1000  # 0 disables logging of slow statements
+        self.debug_headers = debug_headers
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _before_request(self):
+        request.environ[STATS_KEY] = RequestQueryStats()
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_started_at", []).append(time.perf_counter())
+        if context is not None:
+            context.query_started = True  # read by _handle_error
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_started = False  # errors while fetching rows come with the same context
+        self._record(time.perf_counter() - connection.info["query_started_at"].pop(), statement)
+
+    def _handle_error(self, exception_context):
+        # A failed statement gets no after_cursor_execute, its start is removed here (and it is counted too),
+        # otherwise the stack of the pooled connection would grow with every error
+        context = exception_context.execution_context
+        if not getattr(context, "query_started", False):
+            return  # failed before the statement was sent
+        context.query_started = False
+        started_at = exception_context.connection.info["query_started_at"].pop()
+        self._record(time.perf_counter() - started_at, exception_context.statement)
+
+    def _record(self, elapsed, statement):
+        if self.slow_query_seconds and elapsed > self.slow_query_seconds:
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, normalize_sql(statement))
+        stats = request.environ.get(STATS_KEY) if has_request_context() else None
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+            stats.statements.append(statement)
+
+    def _after_request(self, response):
+        stats = request.environ.get(STATS_KEY)
+        if stats is None:
+            return response
+        if self.count_threshold and stats.count > self.count_threshold:
+            repeated = Counter(normalize_sql(statement) for statement in stats.statements).most_common(3)
+            logger.warning("%s %s ran %d queries (%.1f ms), most repeated: %s", request.method, request.path,
+                           stats.count, stats.seconds * 1000,
+                           "; ".join(f"{count}x {statement}" for statement, count in repeated))
+        if self.debug_headers:
+            response.headers["X-Query-Count"] = str(stats.count)
+            response.headers.add("Server-Timing", f'db;dur={stats.seconds * 1000:.3f};desc="{stats.count} queries"')
+        return response
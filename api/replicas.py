@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+import itertools
+from pool import create_engines
+from sqlalchemy import event
+import threading
+import time
+
+# ============================================================
+# 🪞 READ REPLICAS
+# ============================================================
+# With replica databases configured (SQLALCHEMY_REPLICA_URIS), statements of
+# GET requests are sent to one of the replicas, chosen round-robin per request.
+# Flushes, INSERT/UPDATE/DELETE statements, everything outside GET requests and
+# code wrapped in use_primary() (e.g. the check of revoked tokens) use the primary.
+# A user who has just written something keeps reading from the primary for
+# READ_YOUR_WRITES_WINDOW seconds, so they never see a replica lagging behind
+# their own write. It is tracked in process memory and, for browsers talking
+# to several server processes, in a cookie.
+
+PRIMARY_UNTIL_COOKIE = "todolist_primary_until"
+ROUTE_KEY = "todolist.db_route"
+SHARD_ENGINES_KEY = "todolist.shard_engines"  # session info: engines of task shards used by the transaction
+SHARDS_COMMITTED_KEY = "todolist.shards_committed"  # session info: shard transactions committed before the primary
+
+
+@contextmanager
+def use_primary():
+    """Send statements run inside the block to the primary database."""
+    if not has_request_context():
+        yield
+        return
+    previous = request.environ.get(ROUTE_KEY)
+    request.environ[ROUTE_KEY] = "primary"
+    try:
+        yield
+    finally:
+        request.environ[ROUTE_KEY] = previous
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:  # statements on tasks go to the shard of their user (see shards.py)
+            shards = current_app.extensions.get("shards")
+            shard = shards.get_routed_engine(mapper, clause) if shards else None
+            if shard is not None:
+                self.info.setdefault(SHARD_ENGINES_KEY, set()).add(shard)
+                return shard
+        if bind is None and not self._flushing and not (clause is not None and getattr(clause, "is_dml", False)):
+            router = current_app.extensions.get("replicas") if has_request_context() else None
+            replica = router.get_request_replica() if router else None
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _commit_shards_first(session):
+    # Writers of tasks hold the lock of their user row in the primary until they commit, and a move of tasks
+    # to another shard relies on their shard writes being committed once the lock is released (see shards.py).
+    # The session commits its connections in arbitrary order, so shard transactions are committed here first.
+    # This is not atomic: when the COMMIT of the primary fails afterwards, task writes stay committed in the
+    # shards, while the version and counters of their users and tombstones are rolled back. Such failures
+    # are logged and the counters and versions recounted (see repair_task_owners in task_views.py)
+    if session.in_nested_transaction():
+        return
+    session.flush()  # pending task writes may route to a shard too
+    for engine in session.info.pop(SHARD_ENGINES_KEY, ()):
+        # On the DBAPI connection, as ending the transaction of the session's connection would fail its commit;
+        # the COMMIT the session sends next has nothing left to commit
+        session.connection(bind_arguments={"bind": engine}).connection.driver_connection.commit()
+        session.info[SHARDS_COMMITTED_KEY] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _forget_committed_shards(session):
+    # Kept after a failed commit of the primary, for the repair when the transaction ends
+    session.info.pop(SHARDS_COMMITTED_KEY, None)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _forget_shards(session, transaction):
+    if transaction.parent is None:  # rolled back or committed
+        session.info.pop(SHARD_ENGINES_KEY, None)
+
+
+class ReplicaRouter:
+    def __init__(self, window):
+        self.window = window  # seconds of reading from primary after own write
+        self.engines = []
+        self._cycle = None
+        self._recent_writers = {}  # user id -> monotonic deadline
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.engines = create_engines(app.config["SQLALCHEMY_REPLICA_URIS"])
+        if self.engines:
+            self._cycle = itertools.cycle(range(len(self.engines)))
+            app.after_request(self._after_request)
+
+    def get_request_replica(self):
+        """Return engine of replica used by current request, or None to use the primary."""
+        if self._cycle is None:
+            return None
+        route = request.environ.get(ROUTE_KEY)
+        if route is None:
+            route = request.environ[ROUTE_KEY] = next(self._cycle) if self._reads_from_replica() else "primary"
+        return None if route == "primary" else self.engines[route]
+
+    def _reads_from_replica(self):
+        if request.method not in ("GET", "HEAD"):
+            return False
+        try:
+            if float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0)) > time.time():
+                return False
+        except ValueError:
+            pass
+        identity = _get_identity()
+        if identity is None:
+            return True
+        with self._lock:
+            deadline = self._recent_writers.get(identity)
+        return deadline is None or deadline < time.monotonic()
+
+    def _after_request(self, response):
+        if request.method in ("GET", "HEAD", "OPTIONS") or response.status_code >= 400:
+            return response
+        identity = _get_identity()
+        if identity is not None:
+            now = time.monotonic()
+            with self._lock:
+                if len(self._recent_writers) > 10000:  # forget expired entries now and then
+                    self._recent_writers = {user: deadline for user, deadline in self._recent_writers.items()
+                                            if deadline > now}
+                self._recent_writers[identity] = now + self.window
+        response.set_cookie(PRIMARY_UNTIL_COOKIE, str(time.time() + self.window), max_age=self.window,
+                            httponly=True, samesite="Lax")
+        return response
+
+
+def _get_identity():
+    # Identity of user of current request, if the request has already verified a token
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app
+import hashlib
+import logging
+from models import db, RevokedToken, utc_now
+from per_process import PerProcess
+from replicas import use_primary
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+# ============================================================
+# 🚫 REVOKED TOKENS CACHE
+# ============================================================
+# Every authenticated request asks if its token was revoked. Answers are kept
+# in a bounded LRU cache: revoked tokens until they expire, and not revoked
+# ones (negative entries) for a short TTL. On top of that, a Bloom filter of all
+# revoked and not yet expired tokens is rebuilt periodically from the table (in a
+# background thread, requests use the previous filter meanwhile), so first lookup
+# of a token which was never revoked does not need the database either.
+# Tokens revoked by another process are seen here only after the next rebuild of
+# the filter or expiration of the negative entry, whichever comes later.
+# Deletion of a user revokes all their tokens issued until then by one entry
+# under a user key, which expires when the last of those tokens does.
+
+
+def token_expiration(jwt_payload):
+    """Return token expiration time as naive UTC datetime (format used in database)."""
+    return datetime.fromtimestamp(jwt_payload["exp"], timezone.utc).replace(tzinfo=None)
+
+
+def user_tokens_key(user_id):
+    # Not a valid jti (those are UUIDs), so it never collides with revoked tokens
+    return f"user:{int(user_id)}"
+
+
+def revoke_user_tokens(user_id):
+    """Add revocation of all tokens of user issued until now to the session and return it."""
+    expires = current_app.config["JWT_ACCESS_TOKEN_EXPIRES"]
+    exp = utc_now() + expires if expires else datetime(9999, 12, 31)
+    return db.session.merge(RevokedToken(jti=user_tokens_key(user_id), exp=exp))  # user id may be deleted again
+
+
+def prune_revoked_tokens():
+    """Delete revoked tokens that are already expired and return their number."""
+    result = db.session.execute(db.delete(RevokedToken).where(RevokedToken.exp < utc_now()))
+    db.session.commit()
+    return result.rowcount
+
+
+class BloomFilter:
+    """Set membership test without false negatives, in a fixed number of bits."""
+
+    def __init__(self, items_count, bits_per_item=10, hashes_count=7):
+        self.size = max(items_count * bits_per_item, 64)
+        self.hashes_count = hashes_count
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return [(first + i * second) % self.size for i in range(self.hashes_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationCache:
+    """In-process cache of revoked tokens lookups."""
+
+    def __init__(self, max_size, negative_ttl, bloom_refresh_interval, background=True):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.bloom_refresh_interval = bloom_refresh_interval
+        self.background = background  # False rebuilds the Bloom filter in the calling thread
+        self._entries = OrderedDict()  # jti -> (expiration of revocation or False, entry expiration as monotonic time)
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._bloom_built_at = None
+        # Held by the thread rebuilding the filter; a lock of its own in every process, as the rebuilding
+        # thread does not survive fork of server workers
+        self._bloom_lock = PerProcess(threading.Lock)
+        self._revoked_during_rebuild = None  # tokens revoked here while the table is read for the new filter
+        self._rebuild_thread = None
+
+    def is_token_revoked(self, jwt_payload, check_user=True):
+        """Return True if the token was revoked, by itself or (check_user) by deletion of its user after it was issued."""
+        if self.is_revoked(jwt_payload["jti"]):
+            return True
+        if not check_user:
+            return False
+        user_revoked_until = self.get_revocation(user_tokens_key(jwt_payload["sub"]))
+        # Tokens of a new user who got the id of the deleted one expire later than the revocation
+        return user_revoked_until is not None and \
+            ("exp" not in jwt_payload or token_expiration(jwt_payload) <= user_revoked_until)
+
+    def is_revoked(self, jti):
+        return self.get_revocation(jti) is not None
+
+    def get_revocation(self, jti):
+        """Return expiration of revocation of jti (or user key), or None if it is not revoked."""
+        cached = self._get(jti)
+        if cached is not None:
+            return cached or None
+
+        bloom = self._get_bloom()
+        if bloom is not None and jti not in bloom:
+            self._set(jti, False, self.negative_ttl)
+            return None
+
+        with use_primary():  # a token revoked a moment ago may not have reached replicas yet
+            token = db.session.get(RevokedToken, jti)
+        if token is None:
+            self._set(jti, False, self.negative_ttl)
+            return None
+        self.add(jti, token.exp)
+        return token.exp
+
+    def add(self, jti, exp):
+        """Remember a token (or user key) revoked in this process."""
+        self._set(jti, exp, max((exp - utc_now()).total_seconds(), 0))
+        with self._lock:
+            if self._revoked_during_rebuild is not None:
+                self._revoked_during_rebuild.append(jti)
+            bloom = self._bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+    def _get(self, jti):
+        with self._lock:
+            entry = self._entries.get(jti)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[jti]
+                return None
+            self._entries.move_to_end(jti)
+            return entry[0]
+
+    def _set(self, jti, revoked, ttl):
+        with self._lock:
+            self._entries[jti] = (revoked, time.monotonic() + ttl)
+            self._entries.move_to_end(jti)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_bloom(self):
+        # Return current Bloom filter (None until first built), starting its rebuild when stale
+        if self.bloom_refresh_interval <= 0:
+            return None
+        stale = self._bloom_built_at is None \
+            or time.monotonic() - self._bloom_built_at > self.bloom_refresh_interval
+        if stale and self._bloom_lock.get().acquire(blocking=False):
+            with self._lock:
+                self._revoked_during_rebuild = []
+            if not self.background:
+                self._rebuild_bloom(db.engine)
+                return self._bloom
+            self._rebuild_thread = threading.Thread(target=self._rebuild_bloom, args=(db.engine,),
+                                                    name="revoked-tokens-bloom", daemon=True)
+            self._rebuild_thread.start()
+        return self._bloom
+
+    def _rebuild_bloom(self, engine):
+        # Full scan of the table, so it runs outside requests and on a connection of its own;
+        # expired tokens are skipped here and deleted by the prune-revoked-tokens command
+        try:
+            with engine.connect() as connection:
+                jtis = connection.scalars(db.select(RevokedToken.jti).where(RevokedToken.exp >= utc_now())).all()
+            bloom = BloomFilter(len(jtis))
+            for jti in jtis:
+                bloom.add(jti)
+            with self._lock:
+                for jti in self._revoked_during_rebuild:
+                    bloom.add(jti)
+                self._bloom = bloom
+            self._bloom_built_at = time.monotonic()
+        except Exception:
+            logger.exception("Failed to rebuild Bloom filter of revoked tokens")
+        finally:
+            with self._lock:
+                self._revoked_during_rebuild = None
+            self._bloom_lock.get().release()
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from flask import abort, current_app
+from models import Task, db
+import re
+from sqlalchemy import DDL, Float, column, event, false, func, insert, literal_column, select, table, text, type_coerce
+from sqlalchemy.dialects import mysql
+
+# ============================================================
+# 🔎 FULL-TEXT SEARCH OF TASKS
+# ============================================================
+# Titles and descriptions are searched with an inverted index of the database:
+# a FULLTEXT index of the task table on MySQL (declared in models.py) and an
+# FTS5 external-content table on SQLite, which stores only the index and reads
+# texts from the task table. On SQLite triggers keep the index in sync with
+# every write, including bulk Core statements; MySQL maintains its index itself.
+# All words of the query have to match, as whole words (case and diacritics
+# are ignored). Prefix matching is left out on purpose: a short prefix expands
+# to postings of many words of all users and makes queries hundreds of times slower.
+# The MySQL index cannot be restricted to one user: MATCH reads postings of the
+# words of all users of the database (or shard) and user_id filters the matches
+# afterwards, so the cost of a search grows with the whole task table.
+
+MAX_TERMS = 10
+TITLE_WEIGHT = 10.0  # a match in title counts more than a match in description (SQLite)
+# Words MySQL does not index with default InnoDB settings (innodb_ft_min_token_size and the default stopword
+# list). Required in boolean mode they would match nothing, so they are left out of the query
+MYSQL_MIN_WORD_LENGTH = 3
+MYSQL_STOPWORDS = frozenset([
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how", "i", "in", "is", "it",
+    "la", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "who", "will", "with", "und",
+    "www",
+])
+
+SQLITE_INSERT_TRIGGER_DDL = (
+    "CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task BEGIN "
+    "INSERT INTO task_fts(rowid, title, description, user_id) VALUES (new.id, new.title, new.description, new.user_id); "
+    "END"
+)
+SQLITE_INDEX_DDL = [
+    # Owner is indexed too, so a query is answered from postings of the user's tasks only
+    "CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5(title, description, user_id, "
+    "content='task', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    SQLITE_INSERT_TRIGGER_DDL,
+    "CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task BEGIN "
+    "INSERT INTO task_fts(task_fts, rowid, title, description, user_id) "
+    "VALUES ('delete', old.id, old.title, old.description, old.user_id); END",
+    # Only changes of indexed columns are reindexed, not e.g. marking task as done
+    "CREATE TRIGGER IF NOT EXISTS task_fts_update AFTER UPDATE OF title, description, user_id ON task BEGIN "
+    "INSERT INTO task_fts(task_fts, rowid, title, description, user_id) "
+    "VALUES ('delete', old.id, old.title, old.description, old.user_id); "
+    "INSERT INTO task_fts(rowid, title, description, user_id) VALUES (new.id, new.title, new.description, new.user_id); "
+    "END",
+]
+
+task_fts = table("task_fts", column("rowid"), column("title"), column("description"), column("user_id"))
+
+for ddl in SQLITE_INDEX_DDL:
+    event.listen(Task.__table__, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+event.listen(Task.__table__, "before_drop", DDL("DROP TABLE IF EXISTS task_fts").execute_if(dialect="sqlite"))
+
+
+def search_tasks_subquery(user_id, query):
+    """Return subquery of serialized columns of tasks of user matching query and their rank (lower is better).
+
+    Results are paginated by (rank, id) columns of the subquery, like other lists.
+    """
+    terms = re.findall(r"\w+", query or "")[:MAX_TERMS]
+    if not terms:
+        abort(400, "Search query is required.")
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        words = " ".join(f'"{term}"' for term in terms)
+        match_query = f'user_id : "{int(user_id)}" AND {{title description}} : ({words})'
+        rank = type_coerce(func.bm25(literal_column("task_fts"), TITLE_WEIGHT, 1.0, 0.0), Float)
+        statement = select(*Task.get_serialized_columns(), rank.label("rank")) \
+            .select_from(task_fts.join(Task, Task.id == task_fts.c.rowid)) \
+            .where(literal_column("task_fts").op("MATCH")(match_query))
+    elif dialect == "mysql":
+        match_query = mysql_boolean_query(terms)
+        relevance = mysql.match(Task.title, Task.description, against=match_query).in_boolean_mode()
+        statement = select(*Task.get_serialized_columns(), (-type_coerce(relevance, Float)).label("rank")) \
+            .where(relevance if match_query else false(), Task.user_id == user_id)
+    else:
+        abort(501, "Search is not supported by the database.")
+    return statement.subquery("results")
+
+
+def mysql_boolean_query(terms):
+    """Return boolean mode query requiring all indexed words of terms (empty if none of them is indexed)."""
+    words = [term for term in terms if len(term) >= MYSQL_MIN_WORD_LENGTH and term.lower() not in MYSQL_STOPWORDS]
+    return " ".join(f"+{word}" for word in words)
+
+
+def serialize_search_result(row):
+    result = row._asdict()
+    del result["rank"]
+    return result
+
+
+@contextmanager
+def bulk_search_indexing(task_ids=None):
+    """Index tasks inserted in the block by one statement at its end, instead of row by row (SQLite).
+
+    FTS5 indexes a set of rows several times faster than the trigger does one row at a time. The trigger
+    is dropped and created again in the transaction of the block, which has to have written already:
+    SQLite DDL is transactional and the write lock keeps out other writers, so they never miss the trigger.
+    Ids of the tasks are needed when they are assigned explicitly (shards), otherwise new rows get greater ids.
+    """
+    if db.engine.dialect.name != "sqlite":
+        yield
+        return
+    if task_ids is None:
+        new_tasks = Task.id > (db.session.scalar(select(func.max(Task.id))) or 0)
+    else:
+        new_tasks = Task.id.in_(task_ids)
+    db.session.execute(text("DROP TRIGGER task_fts_insert"), bind_arguments={"mapper": Task})
+    yield
+    db.session.execute(insert(task_fts).from_select(
+        ["rowid", "title", "description", "user_id"],
+        select(Task.id, Task.title, Task.description, Task.user_id).where(new_tasks)))
+    db.session.execute(text(SQLITE_INSERT_TRIGGER_DDL), bind_arguments={"mapper": Task})
+
+
+def rebuild_search_index():
+    """Create missing search index (e.g. in database created before search) and rebuild it from tasks."""
+    dialect = db.engine.dialect.name
+    shards = current_app.extensions["shards"]
+    for shard in range(shards.count):
+        with shards.get_engine(shard).begin() as connection:
+            if dialect == "sqlite":
+                for ddl in SQLITE_INDEX_DDL:
+                    connection.exec_driver_sql(ddl)
+                connection.exec_driver_sql("INSERT INTO task_fts(task_fts) VALUES ('rebuild')")
+            elif dialect == "mysql":
+                fulltext_index = next(index for index in Task.__table__.indexes
+                                      if index.name == "ft_task_title_description")
+                fulltext_index.create(connection, checkfirst=True)
@@ -0,0 +1,236 @@
+"""Prefork server: the app is created once, then served by several worker processes.
+
+Each worker is a waitress server with its own threads, so CPU-bound work (password
+hashing, JSON encoding) of one worker does not hold the GIL of the others. All
+workers accept connections from the same listening sockets (API and task events),
+which are opened by the parent. The parent restarts workers which exit, whether
+they crashed or were recycled after TODOLIST_MAX_REQUESTS requests. User
+deletions interrupted by a restart are finished by a one-off process at start.
+
+Run from the api directory:
+    python serve.py
+"""
+from app import create_app
+import atexit
+from event_server import EventServer
+import itertools
+import logging
+from models import db
+import os
+from pool import get_cpu_count, get_server_threads
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from user_deletion import resume_user_deletions
+from waitress import create_server
+from waitress.channel import HTTPChannel
+
+logger = logging.getLogger("serve")
+
+DRAIN_TIMEOUT = 30  # seconds for worker to finish requests in progress before it exits
+MIN_WORKER_LIFETIME = 1  # seconds, workers dying faster are restarted with a delay
+
+
+def get_worker_count():
+    # One worker unless task events are shared through a broker, events of a worker reach only its own streams
+    default = get_cpu_count() if os.getenv("TODOLIST_EVENTS_REDIS_URL") else 1
+    return int(os.getenv("TODOLIST_WORKERS", str(default)))
+
+
+def get_max_requests():
+    return int(os.getenv("TODOLIST_MAX_REQUESTS", "0"))
+
+
+# ============================================================
+# 👷 1. WORKER
+# ============================================================
+
+class Worker:
+    def __init__(self, app, api_socket, events_socket, threads, max_requests):
+        self.app = app
+        self.api_socket = api_socket
+        self.events_socket = events_socket
+        self.threads = threads
+        # Workers are recycled at slightly different moments, so they do not restart all at once
+        self.max_requests = max_requests + random.randint(0, max_requests // 10) if max_requests else 0
+        self.server = None
+        self.event_server = None
+        self._draining = threading.Event()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._start_draining)
+        signal.signal(signal.SIGINT, self._start_draining)
+        signal.signal(signal.SIGUSR1, self._exit)
+        self.server = create_server(self._count_requests(self.app), sockets=[self.api_socket], threads=self.threads)
+        if self.events_socket is not None:
+            self.event_server = EventServer(self.app, self.app.extensions["events"], sock=self.events_socket,
+                                            heartbeat=self.app.config["EVENTS_HEARTBEAT"]).start()
+        threading.Thread(target=self._exit_when_drained, name="worker-drain", daemon=True).start()
+        self.server.run()  # returns after SIGUSR1
+
+    def _count_requests(self, app):
+        if not self.max_requests:
+            return app
+        counter = itertools.count(1)
+
+        def counted_app(environ, start_response):
+            if next(counter) == self.max_requests:
+                logger.info("Worker %s served %d requests, recycling", os.getpid(), self.max_requests)
+                os.kill(os.getpid(), signal.SIGTERM)
+            return app(environ, start_response)
+        return counted_app
+
+    def _start_draining(self, signum, frame):
+        # Runs in the main (server loop) thread: stop accepting, other workers take new connections.
+        # The listening socket is shared and stays open, closing it under the running select() fails with EBADF
+        if not self._draining.is_set():
+            self.server.accepting = False
+            self._draining.set()
+
+    def _exit_when_drained(self):
+        self._draining.wait()
+        if self.event_server is not None:
+            self.event_server.stop()  # clients reconnect to another worker
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while not self._is_idle() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+
+    def _is_idle(self):
+        dispatcher = self.server.task_dispatcher
+        if dispatcher.active_count or dispatcher.queue:
+            return False
+        try:
+            channels = [channel for channel in self.server._map.values() if isinstance(channel, HTTPChannel)]
+        except RuntimeError:  # map changed during iteration
+            return False
+        return not any(channel.requests or channel.total_outbufs_len for channel in channels)
+
+    def _exit(self, signum, frame):
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)  # once, a repeated signal must not interrupt exit handlers
+        raise SystemExit(0)  # waitress stops its loop and threads
+
+
+# ============================================================
+# 🏛️ 2. PARENT PROCESS
+# ============================================================
+
+class PreforkServer:
+    def __init__(self, app, host, port, workers, threads, max_requests, events_port=0):
+        self.app = app
+        self.workers_count = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.api_socket = socket.create_server((host, port), backlog=1024)
+        self.events_socket = socket.create_server((host, events_port), backlog=1024) if events_port else None
+        self.workers = {}  # pid -> start time
+        self.jobs = {}  # pid -> name of one-off job
+        self.running = True
+
+    def run(self):
+        if self.workers_count > 1 and self.events_socket is not None and not self.app.config["EVENTS_REDIS_URL"]:
+            logger.warning("Task events reach only streams of the worker which made the change; "
+                           "set TODOLIST_EVENTS_REDIS_URL to share them between workers")
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        metrics = self.app.extensions["metrics"]
+        metrics.retire_finished_processes()
+        for _ in range(self.workers_count):
+            self._spawn_worker()
+        self._spawn_job("resume user deletions", self._resume_user_deletions)
+        while self.workers or self.jobs:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            # Its counters are kept in one file, and a new process with the same pid starts from zero
+            metrics.retire_process(pid)
+            if pid in self.jobs:
+                name = self.jobs.pop(pid)
+                if status:
+                    logger.error("Job %s exited with status %s", name, status)
+                continue
+            started_at = self.workers.pop(pid, None)
+            if started_at is None or not self.running:
+                continue
+            if status:
+                logger.error("Worker %s exited with status %s, restarting", pid, status)
+            if time.monotonic() - started_at < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)  # do not spin when workers crash on start
+            self._spawn_worker()
+        atexit.unregister(metrics.flush)  # the parent served no requests (workers forked before still flush)
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+        exit_code = 0
+        try:
+            Worker(self.app, self.api_socket, self.events_socket, self.threads, self.max_requests).run()
+        except SystemExit as exit:
+            exit_code = exit.code or 0
+        except BaseException:
+            logger.exception("Worker %s failed", os.getpid())
+            exit_code = 1
+        finally:
+            # Never return into the parent's loop; exit handlers (e.g. metrics flush) still run
+            sys.exit(exit_code)
+
+    def _spawn_job(self, name, job):
+        # One-off work of the app in a process of its own, which is not restarted
+        pid = os.fork()
+        if pid:
+            self.jobs[pid] = name
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)  # interrupted work is resumed at the next start
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            with self.app.app_context():
+                job()
+        except BaseException:
+            logger.exception("Job %s failed", name)
+            exit_code = 1
+        finally:
+            sys.exit(exit_code)
+
+    def _resume_user_deletions(self):
+        # Deletions of large accounts run in threads of workers, a restart leaves them unfinished
+        resumed = resume_user_deletions(self.app.extensions["user_deletions"])
+        if resumed:
+            logger.info("Finished %d user deletions interrupted by restart", resumed)
+
+    def _stop(self, signum, frame):
+        self.running = False
+        for pid in [*self.workers, *self.jobs]:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Every worker saves its metrics there, so /metrics of any worker reports all of them
+    os.environ.setdefault("TODOLIST_METRICS_DIR", tempfile.mkdtemp(prefix="todolist-metrics-"))
+    # Every worker starts its own pool of hashing processes, together they should not exceed the CPUs
+    workers = get_worker_count()
+    os.environ.setdefault("TODOLIST_HASHING_WORKERS", str(max(1, get_cpu_count() // workers)))
+    # Tables and the default admin are created here, once, before any worker starts
+    app = create_app()
+    with app.app_context():
+        for engine in [*db.engines.values(), *app.extensions["replicas"].engines, *app.extensions["shards"].engines]:
+            engine.dispose()  # workers open their own connections
+    server = PreforkServer(app, host="0.0.0.0", port=int(os.getenv("TODOLIST_PORT", "80")),
+                           workers=workers, threads=get_server_threads(),
+                           max_requests=get_max_requests(), events_port=app.config["EVENTS_PORT"])
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
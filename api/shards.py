@@ -0,0 +1,288 @@
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from flask import current_app, g
+import hashlib
+import heapq
+import itertools
+from models import Task, TaskIdSequence, TaskTombstone, User, db, delete_chunk
+from per_process import PerProcess
+from pool import create_engines
+from replicas import use_primary
+from sqlalchemy import delete, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+import threading
+from werkzeug.exceptions import ServiceUnavailable
+
+# ============================================================
+# 🧩 TASK SHARDS
+# ============================================================
+# Tasks (with records of deleted tasks and the search index) can be spread by
+# their owner over several databases, shards. Shard 0 is the primary database,
+# shards 1..N are SQLALCHEMY_SHARD_URIS, numbered by their position. The shard
+# of every user is kept in user.shard (the directory); new users are placed by
+# a consistent hash of their id, so a new shard takes over only its share of
+# users, which move-user-tasks and rebalance-task-shards move while they keep
+# working. A request routes statements on task tables to one shard with
+# use_user_shard; only lists and statistics of all tasks (admin) scatter queries
+# to all shards in parallel. Task ids are unique in all shards, as they are
+# reserved in blocks from a sequence in the primary database. Without shards
+# configured everything stays in the primary database and nothing here runs.
+
+SHARDED_TABLES = {"task", "task_tombstone", "task_fts"}
+VIRTUAL_NODES = 100  # points of every shard on the hash ring, for even placement
+
+
+class ShardRouter:
+    def __init__(self, id_block_size=1000):
+        self.id_block_size = id_block_size  # task ids reserved by one process at once
+        self.engines = []  # shards 1..N, shard 0 is the primary database
+        self._ring = []  # sorted (hash, shard) points
+        self._ids = PerProcess(_IdBlock)  # a block reserved before fork would be shared by all workers
+        self._executor = PerProcess(lambda: ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="shard-query"))
+
+    def init_app(self, app):
+        self.engines = create_engines(app.config["SQLALCHEMY_SHARD_URIS"])
+        self._ring = sorted((_hash(f"shard-{shard}-{point}"), shard)
+                            for shard in range(self.count) for point in range(VIRTUAL_NODES))
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    @property
+    def count(self):
+        return len(self.engines) + 1
+
+    def get_engine(self, shard):
+        return self.engines[shard - 1] if shard else db.engine
+
+    def create_all(self):
+        """Create tables of tasks in shard databases."""
+        for engine in self.engines:
+            db.metadata.create_all(engine, tables=[Task.__table__, TaskTombstone.__table__])
+
+    def get_ring_shard(self, user_id):
+        """Return shard of user by consistent hash of their id."""
+        position = bisect.bisect(self._ring, (_hash(f"user-{user_id}"),))
+        return self._ring[position % len(self._ring)][1]
+
+    def get_user_shard(self, user_id):
+        """Return shard of user's tasks from the directory (0 without shards or for unknown user)."""
+        if not self.enabled:
+            return 0
+        with use_primary():  # a replica may not know about a move yet
+            shard = db.session.scalar(select(User.shard).where(User.id == user_id))
+        return shard or 0
+
+    def get_routed_engine(self, mapper, clause):
+        """Return engine of shard routed for statement on task tables, None for the primary database."""
+        if not self.engines:
+            return None
+        table = inspect(mapper).local_table if mapper is not None else getattr(clause, "table", None)
+        if getattr(table, "name", None) not in SHARDED_TABLES:
+            return None
+        shard = g.get("task_shard")
+        if shard is None:  # the statement would read or write tasks of a random shard
+            raise RuntimeError("Statement on tasks is not routed to a shard, see use_user_shard().")
+        return self.engines[shard - 1] if shard else None
+
+    def allocate_task_ids(self, count):
+        """Return list of count new task ids, unique in all shards."""
+        block = self._ids.get()
+        with block.lock:
+            task_ids = []
+            while len(task_ids) < count:
+                if block.next_id == block.end:
+                    block.next_id, block.end = self._reserve_ids(max(self.id_block_size, count - len(task_ids)))
+                taken = min(count - len(task_ids), block.end - block.next_id)
+                task_ids.extend(range(block.next_id, block.next_id + taken))
+                block.next_id += taken
+            return task_ids
+
+    def _reserve_ids(self, size):
+        # Own short transaction, so the sequence row is not locked until the end of the request
+        sequence = TaskIdSequence.__table__
+        for _ in range(2):
+            with db.engine.begin() as connection:
+                if connection.execute(update(sequence).where(sequence.c.id == 1)
+                                      .values(next_id=sequence.c.next_id + size)).rowcount:
+                    end = connection.scalar(select(sequence.c.next_id).where(sequence.c.id == 1))
+                    return end - size, end
+            # The first reservation starts after ids of tasks created before sharding
+            first_id = 1 + max(rows[0][0] or 0 for rows in self.scatter(select(func.max(Task.id))))
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(sequence).values(id=1, next_id=first_id))
+            except IntegrityError:
+                pass  # created by another process at the same time
+        raise RuntimeError("Task id sequence could not be created.")
+
+    def scatter(self, statement):
+        """Run statement on all shards in parallel and return list of rows of every shard."""
+        engines = [self.get_engine(shard) for shard in range(self.count)]  # resolved in app context
+        return list(self._executor.get().map(_fetch_all, engines, itertools.repeat(statement)))
+
+
+class _IdBlock:
+    """Task ids reserved by this process: next_id up to end (exclusive)."""
+
+    def __init__(self):
+        self.next_id = self.end = 0
+        self.lock = threading.Lock()
+
+
+def _hash(key):
+    # Stable in all processes, unlike hash() of str
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def _fetch_all(engine, statement):
+    with engine.connect() as connection:
+        return connection.execute(statement).all()
+
+
+def merge_rows(row_lists, key_columns, descending=False):
+    """Merge lists of rows ordered by key columns into one ordered iterator (NULLs first, as in SQLite and MySQL)."""
+    def get_key(row):
+        return tuple((value is not None, value) for value in (getattr(row, column.key) for column in key_columns))
+    return heapq.merge(*row_lists, key=get_key, reverse=descending)
+
+
+@contextmanager
+def use_shard(shard):
+    """Route statements on task tables run inside the block to the shard."""
+    previous = g.get("task_shard")
+    g.task_shard = shard
+    try:
+        yield
+    finally:
+        g.task_shard = previous
+
+
+def use_user_shard(user_id):
+    """Route statements on task tables to the shard of user for the rest of the request; return the shard."""
+    g.task_shard = current_app.extensions["shards"].get_user_shard(user_id)
+    return g.task_shard
+
+
+def place_new_user(user):
+    """Set shard of user added to the session by consistent hash of their id."""
+    router = current_app.extensions["shards"]
+    if router.enabled:
+        db.session.flush()  # id is assigned by the database
+        user.shard = router.get_ring_shard(user.id)
+
+
+def assign_task_ids(rows):
+    """Set ids of new tasks (dicts of columns) from the sequence shared by shards.
+
+    Without shards the database assigns ids, unless it cannot return ids of rows inserted by executemany
+    (MySQL): then all tasks take ids from the sequence, so autoincrement never hands out a reserved id.
+    """
+    router = current_app.extensions["shards"]
+    if router.enabled or not db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+        for row, task_id in zip(rows, router.allocate_task_ids(len(rows))):
+            row["id"] = task_id
+
+
+def check_user_shards(user_ids):
+    """Fail with 503 if a user was moved to another shard after statements of the request were routed.
+
+    Writers call it after locking the user rows, which a move holds while it switches the shard.
+    """
+    if not current_app.extensions["shards"].enabled:
+        return
+    shards = db.session.scalars(select(User.shard).where(User.id.in_(user_ids))).all()
+    if any(shard != g.get("task_shard") for shard in shards):
+        raise ServiceUnavailable("Tasks of the user are being moved to another database, try again.", retry_after=1)
+
+
+def move_user_tasks(user_id, target, chunk_size=1000):
+    """Move tasks of user to target shard while the user keeps working; return number of moved tasks.
+
+    Tasks are copied in chunks without locks. Then the user row is locked (writers of the user wait),
+    rows changed in the meantime are copied again, and the user is switched to the target. The old
+    copy is deleted in the end. A move interrupted at any point can be run again.
+    """
+    router = current_app.extensions["shards"]
+    if not 0 <= target < router.count:
+        raise ValueError(f"Unknown shard {target}.")
+    source = router.get_user_shard(user_id)
+    if source == target:
+        return 0
+    tasks, tombstones = Task.__table__, TaskTombstone.__table__
+    user_tasks = tasks.c.user_id == user_id
+    with ExitStack() as stack:
+        source_db = stack.enter_context(router.get_engine(source).connect())
+        target_db = stack.enter_context(router.get_engine(target).connect())
+        # The user row is locked and switched in the primary database, by the target connection if it is the
+        # primary too (SQLite allows one writer), so the switch is committed together with the last rows
+        primary_db = target_db if target == 0 else stack.enter_context(db.engine.connect())
+        _delete_user_rows(target_db, Task, user_id, chunk_size)  # left by an interrupted move
+        last_id = 0
+        while True:
+            rows = source_db.execute(select(tasks).where(user_tasks, tasks.c.id > last_id)
+                                     .order_by(tasks.c.id).limit(chunk_size)).mappings().all()
+            source_db.rollback()  # short read transactions, SQLite writers wait for readers
+            if not rows:
+                break
+            target_db.execute(insert(tasks), rows)
+            target_db.commit()
+            last_id = rows[-1]["id"]
+
+        primary_db.execute(update(User.__table__).where(User.id == user_id)
+                           .values(tasks_version=User.tasks_version + 1))
+        versions = select(tasks.c.id, tasks.c.updated_at).where(user_tasks)
+        source_versions = dict(source_db.execute(versions).all())
+        target_versions = dict(target_db.execute(versions).all())
+        stale_ids = [task_id for task_id, updated_at in target_versions.items()
+                     if source_versions.get(task_id) != updated_at]
+        missing_ids = [task_id for task_id, updated_at in source_versions.items()
+                       if target_versions.get(task_id) != updated_at]
+        for chunk in _chunks(stale_ids, chunk_size):
+            target_db.execute(delete(tasks).where(tasks.c.id.in_(chunk)))
+        for chunk in _chunks(missing_ids, chunk_size):
+            rows = source_db.execute(select(tasks).where(tasks.c.id.in_(chunk))).mappings().all()
+            target_db.execute(insert(tasks), rows)
+        # Records of deleted tasks get new ids in the target, their ids are not referenced anywhere
+        tombstone_rows = source_db.execute(select(tombstones.c.task_id, tombstones.c.user_id, tombstones.c.deleted_at)
+                                           .where(tombstones.c.user_id == user_id)).mappings().all()
+        source_db.rollback()
+        target_db.execute(delete(tombstones).where(tombstones.c.user_id == user_id))
+        if tombstone_rows:
+            target_db.execute(insert(tombstones), tombstone_rows)
+        target_db.commit()  # before the switch: if the switch fails, the user stays in the complete source
+        primary_db.execute(update(User.__table__).where(User.id == user_id).values(shard=target))
+        primary_db.commit()
+
+        _delete_user_rows(source_db, Task, user_id, chunk_size)
+        _delete_user_rows(source_db, TaskTombstone, user_id, chunk_size)
+    return len(source_versions)
+
+
+def rebalance_shards(chunk_size=1000):
+    """Move users whose shard differs from their consistent hash placement (e.g. after adding a shard).
+
+    Return number of moved users.
+    """
+    router = current_app.extensions["shards"]
+    users = db.session.execute(select(User.id, User.shard).order_by(User.id)).all()
+    db.session.commit()
+    moved = 0
+    for user_id, shard in users:
+        target = router.get_ring_shard(user_id)
+        if target != shard:
+            move_user_tasks(user_id, target, chunk_size)
+            moved += 1
+    return moved
+
+
+def _delete_user_rows(connection, model, user_id, chunk_size):
+    while delete_chunk(connection, model, model.user_id == user_id, chunk_size):
+        connection.commit()
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
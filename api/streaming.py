@@ -0,0 +1,108 @@
+import csv
+from datetime import datetime
+from flask import current_app, request, stream_with_context
+import io
+from pagination import fetch_page
+
+# ============================================================
+# 🌊 STREAMED LISTS
+# ============================================================
+# Whole-table exports are sent as a JSON array (or NDJSON, CSV) written chunk by chunk.
+# Rows are fetched from the database in keyset pages of STREAM_YIELD_PER rows, so
+# memory used by the request does not depend on the table size. yield_per would
+# not bound it: mysqlconnector has no server-side cursors and buffers whole results.
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+CSV_MIMETYPE = "text/csv"
+CHUNK_SIZE = 64 * 1024  # bytes of JSON sent to the server at once
+
+
+def stream_requested():
+    return request.args.get("stream", "").lower() in ("1", "true") or ndjson_requested()
+
+
+def ndjson_requested():
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def streamed_response(statement, serialize, key_columns, descending=False, mimetype=None, all_shards=False):
+    """Return response streaming all rows of statement as JSON array, NDJSON or CSV.
+
+    Without mimetype the format is chosen by request (NDJSON or JSON array). With all_shards the rows
+    of all task shards are merged into one stream in key order. Statement has to select all key columns.
+    """
+    rows = _stream_rows(statement, key_columns, descending, all_shards, current_app.config["STREAM_YIELD_PER"])
+    if mimetype is None:
+        mimetype = NDJSON_MIMETYPE if ndjson_requested() else "application/json"
+    if mimetype == NDJSON_MIMETYPE:
+        chunks = _ndjson_chunks(rows, serialize)
+    elif mimetype == CSV_MIMETYPE:
+        chunks = _csv_chunks(rows, serialize)
+    else:
+        chunks = _json_array_chunks(rows, serialize)
+    return current_app.response_class(stream_with_context(chunks), mimetype=mimetype)
+
+
+def _stream_rows(statement, key_columns, descending, all_shards, page_size):
+    # Every page starts right after the key of the last row of the previous one
+    after = None
+    while True:
+        rows, after = fetch_page(statement, key_columns, after, page_size, descending, all_shards)
+        yield from rows
+        if after is None:
+            return
+
+
+def _ndjson_chunks(rows, serialize):
+    dumps = current_app.json.dumps
+    return _join_chunks(dumps(serialize(row)) + "\n" for row in rows)
+
+
+def _json_array_chunks(rows, serialize):
+    dumps = current_app.json.dumps
+    yield "["
+    items = (dumps(serialize(row)) for row in rows)
+    first_item = next(items, None)
+    if first_item is not None:
+        yield first_item
+        yield from _join_chunks("," + item for item in items)
+    yield "]"
+
+
+def _csv_chunks(rows, serialize):
+    return _join_chunks(_csv_lines(rows, serialize))
+
+
+def _csv_lines(rows, serialize):
+    # Header from keys of the first item; dates in ISO format and booleans as 0/1, like in JSON
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, row in enumerate(rows):
+        item = serialize(row)
+        if number == 0:
+            writer.writerow(item.keys())
+        writer.writerow([_csv_value(value) for value in item.values()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _join_chunks(parts):
+    # Join small pieces of JSON into chunks of reasonable size
+    buffer, buffered_size = [], 0
+    for part in parts:
+        buffer.append(part)
+        buffered_size += len(part)
+        if buffered_size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, buffered_size = [], 0
+    if buffer:
+        yield "".join(buffer)
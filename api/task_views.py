@@ -1,11 +1,58 @@
-from datetime import datetime
-from flask import Blueprint, jsonify, request, abort
+from collections import Counter, namedtuple
+import csv
+from datetime import datetime, timedelta
+from flask import Blueprint, current_app, jsonify, request, abort
+from etags import check_if_match, check_version_bumped, get_expected_version, is_not_modified, make_etag, \
+    not_modified_response, prefers_minimal_response, query_digest, with_etag
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Task, db
-from user_views import admin_required, validate_access
+import io
+import logging
+from models import Task, TaskTombstone, User, db, row_to_dict, utc_now
+from pagination import decode_cursor, encode_cursor, fetch_page, get_page_limit, load_cursor, paginated_response
+from replicas import SHARDS_COMMITTED_KEY, RoutingSession, use_primary
+from search import bulk_search_indexing, search_tasks_subquery, serialize_search_result
+from shards import assign_task_ids, check_user_shards, use_shard, use_user_shard
+from sqlalchemy import Integer, cast, delete, event, func, insert, literal, select, true, update
+from streaming import CSV_MIMETYPE, NDJSON_MIMETYPE, stream_requested, streamed_response
+from user_views import admin_required, get_logged_user_role, validate_access
+
+logger = logging.getLogger(__name__)
 
 task_bp = Blueprint('task_bp', __name__)
 
+MAX_IMPORT_ERRORS = 1000  # errors listed in import response, the rest is only counted
+TASK_OWNERS_KEY = "todolist.task_owners"  # session info: users whose tasks the transaction changed
+CHANGED_PHASE, DELETED_PHASE = 0, 1  # pages of changes list changed tasks first, then deleted ones
+
+
+class SyncCursor(namedtuple("SyncCursor", ["phase", "last_time", "last_id", "sync_time"])):
+    """Cursor of changes page: phase, key (time, id) of the last row sent and time of the sync.
+
+    The key is None when the next page starts a phase.
+    """
+
+    def encode(self):
+        return encode_cursor(list(self))
+
+    @classmethod
+    def decode(cls, cursor):
+        phase, last_time, last_id, sync_time = load_cursor(cursor, len(cls._fields))
+        if phase not in (CHANGED_PHASE, DELETED_PHASE) or isinstance(phase, bool) \
+                or not (last_id is None or isinstance(last_id, int) and not isinstance(last_id, bool)) \
+                or (last_time is None) != (last_id is None):
+            abort(400, "Invalid cursor.")
+        try:
+            return cls(phase, _parse_cursor_time(last_time) if last_time is not None else None, last_id,
+                       _parse_cursor_time(sync_time))
+        except (ValueError, TypeError):
+            abort(400, "Invalid cursor.")
+
+
+def _parse_cursor_time(value):
+    if not isinstance(value, str):
+        raise TypeError
+    return datetime.fromisoformat(value)
+
 # ============================================================
 # 🚀 1. API ENDPOINTS (ROUTES)
 # ============================================================
@@ -14,25 +61,127 @@ task_bp = Blueprint('task_bp', __name__)
 @jwt_required()
 def get_all_tasks():
     admin_required(get_jwt_identity()) # only admin can get all tasks
-    tasks = Task.query.all()
-    return jsonify([task.to_dict() for task in tasks])
+    tasks = filter_tasks(select(*Task.get_serialized_columns()))
+    if stream_requested():  # export of the whole table
+        return streamed_response(tasks, row_to_dict, *get_task_ordering(), all_shards=True)
+    return paginated_response(tasks, row_to_dict, *get_task_ordering(), all_shards=True)
+
+
+@task_bp.route('/tasks/stats', methods=['GET'])
+@jwt_required()
+def get_all_tasks_stats():
+    admin_required(get_jwt_identity())
+    # Sums of per-user counters, so the cost depends on the number of users, not tasks. A global counter row
+    # would make it O(1), but every task write of every user would then lock the same row
+    totals = select(func.coalesce(func.sum(User.tasks_total), 0), func.coalesce(func.sum(User.tasks_done), 0))
+    return jsonify(get_task_stats(totals, [], all_shards=True))
 
 
 @task_bp.route('/tasks/<int:task_id>', methods=['GET'])
 @jwt_required()
 def get_task(task_id):
-    task = Task.query.get(task_id) # return task or None if task not found
-    check_if_task_exists(task)
-    return jsonify(task.to_dict())
+    use_task_shard(task_id)
+    owner_id, tasks_version = get_task_owner(task_id)
+    validate_access(owner_id)
+    etag = make_etag("task", task_id, tasks_version)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    return with_etag(jsonify(get_serialized_task(task_id)), etag)
 
 
 @task_bp.route('/tasks/user/<int:user_id>', methods=['GET'])
 @jwt_required()
 def get_tasks_by_user(user_id):
     validate_access(user_id)
-    tasks = Task.query.filter_by(user_id=user_id).all()
-    tasks = [task.to_dict() for task in tasks]
-    return jsonify(tasks)
+    use_user_shard(user_id)
+    # Version is read before the list, so the ETag is never newer than the body
+    etag = make_etag("tasks", user_id, get_tasks_version(user_id), query_digest())
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    tasks = filter_tasks(select(*Task.get_serialized_columns()).where(Task.user_id == user_id))
+    return with_etag(paginated_response(tasks, row_to_dict, *get_task_ordering()), etag)
+
+
+@task_bp.route('/tasks/user/<int:user_id>/search', methods=['GET'])
+@jwt_required()
+def search_user_tasks(user_id):
+    # Tasks matching all words of the query, the most relevant first
+    validate_access(user_id)
+    use_user_shard(user_id)
+    etag = make_etag("search", user_id, get_tasks_version(user_id), query_digest())
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    results = search_tasks_subquery(user_id, request.args.get('q'))
+    return with_etag(paginated_response(select(results), serialize_search_result, [results.c.rank, results.c.id]),
+                     etag)
+
+
+@task_bp.route('/tasks/user/<int:user_id>/stats', methods=['GET'])
+@jwt_required()
+def get_user_tasks_stats(user_id):
+    validate_access(user_id)
+    use_user_shard(user_id)
+    totals = select(User.tasks_total, User.tasks_done).where(User.id == user_id)
+    return jsonify(get_task_stats(totals, [Task.user_id == user_id]))
+
+
+@task_bp.route('/tasks/user/<int:user_id>/export', methods=['GET'])
+@jwt_required()
+def export_user_tasks(user_id):
+    # All tasks of user streamed as NDJSON (default) or CSV (?format=csv or Accept: text/csv)
+    validate_access(user_id)
+    use_user_shard(user_id)
+    export_format = request.args.get('format')
+    if export_format is None:
+        export_format = "csv" if request.accept_mimetypes.best == CSV_MIMETYPE else "ndjson"
+    if export_format not in ("ndjson", "csv"):
+        abort(400, "Incorrect format value. Expected one of: ndjson, csv")
+    mimetype = CSV_MIMETYPE if export_format == "csv" else NDJSON_MIMETYPE
+    tasks = select(*Task.get_serialized_columns()).where(Task.user_id == user_id)
+    response = streamed_response(tasks, row_to_dict, [Task.id], mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=tasks-{user_id}.{export_format}"
+    return response
+
+
+@task_bp.route('/tasks/user/<int:user_id>/changes', methods=['GET'])
+@jwt_required()
+def get_task_changes(user_id):
+    # Delta sync in pages: tasks created or modified since the token in (updated_at, id) order, then ids of tasks
+    # deleted since the token in (deleted_at, id) order. The cursor of the next page keeps the sync time
+    validate_access(user_id)
+    use_user_shard(user_id)
+    limit = get_page_limit()
+    since = request.args.get('since')
+    since_time = get_sync_start(since) if since else None  # without token all tasks are returned, as the first sync
+    after = request.args.get('after')
+    if after:
+        phase, last_time, last_id, sync_time = SyncCursor.decode(after)
+        last_key = [last_time, last_id] if last_id is not None else None
+    else:
+        # Sync time is taken before reading, so no change falls between two syncs
+        sync_time, phase, last_key = utc_now(), CHANGED_PHASE, None
+    changed, deleted, next_key = [], [], None
+    if phase == CHANGED_PHASE:
+        tasks = select(*Task.get_serialized_columns(), Task.updated_at).where(Task.user_id == user_id)
+        if since_time is not None:
+            tasks = tasks.where(Task.updated_at >= since_time)
+        rows, next_key = fetch_page(tasks, [Task.updated_at, Task.id], last_key, limit)
+        changed = [{key: value for key, value in row_to_dict(row).items() if key != 'updated_at'} for row in rows]
+        if next_key is None:
+            phase, last_key = DELETED_PHASE, None
+            if since_time is not None and len(changed) == limit:
+                next_key = [None, None]  # deleted tasks start on the next page
+    if phase == DELETED_PHASE and next_key is None and since_time is not None:
+        # SQLite may reuse id of deleted task, the task which exists now wins
+        reused = select(Task.id).where(Task.id == TaskTombstone.task_id, Task.user_id == user_id).exists()
+        tombstones = select(TaskTombstone.task_id, TaskTombstone.deleted_at, TaskTombstone.id).where(
+            TaskTombstone.user_id == user_id, TaskTombstone.deleted_at >= since_time, ~reused)
+        rows, next_key = fetch_page(tombstones, [TaskTombstone.deleted_at, TaskTombstone.id], last_key,
+                                    limit - len(changed))
+        deleted = [row.task_id for row in rows]
+    next_cursor = SyncCursor(phase, *next_key, sync_time).encode() if next_key else None
+    return jsonify({"changed": changed, "deleted": deleted, "has_more": next_cursor is not None,
+                    "next_cursor": next_cursor, "next_token": encode_cursor([sync_time])})
 
 
 @task_bp.route('/tasks', methods=['POST'])
@@ -40,20 +189,54 @@ def get_tasks_by_user(user_id):
 def create_task():
     data = request.get_json()
     validate_task_data(data)
-    due_date = datetime.strptime(data['due_date'], '%Y-%m-%dT%H:%M')
-    task = Task(title=data['title'], description=data['description'], due_date=due_date,
-                done=data['done'], user_id=get_jwt_identity())
+    due_date = parse_due_date(data['due_date'])
+    row = {"title": data['title'], "description": data['description'], "due_date": due_date, "done": data['done'],
+           "user_id": int(get_jwt_identity())}
+    use_user_shard(row['user_id'])
+    assign_task_ids([row])
+    task = Task(**row)
 
+    bump_tasks_version([task.user_id], total_change=1, done_change=int(bool(task.done)))
     db.session.add(task)
     db.session.commit()
+    publish_task_events(task.user_id, "task.created", [task.to_dict()])
     return jsonify(task.to_dict())
 
 
+@task_bp.route('/tasks/import', methods=['POST'])
+@jwt_required()
+def import_tasks():
+    # NDJSON or CSV body is read line by line and inserted in chunks, each in its own transaction
+    user_id = int(get_jwt_identity())
+    use_user_shard(user_id)
+    chunk_size = current_app.config["IMPORT_CHUNK_SIZE"]
+    imported, failed, errors, rows = 0, 0, [], []
+    for line_number, item, error in read_import_items():
+        if error is None:
+            item.pop('id', None)  # exported tasks can be imported again
+            error = get_new_task_error(item)
+        if error:
+            failed += 1
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append({"line": line_number, "error": error})
+            continue
+        rows.append({"title": item['title'], "description": item['description'], "done": bool(item['done']),
+                     "due_date": parse_due_date(item['due_date']), "user_id": user_id})
+        if len(rows) >= chunk_size:
+            imported += insert_imported_tasks(user_id, rows)
+            rows = []
+    imported += insert_imported_tasks(user_id, rows)
+    return jsonify({"imported": imported, "failed": failed, "errors": errors})
+
+
 @task_bp.route('/tasks/<int:task_id>', methods=['PUT', 'PATCH'])
 @jwt_required()
 def update_task(task_id):
-    task = Task.query.get(task_id)
-    check_if_task_exists(task)
+    # Only owner and collection version are read, task row is updated without loading it
+    use_task_shard(task_id)
+    owner_id, tasks_version = get_task_owner(task_id)
+    validate_access(owner_id)
+    check_if_match(make_etag("task", task_id, tasks_version))
 
     request_data = request.get_json()
     validate_task_data(request_data)
@@ -65,31 +248,393 @@ def update_task(task_id):
         if request_fields != editable_fields:
             abort(400, "Invalid request data structure.")
 
+    new_values = {}
     for field_name in editable_fields:
         requested_value = request_data.get(field_name)
         if requested_value is None:
             continue
-        new_value = datetime.strptime(requested_value, '%Y-%m-%dT%H:%M') \
+        new_values[field_name] = parse_due_date(requested_value) \
             if field_name == 'due_date' else requested_value
-        setattr(task, field_name, new_value)
+    if new_values:
+        changed_done = ([task_id], int(bool(new_values['done']))) if 'done' in new_values else None
+        # Before update, which changes done; conditional on the version compared with If-Match
+        bump_tasks_version([owner_id], changed_done=changed_done, expected_version=get_expected_version(tasks_version))
+        db.session.execute(update(Task).where(Task.id == task_id).values(new_values),
+                           execution_options={"synchronize_session": False})
+    etag = make_etag("task", task_id, get_tasks_version(owner_id))
     db.session.commit()
-    return jsonify(task.to_dict())
+    if new_values:
+        publish_task_events(owner_id, "task.updated", [{"id": task_id, **new_values}])
+
+    if prefers_minimal_response():
+        return with_etag(current_app.response_class(status=204), etag)
+    return with_etag(jsonify(get_serialized_task(task_id)), etag)
 
 
 @task_bp.route('/tasks/<int:task_id>', methods=['DELETE'])
 @jwt_required()
 def delete_task(task_id):
-    task = Task.query.get(task_id)
+    use_task_shard(task_id)
+    task = db.session.get(Task, task_id)
     check_if_task_exists(task)
+    bump_tasks_version([task.user_id], total_change=-1, changed_done=([task_id], 0))
     db.session.delete(task)
+    add_task_tombstones({task.id: task.user_id})
     db.session.commit()
+    publish_task_events(task.user_id, "task.deleted", [{"id": task_id}])
     return jsonify({})
 
 
+@task_bp.route('/tasks/batch', methods=['POST'])
+@jwt_required()
+def create_tasks_batch():
+    items = get_batch_items()
+    user_id = int(get_jwt_identity())
+    use_user_shard(user_id)
+    results, rows, created_positions = [], [], []
+    for position, item in enumerate(items):
+        error = get_new_task_error(item)
+        if error:
+            results.append({"status": 400, "error": error})
+            continue
+        rows.append({"title": item['title'], "description": item['description'], "done": bool(item['done']),
+                     "due_date": parse_due_date(item['due_date']), "user_id": user_id})
+        results.append(None)
+        created_positions.append(position)
+
+    assign_task_ids(rows)
+    if rows:
+        bump_tasks_version([user_id], total_change=len(rows), done_change=sum(row['done'] for row in rows))
+    task_ids = insert_tasks(rows)
+    db.session.commit()
+    for position, row, task_id in zip(created_positions, rows, task_ids):
+        task = Task(**dict(row, id=task_id))
+        results[position] = {"status": 201, "task": task.to_dict()}
+    publish_task_events(user_id, "task.created", [results[position]["task"] for position in created_positions])
+    return jsonify({"results": results})
+
+
+@task_bp.route('/tasks/batch', methods=['PATCH'])
+@jwt_required()
+def update_tasks_batch():
+    items = get_batch_items()
+    ids = Counter(item['id'] for item in items if isinstance(item, dict) and is_task_id(item.get('id')))
+    owners, access_errors = check_batch_access(list(ids))
+    results, changes = [], {}
+    for item in items:
+        if not isinstance(item, dict) or not is_task_id(item.get('id')):
+            results.append({"status": 400, "error": "Invalid request data structure."})
+            continue
+        task_id = item['id']
+        status, error = access_errors.get(task_id, (400, None))
+        if error is None:
+            if ids[task_id] > 1:
+                error = "Task id occurs more than once in the batch."
+            elif not set(item.keys()) - {'id'} <= Task.get_editable_fields():
+                error = "Invalid request data structure."
+            else:
+                error = get_task_data_error(item)
+        if error:
+            results.append({"id": task_id, "status": status, "error": error})
+            continue
+        values = {field_name: parse_due_date(value) if field_name == 'due_date' else value
+                  for field_name, value in item.items() if field_name != 'id' and value is not None}
+        if values:
+            # Tasks which get the same fields changed are updated by one executemany statement
+            changes.setdefault(tuple(sorted(values)), {})[task_id] = values
+        results.append({"id": task_id, "status": 200})
+
+    # Counters are changed before tasks, as changes of done count are computed from current values
+    new_done = {}  # owner id -> {task id: new done value}
+    for task_values in changes.values():
+        for task_id, values in task_values.items():
+            owner_done = new_done.setdefault(owners[task_id], {})
+            if 'done' in values:
+                owner_done[task_id] = int(bool(values['done']))
+    shards = get_owner_shards(new_done)
+    for owner_id, owner_done in sorted(new_done.items()):
+        with use_shard(shards[owner_id]):
+            changed_done = (list(owner_done), sum(owner_done.values())) if owner_done else None
+            bump_tasks_version([owner_id], changed_done=changed_done)
+    for task_values in changes.values():
+        for shard, shard_task_ids in group_by_shard(list(task_values), owners, shards).items():
+            with use_shard(shard):  # bulk update by primary key
+                db.session.execute(update(Task), [{"id": task_id, **task_values[task_id]} for task_id in shard_task_ids])
+    db.session.commit()
+    for task_values in changes.values():
+        for task_id, values in task_values.items():
+            publish_task_events(owners[task_id], "task.updated", [{"id": task_id, **values}])
+    return jsonify({"results": results})
+
+
+@task_bp.route('/tasks/batch', methods=['DELETE'])
+@jwt_required()
+def delete_tasks_batch():
+    items = get_batch_items()
+    owners, access_errors = check_batch_access(items)
+    ids = Counter(task_id for task_id in items if is_task_id(task_id))
+    results, task_ids = [], []
+    for task_id in items:
+        if not is_task_id(task_id):
+            results.append({"status": 400, "error": "Invalid request data structure."})
+        elif task_id in access_errors:
+            status, message = access_errors[task_id]
+            results.append({"id": task_id, "status": status, "error": message})
+        elif ids[task_id] > 1:  # would be counted, tombstoned and published once for every occurrence
+            results.append({"id": task_id, "status": 400, "error": "Task id occurs more than once in the batch."})
+        else:
+            results.append({"id": task_id, "status": 200})
+            task_ids.append(task_id)
+
+    owner_task_ids = {}
+    for task_id in task_ids:
+        owner_task_ids.setdefault(owners[task_id], []).append(task_id)
+    shards = get_owner_shards(owner_task_ids)
+    for owner_id in sorted(owner_task_ids):
+        deleted_ids = owner_task_ids[owner_id]
+        with use_shard(shards[owner_id]):
+            bump_tasks_version([owner_id], total_change=-len(deleted_ids), changed_done=(deleted_ids, 0))
+    for shard, shard_task_ids in group_by_shard(task_ids, owners, shards).items():
+        with use_shard(shard):
+            db.session.execute(delete(Task).where(Task.id.in_(shard_task_ids)),
+                               execution_options={"synchronize_session": False})
+            add_task_tombstones({task_id: owners[task_id] for task_id in shard_task_ids})
+    db.session.commit()
+    for task_id in task_ids:
+        publish_task_events(owners[task_id], "task.deleted", [{"id": task_id}])
+    return jsonify({"results": results})
+
+
 # ============================================================
 # 🔧 2. UTILITIES
 # ============================================================
 
+def get_task_owner(task_id):
+    """Return task owner id and version of their tasks collection, without loading the task."""
+    if current_app.extensions["shards"].enabled:  # tasks and users are in different databases
+        owner_id = db.session.scalar(select(Task.user_id).where(Task.id == task_id))
+        owner = None if owner_id is None else (owner_id, get_tasks_version(owner_id))
+    else:
+        owner = db.session.execute(select(Task.user_id, User.tasks_version)
+                                   .join(User, Task.user_id == User.id).where(Task.id == task_id)).first()
+    if owner is None:
+        abort(404, "Task not found.")
+    return owner
+
+
+def use_task_shard(task_id):
+    """Route statements on tasks to the shard of task: of the logged user, or of any user for administrator."""
+    router = current_app.extensions["shards"]
+    if not router.enabled:
+        return
+    user_id = int(get_jwt_identity())
+    if get_logged_user_role() == "Administrator":
+        owners = [rows[0].user_id for rows in router.scatter(select(Task.user_id).where(Task.id == task_id)) if rows]
+        user_id = owners[0] if owners else user_id
+    use_user_shard(user_id)
+
+
+def get_owner_shards(owner_ids):
+    # Shard of every owner, from the directory (all 0 without shards)
+    router = current_app.extensions["shards"]
+    return {owner_id: router.get_user_shard(owner_id) for owner_id in owner_ids}
+
+
+def group_by_shard(task_ids, owners, shards):
+    # Task ids grouped by shard of their owners, so every shard gets one statement
+    groups = {}
+    for task_id in task_ids:
+        groups.setdefault(shards[owners[task_id]], []).append(task_id)
+    return groups
+
+
+def get_serialized_task(task_id):
+    # Read only serialized columns, without creating Task object
+    task = db.session.execute(select(*Task.get_serialized_columns()).where(Task.id == task_id)).first()
+    if task is None:
+        abort(404, "Task not found.")
+    return row_to_dict(task)
+
+
+def get_tasks_version(user_id):
+    return db.session.scalar(select(User.tasks_version).where(User.id == user_id))
+
+
+def bump_tasks_version(user_ids, total_change=0, done_change=0, changed_done=None, expected_version=None):
+    # Every write to user's tasks changes their collection version (and so ETags of their tasks)
+    # and task counters of their statistics, in the same transaction. The update locks rows of
+    # the users, so concurrent writes to tasks of one user (and their counters) are serialized.
+    # changed_done, (task ids, how many of them are done after the write), adds the change of done
+    # count of one user's tasks, read from the tasks under the lock, before the write changes them.
+    # With expected_version the bump (of one user) is conditional and fails with 412 if the version changed.
+    # Tasks have no foreign key to their owner, so a write for a user deleted meanwhile (e.g. by another
+    # process, which this one learns about only later) fails here, as no user row is updated.
+    user_ids = {int(user_id) for user_id in user_ids}
+    if not user_ids:
+        return
+    sharded = current_app.extensions["shards"].enabled
+    tasks_done = User.tasks_done + done_change
+    if changed_done is not None and not sharded:  # read by the update itself, after it takes the lock
+        tasks_done = tasks_done + get_done_change(*changed_done)
+    statement = update(User).where(User.id.in_(user_ids))
+    if expected_version is not None:
+        statement = statement.where(User.tasks_version == expected_version)
+    result = db.session.execute(statement.values(tasks_version=User.tasks_version + 1,
+                                                 tasks_total=User.tasks_total + total_change, tasks_done=tasks_done),
+                                execution_options={"synchronize_session": False})
+    if result.rowcount != len(user_ids):
+        check_users_exist(user_ids)
+        check_version_bumped(result.rowcount)
+    check_user_shards(user_ids)  # a move of the user may have finished before the lock
+    db.session.info.setdefault(TASK_OWNERS_KEY, set()).update(user_ids)
+    if changed_done is not None and sharded:  # tasks are not in the database of users, read once it is locked
+        db.session.execute(update(User).where(User.id.in_(user_ids))
+                           .values(tasks_done=User.tasks_done + get_done_change(*changed_done)),
+                           execution_options={"synchronize_session": False})
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def repair_task_owners(session, transaction):
+    # Commit of the primary failed after shard transactions were committed (see replicas.py): the tasks
+    # changed, but the bump of their owners did not, so their counters and versions are recounted from
+    # the shards. Tombstones of deleted tasks are lost, clients sync the deletion only with a full sync.
+    if transaction.parent is not None:
+        return
+    owners = session.info.pop(TASK_OWNERS_KEY, None)
+    if not session.info.pop(SHARDS_COMMITTED_KEY, False) or not owners:
+        return
+    logger.error("Commit of primary database failed after commit of task shards, recounting tasks of users %s",
+                 sorted(owners))
+    try:
+        with current_app.app_context(), use_primary():  # app context of its own has a new session
+            rebuild_task_stats(owners)
+            db.session.remove()
+    except Exception:
+        logger.exception("Failed to recount tasks of users %s, run rebuild-task-stats", sorted(owners))
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _forget_task_owners(session):
+    session.info.pop(TASK_OWNERS_KEY, None)
+
+
+def check_users_exist(user_ids):
+    # Abort with 401 if the logged user no longer exists, or with 404 for other owners of tasks
+    existing = set(db.session.scalars(select(User.id).where(User.id.in_(user_ids))))
+    if int(get_jwt_identity()) in user_ids - existing:
+        abort(401, "User no longer exists.")
+    if user_ids - existing:
+        abort(404, "User not found.")
+
+
+def get_done_change(task_ids, new_done_count):
+    """Return change of done tasks count (SQL expression without shards), when new_done_count of tasks get done.
+
+    It reads current values of tasks, so it has to run before the tasks are changed. With shards they are read
+    by a locking read, which sees writes committed after the transaction read the shard for the first time.
+    """
+    if current_app.extensions["shards"].enabled:
+        old_done = db.session.scalars(select(cast(Task.done, Integer)).where(Task.id.in_(task_ids)).with_for_update())
+        return new_done_count - sum(old_done)
+    old_done_count = select(func.coalesce(func.sum(cast(Task.done, Integer)), 0)).where(Task.id.in_(task_ids))
+    return literal(new_done_count) - old_done_count.scalar_subquery()
+
+
+def add_task_tombstones(owners):
+    """Record deletion of tasks given as {task id: owner id} for delta sync."""
+    if owners:
+        db.session.execute(insert(TaskTombstone), [{"task_id": task_id, "user_id": user_id, "deleted_at": utc_now()}
+                                                   for task_id, user_id in owners.items()])
+
+
+def publish_task_events(user_id, event_type, items):
+    # Push committed changes to open event streams of the task owner
+    events = current_app.extensions["events"]
+    for item in items:
+        events.publish(user_id, event_type, current_app.json.dumps(item))
+
+
+def get_sync_start(since):
+    """Return time from which changes are sent for sync token, including margin for late commits and clock skew."""
+    since_time = decode_cursor(since, [Task.updated_at])[0]
+    if since_time < utc_now() - timedelta(days=current_app.config["TASK_TOMBSTONE_RETENTION_DAYS"]):
+        abort(410, "Sync token expired. Download the whole task list.")
+    return since_time - timedelta(seconds=current_app.config["TASK_SYNC_MARGIN"])
+
+
+def prune_task_tombstones():
+    """Delete tombstones older than retention period and return their number."""
+    retention = timedelta(days=current_app.config["TASK_TOMBSTONE_RETENTION_DAYS"])
+    removed, expired = 0, TaskTombstone.deleted_at < utc_now() - retention
+    for shard in range(current_app.extensions["shards"].count):
+        with use_shard(shard):
+            result = db.session.execute(delete(TaskTombstone).where(expired))
+            db.session.commit()
+        removed += result.rowcount
+    return removed
+
+
+def get_task_stats(totals, conditions, all_shards=False):
+    """Return task statistics from statement selecting (total, done) counters and counts of open tasks due.
+
+    Overdue and due today counts depend on time, so they are counted by range scans of due_date indexes
+    (of the routed shard or, with all_shards, of all shards). They are counted against the now parameter
+    (local time of the client, as due dates are stored without time zone) or the current UTC time.
+    """
+    now = parse_date_filter('now') or utc_now()
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    def count_open_due(*due_conditions):
+        return select(func.count()).select_from(Task) \
+            .where(*conditions, Task.done == False, *due_conditions).scalar_subquery()
+    overdue = count_open_due(Task.due_date < now)
+    due_today = count_open_due(Task.due_date >= start_of_day, Task.due_date < start_of_day + timedelta(days=1))
+    router = current_app.extensions["shards"]
+    if router.enabled:  # counters and tasks are in different databases
+        row = db.session.execute(totals).first()
+        if row is not None:
+            counts = select(overdue, due_today)
+            shard_counts = router.scatter(counts) if all_shards \
+                else [db.session.execute(counts, bind_arguments={"mapper": Task}).all()]
+            row = (*row, sum(rows[0][0] for rows in shard_counts), sum(rows[0][1] for rows in shard_counts))
+    else:
+        row = db.session.execute(totals.add_columns(overdue, due_today)).first()
+    if row is None:
+        abort(404, "User not found.")
+    total, done, overdue, due_today = row
+    return {"total": total, "done": done, "open": total - done, "overdue": overdue, "due_today": due_today}
+
+
+def rebuild_task_stats(user_ids=None):
+    """Recount task counters of all users (or of user_ids) from tasks and return number of users.
+
+    Versions of the users' tasks are bumped too, as their tasks may have changed without it.
+    """
+    router = current_app.extensions["shards"]
+    users = User.id.in_(user_ids) if user_ids is not None else true()
+    db.session.execute(update(User).where(users).values(tasks_version=User.tasks_version + 1),
+                       execution_options={"synchronize_session": False})
+    if router.enabled:
+        # Counts of every shard, where each user takes them from their own shard
+        counts = select(Task.user_id, func.count(), func.coalesce(func.sum(cast(Task.done, Integer)), 0)) \
+            .where(Task.user_id.in_(user_ids) if user_ids is not None else true()).group_by(Task.user_id)
+        shard_counts = [{user_id: (total, done) for user_id, total, done in rows} for rows in router.scatter(counts)]
+        values = []
+        for user_id, shard in db.session.execute(select(User.id, User.shard).where(users)).all():
+            total, done = shard_counts[shard].get(user_id, (0, 0))
+            values.append({"id": user_id, "tasks_total": total, "tasks_done": done})
+        if values:
+            db.session.execute(update(User), values)  # bulk update by primary key
+        db.session.commit()
+        return len(values)
+    def count_tasks(*conditions):
+        return select(func.count()).select_from(Task).where(Task.user_id == User.id, *conditions).scalar_subquery()
+    result = db.session.execute(update(User).where(users)
+                                .values(tasks_total=count_tasks(), tasks_done=count_tasks(Task.done == True)),
+                                execution_options={"synchronize_session": False})
+    db.session.commit()
+    return result.rowcount
+
+
 def check_if_task_exists(task):
     # Check if task exists or user has permissions to see it
     if task is None:
@@ -98,13 +643,177 @@ def check_if_task_exists(task):
     validate_access(user_id)
 
 
-def validate_task_data(task):
+def filter_tasks(query):
+    # Apply list filters from query string, so they run in SQL on the task indexes
+    done = request.args.get('done')
+    if done is not None:
+        if done not in ('0', '1'):
+            abort(400, "Incorrect done filter value. Expected 0 or 1")
+        query = query.filter(Task.done == (done == '1'))
+    due_before = parse_date_filter('due_before')
+    if due_before is not None:
+        query = query.filter(Task.due_date < due_before)
+    due_after = parse_date_filter('due_after')
+    if due_after is not None:
+        query = query.filter(Task.due_date > due_after)
+    return query
+
+
+def parse_date_filter(param_name):
+    value = request.args.get(param_name)
+    if value is None:
+        return None
+    try:
+        return parse_due_date(value)
+    except ValueError:
+        abort(400, f"Incorrect {param_name} format. Expected ISO format: YYYY-MM-DDTHH:MM")
+
+
+def get_task_ordering():
+    # Key columns of the requested list order (always ending with unique task id) and direction
+    sort = request.args.get('sort', 'id')
+    if sort == 'id':
+        return [Task.id], False
+    if sort == 'due_date':
+        return [Task.due_date, Task.id], False
+    if sort == '-due_date':
+        return [Task.due_date, Task.id], True
+    abort(400, "Incorrect sort value. Expected one of: id, due_date, -due_date")
+
+
+def get_batch_items():
+    items = request.get_json()
+    if not isinstance(items, list):
+        abort(400, "Invalid request data structure. Expected JSON array.")
+    max_size = current_app.config["TASK_BATCH_MAX_SIZE"]
+    if len(items) > max_size:
+        abort(413, f"Too many items in the batch. Maximum is {max_size}.")
+    return items
+
+
+def is_task_id(value):
+    # JSON true and false are ints in Python, but not task ids 1 and 0
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def check_batch_access(task_ids):
+    """Return owners of tasks and (status, message) errors for tasks which do not exist or user has no access to.
+
+    The whole batch is checked using one query.
+    """
+    task_ids = [task_id for task_id in task_ids if is_task_id(task_id)]
+    logged_user_id = int(get_jwt_identity())
+    is_admin = get_logged_user_role() == "Administrator"
+    statement = select(Task.id, Task.user_id).where(Task.id.in_(task_ids))
+    router = current_app.extensions["shards"]
+    if is_admin and router.enabled:  # tasks of any users, from all shards
+        owners = {task_id: owner_id for rows in router.scatter(statement) for task_id, owner_id in rows}
+    else:
+        use_user_shard(logged_user_id)
+        owners = dict(db.session.execute(statement).all())
+    errors = {}
+    for task_id in task_ids:
+        if task_id not in owners:
+            errors[task_id] = (404, "Task not found.")
+        elif not is_admin and owners[task_id] != logged_user_id:
+            errors[task_id] = (403, "Access denied.")
+    return owners, errors
+
+
+def read_import_items():
+    """Yield (line number, task data, error) for every record of imported NDJSON or CSV request body."""
+    stream = io.BufferedReader(request.stream)  # reads body in blocks, not the whole at once
+    if request.mimetype == CSV_MIMETYPE:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+        try:
+            for item in reader:
+                if item.get('done') in ("0", "1"):
+                    item['done'] = int(item['done'])
+                yield reader.line_num, item, None
+        except (UnicodeDecodeError, csv.Error) as error:
+            yield reader.line_num, None, f"Invalid CSV: {error}"
+        return
+    loads = current_app.json.loads
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            item = loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON."
+            continue
+        yield line_number, item, None if isinstance(item, dict) else "Invalid request data structure."
+
+
+def insert_imported_tasks(user_id, rows):
+    """Insert chunk of imported tasks by one executemany statement and commit it; return number of tasks."""
+    if not rows:
+        return 0
+    assign_task_ids(rows)
+    # Version is bumped first, so the transaction holds the write lock before the search index DDL
+    bump_tasks_version([user_id], total_change=len(rows), done_change=sum(row['done'] for row in rows))
+    # Core insert without fetching ids; one updated_at for the chunk instead of the column default per row
+    statement = insert(Task.__table__).values(updated_at=utc_now())
+    with bulk_search_indexing([row['id'] for row in rows] if 'id' in rows[0] else None):
+        db.session.execute(statement, rows)
+    db.session.commit()
+    # One event per chunk instead of per task; open clients fetch the imported tasks with delta sync
+    publish_task_events(user_id, "task.imported", [{"count": len(rows)}])
+    return len(rows)
+
+
+def insert_tasks(rows):
+    """Insert tasks by one executemany statement and return their ids in order of rows."""
+    if not rows:
+        return []
+    if 'id' in rows[0]:  # assigned by assign_task_ids, e.g. on MySQL, which has no RETURNING
+        db.session.execute(insert(Task.__table__), rows)
+        return [row['id'] for row in rows]
+    statement = insert(Task).returning(Task.id, sort_by_parameter_order=True)
+    return db.session.scalars(statement, rows).all()
+
+
+def parse_due_date(value):
+    # Minutes as sent by the date input of frontend, or seconds as in dates returned by the API.
+    # fromisoformat is many times faster than strptime, which matters for imports; other ISO forms
+    # it accepts (dates only, fractions, time zones) are rejected by the length and separator check
+    if not isinstance(value, str) or len(value) not in (16, 19) or value[10] != 'T':
+        raise ValueError(f"Invalid due date: {value!r}")
+    due_date = datetime.fromisoformat(value)
+    if due_date.tzinfo is not None:  # e.g. 2025-03-20T12:00+01
+        raise ValueError(f"Invalid due date: {value!r}")
+    return due_date
+
+
+def get_new_task_error(task):
+    if not isinstance(task, dict) or set(task.keys()) != Task.get_editable_fields():
+        return "Invalid request data structure."
+    if not isinstance(task['title'], str) or not task['title']:
+        return "Task title is required."
+    if not task['due_date']:
+        return "Incorrect datetime format. Expected ISO format: YYYY-MM-DDTHH:MM"
+    return get_task_data_error(task)
+
+
+def get_task_data_error(task):
+    # Return description of the first problem with task data or None if data are correct
+    if task.get('title') is not None and not isinstance(task['title'], str):
+        return "Incorrect title value. Expected string."
+    if task.get('description') is not None and not isinstance(task['description'], str):
+        return "Incorrect description value. Expected string."
     due_date = task.get('due_date')
     if due_date:
         try:
-            datetime.strptime(due_date, '%Y-%m-%dT%H:%M')
-        except ValueError:
-            abort(400, "Incorrect datetime format. Expected ISO format: YYYY-MM-DDTHH:MM")
+            parse_due_date(due_date)
+        except (ValueError, TypeError):
+            return "Incorrect datetime format. Expected ISO format: YYYY-MM-DDTHH:MM"
     done = task.get('done')
     if done is not None and done not in (0, 1):
-        abort(400, "Incorrect done field value. Expected 0 or 1")
+        return "Incorrect done field value. Expected 0 or 1"
+    return None
+
+
+def validate_task_data(task):
+    error = get_task_data_error(task)
+    if error:
+        abort(400, error)
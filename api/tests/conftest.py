@@ -1,8 +1,10 @@
+from contextlib import contextmanager
 import pytest
 from app import create_app
 from datetime import datetime
 from flask_jwt_extended import create_access_token
 from models import db, User, Task
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
 
 @pytest.fixture
@@ -54,4 +56,17 @@ def login_test_user(identity):
     """Return Bearer auth header for user identified by provided id"""
     access_token = create_access_token(identity=str(identity))
     auth_header = {"Authorization": f"Bearer {access_token}"}
-    return auth_header
\ No newline at end of file
+    return auth_header
+
+@contextmanager
+def max_queries(limit):
+    """Fail if code in the block runs more than limit SQL statements; yields list of the statements"""
+    statements = []
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len(statements) <= limit, f"{len(statements)} queries run, expected at most {limit}:\n" + "\n".join(statements)
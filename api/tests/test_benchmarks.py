@@ -0,0 +1,19 @@
+from benchmarks.load import find_regressions, run_benchmark
+
+def test_load_benchmark_smoke(tmp_path, monkeypatch):
+    """Benchmark suite should drive endpoints without errors through WSGI and waitress"""
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", "")  # restored after the test
+    report = run_benchmark(tasks_count=50, requests_count=20, concurrency=2,
+                           scenarios=("list_tasks", "get_task", "create_task"), database_dir=tmp_path)
+    for mode in ("wsgi", "waitress"):
+        for result in report["results"][mode].values():
+            assert result["requests"] == 20 and result["errors"] == 0
+            assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+
+def test_find_regressions():
+    """Only slowdowns above allowed threshold should be reported"""
+    baseline = {"results": {"wsgi": {"get_task": {"p95_ms": 10.0, "throughput_rps": 100.0}}}}
+    current = {"results": {"wsgi": {"get_task": {"p95_ms": 11.0, "throughput_rps": 95.0}}}}
+    assert find_regressions(current, baseline, 0.2) == []
+    current = {"results": {"wsgi": {"get_task": {"p95_ms": 13.0, "throughput_rps": 70.0}}}}
+    assert len(find_regressions(current, baseline, 0.2)) == 2
@@ -0,0 +1,52 @@
+from conftest import login_test_user
+import gzip
+import json
+from models import db, Task
+from datetime import datetime
+
+def add_tasks(user_id, count):
+    db.session.add_all([Task(title=f"Task {n}", description="Task description", done=0,
+                             due_date=datetime(2025, 3, 20, 12, 0), user_id=user_id) for n in range(count)])
+    db.session.commit()
+
+def test_dates_in_iso_format(test_client, test_user, new_task):
+    """Dates should be returned in ISO format, which is accepted back by the API"""
+    headers = login_test_user(test_user.id)
+    task = test_client.get(f"/tasks/{new_task.id}", headers=headers).get_json()
+    assert task["due_date"] == "2025-03-20T12:00:00"
+
+    task["title"] = "Renamed"
+    del task["id"]
+    response = test_client.put(f"/tasks/{new_task.id}", json=task, headers=headers)
+    assert response.status_code == 200 and response.get_json()["due_date"] == "2025-03-20T12:00:00"
+
+def test_response_compression(test_client, test_user):
+    """Large responses should be compressed with gzip when client accepts it"""
+    add_tasks(test_user.id, 50)
+    headers = login_test_user(test_user.id)
+
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers | {"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in response.headers["Vary"]
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and etag.endswith('-gzip"'), "Compressed response should have strong ETag of coding"
+    items = json.loads(gzip.decompress(response.get_data()))["items"]
+    assert len(items) == 50
+    response = test_client.get(f"/tasks/user/{test_user.id}",
+                               headers=headers | {"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["ETag"] == etag
+
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
+    assert "Content-Encoding" not in response.headers and len(response.get_json()["items"]) == 50
+    response = test_client.get(f"/tasks/user/{test_user.id}?limit=1", headers=headers | {"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers, "Small responses should not be compressed"
+
+def test_streamed_response_compression(test_client, test_user, test_admin):
+    """Streamed exports should be compressed chunk by chunk"""
+    add_tasks(test_user.id, 50)
+    test_client.application.config["STREAM_YIELD_PER"] = 10
+    headers = login_test_user(test_admin.id) | {"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}
+
+    response = test_client.get("/tasks", headers=headers)
+    assert response.is_streamed and response.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert [json.loads(line)["title"] for line in lines] == [f"Task {n}" for n in range(50)]
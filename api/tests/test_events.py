@@ -0,0 +1,158 @@
+from conftest import login_test_user
+from datetime import timedelta
+from event_server import EventServer
+import event_server
+import events
+from events import EventHub, LocalBroker, RedisBroker
+from flask import current_app
+from flask_jwt_extended import create_access_token
+import json
+import socket
+import threading
+import time
+
+def open_stream(port, path, headers):
+    """Send events request and return connected socket with response received so far"""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    header_lines = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{header_lines}\r\n".encode())
+    return sock, read_until(sock, b"\r\n\r\n")
+
+def read_until(sock, marker, received=b""):
+    while marker not in received:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        received += chunk
+    return received
+
+def read_to_end(sock, received=b""):
+    """Return everything received until the server closes connection (fails after 5 seconds)"""
+    deadline = time.monotonic() + 5
+    while chunk := sock.recv(4096):
+        received += chunk
+        assert time.monotonic() < deadline, "Server should close the connection"
+    return received
+
+def test_event_hub_evicts_slow_subscriber():
+    """Subscriber whose queue is full should be evicted instead of queue growing"""
+    hub = EventHub(LocalBroker(), max_queue=2)
+    notified = []
+    subscriber = hub.subscribe(1, notified.append)
+    other_user = hub.subscribe(2, notified.append)
+    for number in range(3):
+        hub.publish(1, "task.created", json.dumps({"id": number}))
+
+    assert subscriber.evicted and len(subscriber.queue) == 2
+    assert not other_user.evicted and len(other_user.queue) == 0
+    assert hub.subscribers_count() == 1
+
+def test_task_events_stream(test_client, test_user, test_user2):
+    """Owner should receive task events over SSE, other users should be rejected"""
+    app = current_app._get_current_object()
+    server = EventServer(app, app.extensions["events"], host="127.0.0.1", port=0).start()
+    try:
+        sock, response = open_stream(server.port, f"/tasks/user/{test_user.id}/events", login_test_user(test_user.id))
+        assert response.startswith(b"HTTP/1.1 200") and b"text/event-stream" in response
+
+        headers = login_test_user(test_user.id)
+        task = {"title": "Streamed", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+        task_id = test_client.post("/tasks", json=task, headers=headers).get_json()["id"]
+        test_client.delete(f"/tasks/{task_id}", headers=headers)
+        received = read_until(sock, b"event: task.deleted", response)
+        assert b"event: task.created" in received and b'"title":"Streamed"' in received.replace(b" ", b"")
+        sock.close()
+
+        denied, response = open_stream(server.port, f"/tasks/user/{test_user.id}/events",
+                                       login_test_user(test_user2.id))
+        assert response.startswith(b"HTTP/1.1 403")
+        denied.close()
+        anonymous, response = open_stream(server.port, f"/tasks/user/{test_user.id}/events", {})
+        assert response.startswith(b"HTTP/1.1 401")
+        anonymous.close()
+    finally:
+        server.stop()
+
+def test_task_events_stream_not_blocked_by_authentication(test_client, test_user, monkeypatch):
+    """Events should keep flowing to open streams while authentication of another stream waits"""
+    app = current_app._get_current_object()
+    server = EventServer(app, app.extensions["events"], host="127.0.0.1", port=0).start()
+    path = f"/tasks/user/{test_user.id}/events"
+    try:
+        sock, response = open_stream(server.port, path, login_test_user(test_user.id))
+        assert response.startswith(b"HTTP/1.1 200")
+        authenticate, database_answers = server._authenticate, threading.Event()
+        monkeypatch.setattr(server, "_authenticate", lambda *args: database_answers.wait(5) and authenticate(*args))
+        waiting = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+        headers = login_test_user(test_user.id)
+        waiting.sendall(f"GET {path} HTTP/1.1\r\nAuthorization: {headers['Authorization']}\r\n\r\n".encode())
+
+        task = {"title": "Streamed", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+        test_client.post("/tasks", json=task, headers=headers)
+        sock.settimeout(2)  # before the authentication gives up waiting
+        assert b"event: task.created" in read_until(sock, b"event: task.created", response)
+        database_answers.set()
+        assert read_until(waiting, b"\r\n\r\n").startswith(b"HTTP/1.1 200")
+        sock.close()
+        waiting.close()
+    finally:
+        server.stop()
+
+def test_task_events_stream_closed_with_token(test_client, test_user, monkeypatch):
+    """Stream should be closed when its token expires or is revoked by logout or deletion of the user"""
+    monkeypatch.setattr(event_server, "REVOCATION_CHECK_CHUNK", 1)  # tokens of each stream in separate queries
+    app = current_app._get_current_object()
+    server = EventServer(app, app.extensions["events"], host="127.0.0.1", port=0, heartbeat=0.1).start()
+    path = f"/tasks/user/{test_user.id}/events"
+    try:
+        token = create_access_token(identity=str(test_user.id), expires_delta=timedelta(seconds=1))
+        expiring, response = open_stream(server.port, path, {"Authorization": f"Bearer {token}"})
+        assert response.startswith(b"HTTP/1.1 200")
+        read_to_end(expiring, response)
+        expiring.close()
+
+        headers = login_test_user(test_user.id)
+        revoked, response = open_stream(server.port, path, headers)
+        assert response.startswith(b"HTTP/1.1 200")
+        assert test_client.get("/logout", headers=headers).status_code == 200
+        read_to_end(revoked, response)
+        revoked.close()
+
+        deleted, response = open_stream(server.port, path, login_test_user(test_user.id))
+        assert response.startswith(b"HTTP/1.1 200")
+        assert test_client.delete(f"/users/{test_user.id}", headers=login_test_user(test_user.id)).status_code == 200
+        read_to_end(deleted, response)
+        deleted.close()
+    finally:
+        server.stop()
+
+def test_redis_broker_subscribes_again_after_connection_error(monkeypatch):
+    """Lost Redis connection should not stop delivery of events published after it comes back"""
+    class FakePubSub:
+        def __init__(self, messages):
+            self.messages = messages
+        def subscribe(self, channel):
+            pass
+        def listen(self):
+            for message in self.messages:
+                if isinstance(message, Exception):
+                    raise message
+                yield message
+            threading.Event().wait()  # connection stays open
+        def close(self):
+            pass
+
+    class FakeRedis:
+        def __init__(self):
+            self.subscriptions = [FakePubSub([ConnectionError("Connection reset")]),
+                                  FakePubSub([ConnectionError("Connection refused")]),
+                                  FakePubSub([{"data": json.dumps([1, "task.created", "{}"])}])]
+        def pubsub(self, ignore_subscribe_messages):
+            return self.subscriptions.pop(0)
+
+    monkeypatch.setattr(events, "RECONNECT_DELAY", 0.01)
+    broker = RedisBroker.__new__(RedisBroker)  # without redis package
+    broker.client, broker.channel = FakeRedis(), "task-events"
+    delivered = threading.Event()
+    broker.start(lambda user_id, event_type, data: delivered.set())
+    assert delivered.wait(5), "Listener should subscribe again after connection errors"
@@ -0,0 +1,115 @@
+from app import create_app
+from conftest import login_test_user
+from models import db
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+def test_health(test_client):
+    """Health check should be available without login"""
+    response = test_client.get("/health")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ok"
+
+def test_database_pool_configuration(tmp_path, monkeypatch):
+    """Pool should be configured from environment and report its statistics"""
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'pool.db'}")
+    monkeypatch.setenv("TODOLIST_DB_POOL_SIZE", "1")
+    monkeypatch.setenv("TODOLIST_DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("TODOLIST_DB_POOL_TIMEOUT", "1")
+    app = create_app()
+
+    with app.app_context():
+        with db.engine.connect():
+            with pytest.raises(PoolTimeoutError):
+                db.engine.connect()
+            stats = app.test_client().get("/health").get_json()["database_pool"]
+        db.engine.dispose()
+    assert stats["size"] == 1 and stats["checked_out"] == 1
+    assert stats["timeouts"] == 1 and stats["wait_seconds_total"] >= 1
+
+def test_metrics(test_client, test_user):
+    """Metrics should count requests per route template with latency histogram"""
+    headers = login_test_user(test_user.id)
+    for _ in range(2):
+        test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
+    test_client.get("/no-such-page")
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    labels = 'blueprint="task_bp",route="/tasks/user/<int:user_id>",method="GET"'
+    assert f'todolist_http_requests_total{{{labels},status="200"}} 2' in body
+    assert f'todolist_http_request_duration_seconds_count{{{labels}}} 2' in body
+    assert f'todolist_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in body
+    assert 'route="<unmatched>",method="GET",status="404"} 1' in body
+    assert "todolist_http_requests_in_flight 1" in body  # the /metrics request itself
+
+def test_metrics_of_all_processes(tmp_path):
+    """Metrics should sum counters of all processes, and gauges of running ones only"""
+    from metrics import RequestMetrics
+    import json
+    import os
+    key = ["task_bp", "/tasks", "POST"]
+    for pid, in_flight in ((os.getppid(), 2), (2 ** 22 + 1, 5)):  # running parent and non-existent process
+        data = {"requests": [[key + ["201"], 3]], "latency": [[key, [3] + [0] * 11 + [0.003, 3]]], "size": [],
+                "in_flight": in_flight, "other": {"todolist_db_pool_checked_out": ["gauge", "In use.", 1]}}
+        (tmp_path / f"metrics-{pid}.json").write_text(json.dumps(data))
+
+    metrics = RequestMetrics(metrics_dir=str(tmp_path))
+    total = metrics.aggregate()
+    assert total["requests"][tuple(key + ["201"])] == 6
+    assert total["latency"][tuple(key)][0] == 6
+    assert total["in_flight"] == 2
+    assert total["other"]["todolist_db_pool_checked_out"][2] == 1
+
+def test_retired_process_metrics(tmp_path):
+    """Files of finished processes should be folded into one file, keeping their counters only"""
+    from metrics import RequestMetrics
+    import json
+    key = ["task_bp", "/tasks", "POST"]
+    metrics = RequestMetrics(metrics_dir=str(tmp_path))
+    for pid in (2 ** 22 + 1, 2 ** 22 + 2):  # non-existent processes
+        data = {"requests": [[key + ["201"], 3]], "latency": [[key, [3] + [0] * 11 + [0.003, 3]]], "size": [],
+                "in_flight": 1, "other": {"todolist_db_pool_checked_out": ["gauge", "In use.", 1],
+                                          "todolist_db_queries_total": ["counter", "Queries.", 4]}}
+        (tmp_path / f"metrics-{pid}.json").write_text(json.dumps(data))
+    metrics.retire_process(2 ** 22 + 1)
+    metrics.retire_finished_processes()
+    assert sorted(path.name for path in tmp_path.glob("metrics-*.json")) == ["metrics-retired.json"]
+    total = metrics.aggregate()
+    assert total["requests"][tuple(key + ["201"])] == 6
+    assert total["latency"][tuple(key)][-1] == 6
+    assert total["in_flight"] == 0
+    assert total["other"]["todolist_db_queries_total"][2] == 8
+    assert "todolist_db_pool_checked_out" not in total["other"]
+
+def test_query_stats(monkeypatch, caplog):
+    """Query counts should be sent in debug headers and busy requests logged with normalized SQL"""
+    from query_stats import normalize_sql
+    from sqlalchemy import text
+    monkeypatch.setenv("TODOLIST_QUERY_DEBUG_HEADERS", "true")
+    monkeypatch.setenv("TODOLIST_QUERY_COUNT_THRESHOLD", "2")
+    app = create_app("testing")
+
+    @app.route("/busy")
+    def busy():
+        for number in range(3):
+            db.session.execute(text(f"SELECT {number}"))
+        return "ok"
+
+    with app.app_context():
+        with caplog.at_level("WARNING", logger="query_stats"):
+            assert app.test_client().get("/health").headers["X-Query-Count"] == "0"
+            response = app.test_client().get("/busy")
+    assert response.headers["X-Query-Count"] == "3"
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert "GET /busy ran 3 queries" in caplog.text and "3x SELECT ?" in caplog.text
+    with app.app_context():
+        connection = db.session.connection()
+        for _ in range(3):
+            with pytest.raises(Exception):
+                connection.execute(text("SELECT * FROM missing_table"))
+        assert connection.info["query_started_at"] == [], "Failed statements should not leave their start time"
+    assert normalize_sql("SELECT *\n FROM task WHERE id IN (1, 2, 3) AND title = 'a''b'") == \
+        "SELECT * FROM task WHERE id IN (?, ...) AND title = ?"
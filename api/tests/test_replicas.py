@@ -0,0 +1,70 @@
+from app import create_app
+from conftest import login_test_user
+from models import db
+import shutil
+import sqlite3
+
+def create_replicated_app(tmp_path, monkeypatch):
+    """Create app with SQLite primary and two replicas holding copies of its data"""
+    primary = tmp_path / "primary.db"
+    replicas = [tmp_path / "replica0.db", tmp_path / "replica1.db"]
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{primary}")
+    monkeypatch.setenv("SQLALCHEMY_REPLICA_URIS", ",".join(f"sqlite:///{path}" for path in replicas))
+    monkeypatch.setenv("TODOLIST_HASHING_WORKERS", "0")
+    app = create_app()
+    with app.app_context():
+        user_id = db.session.execute(db.text("SELECT id FROM user")).scalar()
+        headers = login_test_user(user_id)
+        db.session.remove()
+        db.engine.dispose()
+    for number, replica in enumerate(replicas):  # replication, each replica with its own task
+        shutil.copy(primary, replica)
+        with sqlite3.connect(replica) as connection:
+            connection.execute("INSERT INTO task (title, description, due_date, done, user_id, updated_at) "
+                               "VALUES (?, '', '2025-03-20 12:00:00', 0, ?, '2025-03-20 12:00:00')",
+                               (f"replica {number}", user_id))
+    return app, user_id, headers
+
+def get_task_titles(client, user_id, headers):
+    response = client.get(f"/tasks/user/{user_id}", headers=headers)
+    assert response.status_code == 200
+    return [task["title"] for task in response.get_json()["items"]]
+
+def test_reads_go_to_replicas_round_robin(tmp_path, monkeypatch):
+    """GET requests should read from replicas in turn, writes should go to primary"""
+    app, user_id, headers = create_replicated_app(tmp_path, monkeypatch)
+    client = app.test_client()
+
+    titles = [get_task_titles(client, user_id, headers) for _ in range(4)]
+    assert sorted(map(tuple, titles)) == [("replica 0",), ("replica 0",), ("replica 1",), ("replica 1",)]
+
+    task = {"title": "primary", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    assert client.post("/tasks", json=task, headers=headers).status_code == 200
+    with sqlite3.connect(tmp_path / "replica0.db") as connection:
+        assert connection.execute("SELECT count(*) FROM task WHERE title = 'primary'").fetchone()[0] == 0
+
+def test_reads_own_writes_from_primary(tmp_path, monkeypatch):
+    """After a write, user should read from primary, tracked by cookie and by the process"""
+    app, user_id, headers = create_replicated_app(tmp_path, monkeypatch)
+    client = app.test_client()
+    task = {"title": "primary", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    assert client.post("/tasks", json=task, headers=headers).status_code == 200
+
+    assert client.get_cookie("todolist_primary_until") is not None
+    assert get_task_titles(client, user_id, headers) == ["primary"]
+    client.delete_cookie("todolist_primary_until")
+    assert get_task_titles(client, user_id, headers) == ["primary"]
+
+    app.extensions["replicas"].window = 0  # window is over
+    app.extensions["replicas"]._recent_writers.clear()
+    assert get_task_titles(client, user_id, headers)[0].startswith("replica")
+
+def test_roles_are_checked_on_primary(tmp_path, monkeypatch):
+    """Role of logged user should be read from primary, replicas may still have the previous one"""
+    app, user_id, headers = create_replicated_app(tmp_path, monkeypatch)
+    client = app.test_client()
+    assert client.get("/users", headers=headers).status_code == 200
+    with sqlite3.connect(tmp_path / "primary.db") as connection:  # demoted, not replicated yet
+        connection.execute("UPDATE user SET role = 'User', auth_version = auth_version + 1 WHERE id = ?", (user_id,))
+    app.extensions["auth_versions"].discard(user_id)
+    assert client.get("/users", headers=headers).status_code == 403
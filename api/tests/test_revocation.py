@@ -0,0 +1,73 @@
+from conftest import login_test_user
+from datetime import timedelta
+from flask import current_app
+from flask_jwt_extended import decode_token
+from models import db, RevokedToken
+from revocation import BloomFilter, RevocationCache, prune_revoked_tokens, utc_now
+from sqlalchemy import event
+import threading
+
+def test_revoked_token_lookups_are_cached(test_client, test_user):
+    """Not revoked tokens should be checked without querying revoked tokens table"""
+    headers = login_test_user(test_user.id)
+    revoked_headers = login_test_user(test_user.id)
+    jti = decode_token(revoked_headers["Authorization"].split()[1])["jti"]
+    db.session.add(RevokedToken(jti=jti, exp=utc_now() + timedelta(minutes=15)))
+    db.session.commit()
+
+    queries = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "revoked_token" in statement:
+            queries.append(statement)
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        response = test_client.get(f"/users/{test_user.id}", headers=revoked_headers)
+        assert response.status_code == 401, "Token revoked before cache was built should be rejected"
+        queries.clear()
+        for _ in range(3):
+            response = test_client.get(f"/users/{test_user.id}", headers=headers)
+            assert response.status_code == 200
+        response = test_client.get(f"/users/{test_user.id}", headers=revoked_headers)
+        assert response.status_code == 401
+        assert queries == [], "Revocation checks should be answered from the cache"
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+
+def test_prune_revoked_tokens(test_client):
+    """Only expired revoked tokens should be removed"""
+    db.session.add(RevokedToken(jti="expired", exp=utc_now() - timedelta(minutes=1)))
+    db.session.add(RevokedToken(jti="valid", exp=utc_now() + timedelta(minutes=15)))
+    db.session.commit()
+    assert prune_revoked_tokens() == 1
+    assert [token.jti for token in RevokedToken.query.all()] == ["valid"]
+
+def test_bloom_rebuild_leaves_session_alone(test_client):
+    """Rebuilding the Bloom filter should neither prune tokens nor commit the request session"""
+    db.session.add(RevokedToken(jti="expired", exp=utc_now() - timedelta(minutes=1)))
+    db.session.commit()
+    db.session.add(RevokedToken(jti="pending", exp=utc_now() + timedelta(minutes=15)))
+    cache = current_app.extensions["revoked_tokens"]
+    cache._bloom_built_at = None
+    assert cache.is_revoked("expired") is False
+    db.session.rollback()
+    assert [token.jti for token in RevokedToken.query.all()] == ["expired"]
+
+def test_bloom_rebuild_runs_in_background(test_client):
+    """Lookups should not wait for the rebuild, and tokens revoked meanwhile should stay in the new filter"""
+    cache = RevocationCache(max_size=100, negative_ttl=30, bloom_refresh_interval=30, background=True)
+    cache._bloom = BloomFilter(0)  # stale filter of an earlier rebuild
+    reading, resume = threading.Event(), threading.Event()
+    def pause(conn, cursor, statement, parameters, context, executemany):
+        if "FROM revoked_token" in statement and threading.current_thread() is cache._rebuild_thread:
+            reading.set()
+            resume.wait(5)
+    event.listen(db.engine, "before_cursor_execute", pause)
+    try:
+        assert cache.is_revoked("second") is False, "Lookup should use the previous filter during the rebuild"
+        assert reading.wait(5)
+        cache.add("revoked-meanwhile", utc_now() + timedelta(minutes=15))
+        resume.set()
+        cache._rebuild_thread.join()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", pause)
+    assert "revoked-meanwhile" in cache._bloom
@@ -0,0 +1,89 @@
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+
+SERVER_SCRIPT = """
+import sys
+from app import create_app
+from serve import PreforkServer
+app = create_app()
+server = PreforkServer(app, "127.0.0.1", 0, workers=2, threads=2, max_requests=5)
+print(server.api_socket.getsockname()[1], flush=True)
+server.run()
+"""
+
+def test_prefork_server_recycles_workers(tmp_path):
+    """Workers should serve requests, be replaced after max requests and stop with the parent"""
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'serve.db'}", TODOLIST_HASHING_WORKERS="0",
+               TODOLIST_METRICS_DIR=str(tmp_path / "metrics"))
+    process = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT], cwd=api_dir, env=env, stdout=subprocess.PIPE)
+    try:
+        port = int(process.stdout.readline())
+        for _ in range(30):  # each worker is recycled several times
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            connection.request("GET", "/health")
+            assert connection.getresponse().status == 200
+            connection.close()
+        worker_files = [name for name in os.listdir(tmp_path / "metrics") if name.endswith(".json")]
+        assert "metrics-retired.json" in worker_files and len(worker_files) <= 3, \
+            "Metrics of recycled workers should be folded into one file"
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+    assert sorted(os.listdir(tmp_path / "metrics")) == ["metrics-retired.json", "metrics.lock"]
+    with open(tmp_path / "metrics" / "metrics-retired.json") as metrics_file:
+        assert json.load(metrics_file)["requests"] == [[["monitoring_bp", "/health", "GET", "200"], 30]]
+
+def test_worker_count_defaults(monkeypatch):
+    """One worker by default, as many as CPUs allowed to the process when events go through a broker"""
+    from pool import get_cpu_count
+    from serve import get_worker_count
+    monkeypatch.delenv("TODOLIST_WORKERS", raising=False)
+    monkeypatch.delenv("TODOLIST_EVENTS_REDIS_URL", raising=False)
+    assert get_worker_count() == 1
+    monkeypatch.setenv("TODOLIST_EVENTS_REDIS_URL", "redis://localhost:6379/0")
+    assert get_worker_count() == get_cpu_count() <= (os.cpu_count() or 1)
+
+RESUME_SCRIPT = """
+from app import create_app
+from models import db, User, UserDeletion
+from serve import PreforkServer
+app = create_app()
+with app.app_context():  # deletion interrupted by restart of the previous server
+    user = User(username="leaving", email="leaving@example.com", role="User", password="password")
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(UserDeletion(user_id=user.id, requested_by=1, status="running"))
+    db.session.commit()
+    db.engine.dispose()
+server = PreforkServer(app, "127.0.0.1", 0, workers=1, threads=2, max_requests=0)
+print(server.api_socket.getsockname()[1], flush=True)
+server.run()
+"""
+
+def test_prefork_server_resumes_user_deletions(tmp_path):
+    """Unfinished user deletions should be finished at start of the server"""
+    import sqlite3
+    import time
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'serve.db'}", TODOLIST_HASHING_WORKERS="0",
+               TODOLIST_METRICS_DIR=str(tmp_path / "metrics"))
+    process = subprocess.Popen([sys.executable, "-c", RESUME_SCRIPT], cwd=api_dir, env=env, stdout=subprocess.PIPE)
+    try:
+        process.stdout.readline()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            with sqlite3.connect(tmp_path / "serve.db") as connection:
+                status = connection.execute("SELECT status FROM user_deletion").fetchone()[0]
+                users = connection.execute("SELECT count(*) FROM user WHERE username = 'leaving'").fetchone()[0]
+            if status == "done":
+                break
+            time.sleep(0.1)
+        assert (status, users) == ("done", 0)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
@@ -0,0 +1,278 @@
+from conftest import login_test_user
+from contextlib import contextmanager
+from flask import current_app
+import json
+import pytest
+import re
+from app import create_app
+from models import db, Task, User
+from shards import move_user_tasks, rebalance_shards
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.exc import OperationalError
+from task_views import rebuild_task_stats
+
+@pytest.fixture
+def sharded_client(tmp_path, monkeypatch):
+    """App with tasks spread over the primary SQLite database and two shard files."""
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setenv("SQLALCHEMY_SHARD_URIS", ",".join(f"sqlite:///{tmp_path / f'shard{n}.db'}" for n in (1, 2)))
+    monkeypatch.setenv("TODOLIST_HASHING_WORKERS", "0")
+    app = create_app()
+    with app.test_client() as client, app.app_context():
+        yield client
+        db.session.remove()
+
+def shard_tasks(shard):
+    """Return {task id: owner id} of tasks stored in the shard"""
+    engine = current_app.extensions["shards"].get_engine(shard)
+    with engine.connect() as connection:
+        return dict(connection.execute(select(Task.id, Task.user_id)).all())
+
+@contextmanager
+def used_shards():
+    """Yield set filled with numbers of shards which ran statements on tasks in the block"""
+    shards, listeners = set(), []
+    router = current_app.extensions["shards"]
+    for shard in range(router.count):
+        def record(conn, cursor, statement, *args, shard=shard):
+            if re.search(r"\b(task|task_tombstone|task_fts)\b", statement):
+                shards.add(shard)
+        event.listen(router.get_engine(shard), "before_cursor_execute", record)
+        listeners.append((router.get_engine(shard), record))
+    try:
+        yield shards
+    finally:
+        for engine, record in listeners:
+            event.remove(engine, "before_cursor_execute", record)
+
+def test_sharded_tasks(sharded_client):
+    """Tasks should live in the shard of their user, and admin lists should gather them from all shards"""
+    client = sharded_client
+    router = client.application.extensions["shards"]
+    users = []
+    for n in range(8):
+        user = client.post("/users", json={"username": f"user{n}", "email": f"user{n}@example.com",
+                                           "password": "password", "role": "User"}).get_json()
+        users.append(user["id"])
+    shards = dict(db.session.execute(select(User.id, User.shard)).all())
+    assert {shards[user_id] for user_id in users} == {0, 1, 2}, "Users should be spread over all shards"
+    assert all(shards[user_id] == router.get_ring_shard(user_id) for user_id in users)
+
+    task = {"title": "Milk", "description": "Buy milk", "due_date": "2025-03-20T12:00", "done": 0}
+    for n, user_id in enumerate(users):
+        headers = login_test_user(user_id)
+        client.post("/tasks", json=task | {"done": n % 2}, headers=headers)
+        client.post("/tasks/batch", json=[task | {"title": f"Batch {n}"}], headers=headers)
+        lines = json.dumps(task | {"title": f"Imported {n}", "due_date": f"2025-03-{n + 10}T12:00"})
+        client.post("/tasks/import", data=lines, headers=headers, content_type="application/x-ndjson")
+    stored = [shard_tasks(shard) for shard in range(router.count)]
+    assert sum(len(tasks) for tasks in stored) == 3 * len(users), "Task ids should be unique in all shards"
+    assert all(shards[owner_id] == shard for shard, tasks in enumerate(stored) for owner_id in tasks.values())
+
+    user_id = users[0]
+    headers = login_test_user(user_id)
+    with used_shards() as used:
+        tasks = client.get(f"/tasks/user/{user_id}", headers=headers).get_json()["items"]
+        client.get(f"/tasks/{tasks[0]['id']}", headers=headers)
+        client.patch(f"/tasks/{tasks[0]['id']}", json={"done": 1}, headers=headers)
+        assert len(client.get(f"/tasks/user/{user_id}/search?q=milk", headers=headers).get_json()["items"]) == 3
+    assert used == {shards[user_id]}, "Endpoints of one user should touch only their shard"
+
+    admin_headers = login_test_user(1)
+    all_ids = sorted(task_id for tasks in stored for task_id in tasks)
+    pages, cursor = [], None
+    while True:
+        page = client.get("/tasks", query_string={"limit": 5, **({"after": cursor} if cursor else {})},
+                          headers=admin_headers).get_json()
+        pages += [task["id"] for task in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == all_ids
+    by_due_date = client.get("/tasks?sort=-due_date&limit=1000", headers=admin_headers).get_json()["items"]
+    assert [task["due_date"] for task in by_due_date] == sorted([task["due_date"] for task in by_due_date],
+                                                                 reverse=True)
+    response = client.get("/tasks", headers=admin_headers | {"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["id"] for line in response.get_data(as_text=True).splitlines()] == all_ids
+    stats = client.get("/tasks/stats?now=2025-03-15T00:00", headers=admin_headers).get_json()
+    assert stats["total"] == len(all_ids) and stats["overdue"] == 5  # imported tasks due 10-14 March, not done
+
+    other_task = next(task_id for task_id, owner_id in stored[shards[users[1]]].items() if owner_id == users[1])
+    assert client.get(f"/tasks/{other_task}", headers=admin_headers).status_code == 200
+    assert client.get(f"/tasks/{other_task}", headers=headers).status_code in (403, 404)
+    batch = [{"id": tasks[1]["id"], "title": "Renamed"}, {"id": other_task, "title": "Renamed"}]
+    results = client.patch("/tasks/batch", json=batch, headers=admin_headers).get_json()["results"]
+    assert [result["status"] for result in results] == [200, 200]
+    results = client.delete("/tasks/batch", json=[tasks[2]["id"], other_task], headers=admin_headers).get_json()
+    assert [result["status"] for result in results["results"]] == [200, 200]
+    assert client.get(f"/tasks/{other_task}", headers=admin_headers).status_code == 404
+
+def test_writes_for_deleted_owner_are_rejected(sharded_client):
+    """Tasks have no foreign key to users, so writes for a user deleted meanwhile should fail by the owner check"""
+    client = sharded_client
+    user = client.post("/users", json={"username": "gone", "email": "gone@example.com", "password": "password",
+                                       "role": "User"}).get_json()
+    user_id, headers = user["id"], login_test_user(user["id"])
+    task = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    task_id = client.post("/tasks", json=task, headers=headers).get_json()["id"]
+    shard = db.session.scalar(select(User.shard).where(User.id == user_id))
+
+    # Deleted by another process, this one still trusts claims of the token
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+    assert client.post("/tasks", json=task, headers=headers).status_code == 401
+    assert client.post("/tasks/batch", json=[task, task], headers=headers).status_code == 401
+    assert client.patch("/tasks/batch", json=[{"id": task_id, "done": 1}], headers=headers).status_code == 401
+    assert client.patch(f"/tasks/{task_id}", json={"done": 1}, headers=login_test_user(1)).status_code == 404
+    db.session.remove()
+    assert shard_tasks(shard) == {task_id: user_id}, "No task should be written for the deleted owner"
+
+def test_failed_primary_commit_recounts_task_owners(sharded_client):
+    """Counters and version of user should be recounted when primary commit fails after shard commit"""
+    client = sharded_client
+    user = client.post("/users", json={"username": "unlucky", "email": "unlucky@example.com", "password": "password",
+                                       "role": "User"}).get_json()
+    user_id, headers = user["id"], login_test_user(user["id"])
+    task = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 1}
+    client.post("/tasks", json=task, headers=headers)
+    version = db.session.scalar(select(User.tasks_version).where(User.id == user_id))
+    db.session.remove()
+
+    def fail_once(conn):
+        event.remove(db.engine, "commit", fail_once)
+        raise OperationalError("COMMIT", {}, Exception("Deadlock found when trying to get lock"))
+    event.listen(db.engine, "commit", fail_once)
+    assert client.post("/tasks", json=task, headers=headers).status_code == 500
+    db.session.remove()  # teardown of the request, which shares app context of the test
+    assert len(shard_tasks(db.session.scalar(select(User.shard).where(User.id == user_id)))) == 2, \
+        "Shard write is committed before the primary"
+    user = db.session.get(User, user_id)
+    assert (user.tasks_total, user.tasks_done) == (2, 2), "Counters should follow the committed tasks"
+    assert user.tasks_version > version, "Version should change, so ETags of the old task list are not trusted"
+
+def test_move_user_tasks(sharded_client):
+    """Tasks of user should move to another shard with their search index, sync records and counters"""
+    client = sharded_client
+    user = client.post("/users", json={"username": "mover", "email": "mover@example.com", "password": "password",
+                                       "role": "User"}).get_json()
+    user_id, headers = user["id"], login_test_user(user["id"])
+    source = db.session.scalar(select(User.shard).where(User.id == user_id))
+    target = (source + 1) % 3
+    items = [{"title": f"Task {n}", "description": "Move me", "due_date": "2025-03-20T12:00", "done": n % 2}
+             for n in range(5)]
+    task_ids = [result["task"]["id"] for result in
+                client.post("/tasks/batch", json=items, headers=headers).get_json()["results"]]
+    sync_token = client.get(f"/tasks/user/{user_id}/changes", headers=headers).get_json()["next_token"]
+    client.delete(f"/tasks/{task_ids[0]}", headers=headers)
+    before = client.get(f"/tasks/user/{user_id}", headers=headers).get_json()["items"]
+
+    assert move_user_tasks(user_id, target, chunk_size=2) == 4
+    db.session.remove()
+    assert db.session.scalar(select(User.shard).where(User.id == user_id)) == target
+    assert user_id not in shard_tasks(source).values() and len(shard_tasks(target)) == 4
+    assert client.get(f"/tasks/user/{user_id}", headers=headers).get_json()["items"] == before
+    assert len(client.get(f"/tasks/user/{user_id}/search?q=move", headers=headers).get_json()["items"]) == 4
+    changes = client.get(f"/tasks/user/{user_id}/changes?since={sync_token}", headers=headers).get_json()
+    assert changes["deleted"] == [task_ids[0]]
+    assert client.patch(f"/tasks/{task_ids[1]}", json={"done": 0}, headers=headers).status_code == 200
+
+    stats = client.get(f"/tasks/user/{user_id}/stats", headers=headers).get_json()
+    db.session.execute(update(User).values(tasks_total=0, tasks_done=0))
+    db.session.commit()
+    rebuild_task_stats()
+    assert client.get(f"/tasks/user/{user_id}/stats", headers=headers).get_json() == stats == \
+        {"total": 4, "done": 1, "open": 3, "overdue": stats["overdue"], "due_today": stats["due_today"]}
+
+    assert rebalance_shards() == 1, "Rebalance should return the user to their hash placement"
+    db.session.remove()
+    assert db.session.scalar(select(User.shard).where(User.id == user_id)) == source
+    assert len(client.get(f"/tasks/user/{user_id}", headers=headers).get_json()["items"]) == 4
+
+def test_move_waits_for_task_writes(sharded_client):
+    """A write paused in its commit should be in the shard before the move can lock the user and diff the copies"""
+    import threading
+    client = sharded_client
+    app = client.application
+    router = app.extensions["shards"]
+    user_id = next(user["id"] for user in (
+        client.post("/users", json={"username": f"writer{n}", "email": f"writer{n}@example.com",
+                                    "password": "password", "role": "User"}).get_json() for n in range(8))
+        if db.session.scalar(select(User.shard).where(User.id == user["id"])) != 0)
+    headers = login_test_user(user_id)
+    task = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    task_id = client.post("/tasks", json=task, headers=headers).get_json()["id"]
+    source = db.session.scalar(select(User.shard).where(User.id == user_id))
+    target = 0 if source == 2 else 2
+    db.session.remove()
+
+    committing, resume = threading.Event(), threading.Event()
+    writer = threading.current_thread()
+    def pause_primary_commit(connection):  # runs before the COMMIT of the primary database is sent
+        if threading.current_thread() is writer:
+            committing.set()
+            resume.wait(10)
+    def write():
+        app.test_client().patch(f"/tasks/{task_id}", json={"title": "Written during move"}, headers=headers)
+    def move():
+        with app.app_context():
+            move_user_tasks(user_id, target)
+
+    event.listen(db.engine, "commit", pause_primary_commit)
+    try:
+        writer = threading.Thread(target=write)
+        writer.start()
+        assert committing.wait(10)
+        with router.get_engine(source).connect() as connection:
+            title = connection.scalar(select(Task.title).where(Task.id == task_id))
+        assert title == "Written during move", "Shard write should be committed before the primary"
+        mover = threading.Thread(target=move)
+        mover.start()  # waits for the user row locked by the writer
+        resume.set()
+        writer.join(10)
+        mover.join(10)
+    finally:
+        resume.set()
+        event.remove(db.engine, "commit", pause_primary_commit)
+    with router.get_engine(target).connect() as connection:
+        assert connection.scalar(select(Task.title).where(Task.id == task_id)) == "Written during move"
+    assert db.session.scalar(select(User.shard).where(User.id == user_id)) == target
+
+def test_concurrent_done_changes_keep_counter(sharded_client):
+    """Two sessions marking the same task done at once should count it as done once"""
+    import threading
+    import time
+    client = sharded_client
+    app = client.application
+    user_id = next(user["id"] for user in (
+        client.post("/users", json={"username": f"toggler{n}", "email": f"toggler{n}@example.com",
+                                    "password": "password", "role": "User"}).get_json() for n in range(8))
+        if db.session.scalar(select(User.shard).where(User.id == user["id"])) != 0)
+    headers = login_test_user(user_id)
+    task = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    task_id = client.post("/tasks", json=task, headers=headers).get_json()["id"]
+    db.session.remove()
+
+    locked, resume = threading.Event(), threading.Event()
+    first = threading.current_thread()
+    def pause_after_lock(conn, cursor, statement, *args):  # the first session holds the user row
+        if threading.current_thread() is first and statement.startswith("UPDATE user") and not locked.is_set():
+            locked.set()
+            resume.wait(10)
+    def mark_done():
+        app.test_client().patch(f"/tasks/{task_id}", json={"done": 1}, headers=headers)
+
+    event.listen(db.engine, "after_cursor_execute", pause_after_lock)
+    try:
+        first = threading.Thread(target=mark_done)
+        first.start()
+        assert locked.wait(10)
+        second = threading.Thread(target=mark_done)
+        second.start()
+        time.sleep(0.5)  # the second session reaches the lock of the user row
+        resume.set()
+        first.join(10)
+        second.join(10)
+    finally:
+        resume.set()
+        event.remove(db.engine, "after_cursor_execute", pause_after_lock)
+    assert client.get(f"/tasks/user/{user_id}/stats", headers=headers).get_json()["done"] == 1
@@ -1,5 +1,12 @@
+from conftest import login_test_user, max_queries
+from datetime import datetime
 import json
 from flask_jwt_extended import create_access_token
+from models import db, Task, User
+from pagination import encode_cursor
+from search import mysql_boolean_query
+from sqlalchemy import event, select, update
+from task_views import rebuild_task_stats
 
 def test_create_task(test_client, test_user):
     """Task creation test by logged in user"""
@@ -23,6 +30,411 @@ def test_get_tasks(test_client, test_user, new_task):
 
     response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
     assert response.status_code == 200, "Logged user should can get your own tasks data"
-    data = response.get_json()
+    data = response.get_json()["items"]
     assert len(data) == 1
     assert data[0]["title"] == "Test Task", "API should return only tasks belongs to specific user"
+
+def test_get_tasks_pagination(test_client, test_user):
+    """Task list is returned in pages linked by cursor"""
+    due_dates = [datetime(2025, 3, day, 12, 0) for day in (5, 1, 3, 1, 2)] + [None]
+    for number, due_date in enumerate(due_dates):
+        db.session.add(Task(title=f"Task {number}", description="", due_date=due_date, done=0, user_id=test_user.id))
+    db.session.commit()
+    headers = login_test_user(test_user.id)
+
+    for sort in ("id", "due_date"):
+        titles, cursor = [], None
+        while True:
+            query = {"limit": 2, "sort": sort} | ({"after": cursor} if cursor else {})
+            response = test_client.get(f"/tasks/user/{test_user.id}", query_string=query, headers=headers)
+            assert response.status_code == 200
+            data = response.get_json()
+            assert len(data["items"]) <= 2, "Page should not be longer than requested limit"
+            titles += [task["title"] for task in data["items"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        expected = [f"Task {n}" for n in range(6)] if sort == "id" \
+            else ["Task 5", "Task 1", "Task 3", "Task 4", "Task 2", "Task 0"]
+        assert titles == expected, "Following cursors should return every task exactly once in requested order"
+
+    test_client.application.config["MAX_PAGE_SIZE"] = 4
+    response = test_client.get(f"/tasks/user/{test_user.id}?limit=100", headers=headers)
+    assert len(response.get_json()["items"]) == 4, "Page size should be limited by server maximum"
+
+    response = test_client.get(f"/tasks/user/{test_user.id}?after=notacursor", headers=headers)
+    assert response.status_code == 400, "Malformed cursor should be rejected"
+
+    test_client.application.config["LEGACY_LIST_RESPONSES"] = True
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
+    assert len(response.get_json()) == 6, "Compatibility mode should return whole list as JSON array"
+
+def test_get_tasks_filters(test_client, test_user):
+    """Task list filters and sorting are applied by the server"""
+    for day, done in ((1, 0), (2, 1), (3, 0), (4, 0)):
+        db.session.add(Task(title=f"Task {day}", description="", due_date=datetime(2025, 3, day, 12, 0),
+                            done=done, user_id=test_user.id))
+    db.session.commit()
+    headers = login_test_user(test_user.id)
+
+    query = {"done": 0, "due_after": "2025-03-01T12:00", "due_before": "2025-03-10T00:00", "sort": "-due_date"}
+    response = test_client.get(f"/tasks/user/{test_user.id}", query_string=query, headers=headers)
+    assert response.status_code == 200
+    assert [task["title"] for task in response.get_json()["items"]] == ["Task 4", "Task 3"]
+
+    response = test_client.get(f"/tasks/user/{test_user.id}?done=yes", headers=headers)
+    assert response.status_code == 400, "Incorrect filter value should be rejected"
+    response = test_client.get(f"/tasks/user/{test_user.id}?due_before=tomorrow", headers=headers)
+    assert response.status_code == 400, "Incorrect date filter format should be rejected"
+
+def test_get_tasks_filters_use_index(test_client, test_user):
+    """Filtered task list query should be an index range scan, not a table scan"""
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT") and "FROM task" in statement:
+            statements.append((statement, parameters))
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        headers = login_test_user(test_user.id)
+        query = {"done": 0, "due_before": "2025-03-10T00:00", "sort": "due_date"}
+        response = test_client.get(f"/tasks/user/{test_user.id}", query_string=query, headers=headers)
+        assert response.status_code == 200
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+
+    statement, parameters = statements[-1]
+    plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    details = " ".join(row[-1] for row in plan)
+    assert "USING INDEX ix_task_user_done_due_date" in details, details
+    assert "SCAN task" not in details and "TEMP B-TREE" not in details, details
+
+def test_tasks_batch(test_client, test_user, test_user2):
+    """Tasks can be created, updated and removed in batches, with result for each item"""
+    headers = login_test_user(test_user.id) | {"Content-Type": "application/json"}
+    other_task = Task(title="Other", description="", due_date=datetime(2025, 3, 1, 12, 0), done=0, user_id=test_user2.id)
+    db.session.add(other_task)
+    db.session.commit()
+
+    new_tasks = [{"title": f"Task {n}", "description": "", "due_date": "2025-03-01T12:00", "done": 0} for n in range(3)]
+    new_tasks.insert(1, {"title": "Broken", "description": "", "due_date": "tomorrow", "done": 0})
+    response = test_client.post("/tasks/batch", data=json.dumps(new_tasks), headers=headers)
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == [201, 400, 201, 201]
+    ids = [result["task"]["id"] for result in results if result["status"] == 201]
+    assert Task.query.filter_by(user_id=test_user.id).count() == 3
+
+    changes = [{"id": ids[0], "done": 1}, {"id": ids[1], "done": 1}, {"id": ids[2], "title": "Renamed"},
+               {"id": other_task.id, "done": 1}, {"id": 9999, "done": 1}]
+    response = test_client.patch("/tasks/batch", data=json.dumps(changes), headers=headers)
+    assert [result["status"] for result in response.get_json()["results"]] == [200, 200, 200, 403, 404]
+    db.session.expire_all()
+    assert [(task.title, task.done) for task in Task.query.filter(Task.id.in_(ids)).order_by(Task.id)] == \
+        [("Task 0", True), ("Task 1", True), ("Renamed", False)]
+    assert db.session.get(Task, other_task.id).done is False, "Tasks of other users should not be changed"
+    changes = [{"id": task_id, "title": f"Title {task_id}", "done": 0} for task_id in ids]
+    with max_queries(100) as statements:
+        test_client.patch("/tasks/batch", data=json.dumps(changes), headers=headers)
+    assert len([statement for statement in statements if statement.startswith("UPDATE task ")]) == 1, \
+        "Tasks with the same fields changed should be updated by one executemany statement"
+    db.session.expire_all()
+    assert [(task.title, task.done) for task in Task.query.filter(Task.id.in_(ids)).order_by(Task.id)] == \
+        [(f"Title {task_id}", False) for task_id in ids]
+    changes = [{"id": [ids[0]]}, {"id": ids[1], "description": ["x"]}, {"id": ids[2], "title": {"x": 1}}]
+    response = test_client.patch("/tasks/batch", data=json.dumps(changes), headers=headers)
+    assert [result["status"] for result in response.get_json()["results"]] == [400, 400, 400]
+
+    response = test_client.delete("/tasks/batch", data=json.dumps([ids[2], ids[2]]), headers=headers)
+    assert [result["status"] for result in response.get_json()["results"]] == [400, 400]
+    response = test_client.delete("/tasks/batch", data=json.dumps(ids[:2] + [other_task.id]), headers=headers)
+    assert [result["status"] for result in response.get_json()["results"]] == [200, 200, 403]
+    assert Task.query.count() == 2
+    assert test_client.get(f"/tasks/user/{test_user.id}/stats", headers=headers).get_json()["total"] == 1
+
+    test_client.application.config["TASK_BATCH_MAX_SIZE"] = 2
+    response = test_client.delete("/tasks/batch", data=json.dumps(ids), headers=headers)
+    assert response.status_code == 413, "Batch larger than configured maximum should be rejected"
+
+def test_tasks_batch_rejects_boolean_ids(test_client, test_user, new_task):
+    """JSON true and false are not task ids 1 and 0"""
+    headers = login_test_user(test_user.id) | {"Content-Type": "application/json"}
+    assert new_task.id == 1
+    response = test_client.patch("/tasks/batch", data=json.dumps([{"id": True, "title": "Changed"},
+                                                                   {"id": False, "title": "Changed"}]), headers=headers)
+    assert response.get_json()["results"] == [{"status": 400, "error": "Invalid request data structure."}] * 2
+    response = test_client.delete("/tasks/batch", data=json.dumps([True, False]), headers=headers)
+    assert response.get_json()["results"] == [{"status": 400, "error": "Invalid request data structure."}] * 2
+    db.session.expire_all()
+    assert [(task.id, task.title) for task in Task.query.all()] == [(1, "Test Task")]
+
+def test_tasks_batch_without_returning(test_client, test_user, monkeypatch):
+    """Without executemany RETURNING (MySQL), batch tasks should get ids from the sequence and one INSERT"""
+    monkeypatch.setattr(db.engine.dialect, "insert_executemany_returning_sort_by_parameter_order", False)
+    headers = login_test_user(test_user.id) | {"Content-Type": "application/json"}
+    new_tasks = [{"title": f"Task {n}", "description": "", "due_date": "2025-03-01T12:00", "done": 0} for n in range(5)]
+    with max_queries(100) as statements:
+        results = test_client.post("/tasks/batch", data=json.dumps(new_tasks), headers=headers).get_json()["results"]
+    assert len([statement for statement in statements if statement.startswith("INSERT INTO task ")]) == 1
+    ids = [result["task"]["id"] for result in results]
+    assert [task.id for task in Task.query.order_by(Task.id)] == ids
+    response = test_client.post("/tasks", data=json.dumps(new_tasks[0]), headers=headers)
+    assert response.get_json()["id"] == ids[-1] + 1, "Single tasks should take ids from the sequence too"
+
+def test_tasks_etags(test_client, test_user, new_task):
+    """Unchanged task resources should be answered with 304, stale updates with 412"""
+    headers = login_test_user(test_user.id) | {"Content-Type": "application/json"}
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
+    list_etag = response.headers["ETag"]
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers | {"If-None-Match": list_etag})
+    assert response.status_code == 304, "Unchanged list should not be sent again"
+
+    response = test_client.get(f"/tasks/{new_task.id}", headers=headers)
+    task_etag = response.headers["ETag"]
+    response = test_client.get(f"/tasks/{new_task.id}", headers=headers | {"If-None-Match": task_etag})
+    assert response.status_code == 304
+
+    response = test_client.patch(f"/tasks/{new_task.id}", data=json.dumps({"done": 1}),
+                                 headers=headers | {"If-Match": task_etag, "Prefer": "return=minimal"})
+    assert response.status_code == 204, "Update with current version should succeed"
+    new_etag = response.headers["ETag"]
+    assert new_etag != task_etag
+
+    response = test_client.patch(f"/tasks/{new_task.id}", data=json.dumps({"done": 0}), headers=headers | {"If-Match": task_etag})
+    assert response.status_code == 412, "Update based on stale version should be rejected"
+    response = test_client.patch(f"/tasks/{new_task.id}", data=json.dumps({"done": 0}), headers=headers | {"If-Match": new_etag})
+    assert response.status_code == 200 and response.get_json()["done"] is False
+    compressed_etag = response.headers["ETag"][:-1] + '-gzip"'  # as sent with compressed responses
+    response = test_client.patch(f"/tasks/{new_task.id}", json={"done": 1}, headers=headers | {"If-Match": "W/" + compressed_etag})
+    assert response.status_code == 412, "If-Match should use strong comparison"
+    response = test_client.patch(f"/tasks/{new_task.id}", json={"done": 1}, headers=headers | {"If-Match": compressed_etag})
+    assert response.status_code == 200, "ETag of compressed response should match its version"
+
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers | {"If-None-Match": list_etag})
+    assert response.status_code == 200, "Any task write should change the list ETag"
+
+def test_task_update_loses_race_with_same_etag(test_client, test_user, new_task, monkeypatch):
+    """Of two updates holding the same ETag, the one checked before the other committed should fail"""
+    import task_views
+    headers = login_test_user(test_user.id)
+    etag = test_client.get(f"/tasks/{new_task.id}", headers=headers).headers["ETag"]
+    def check_then_lose_race(etag):  # the other client commits its update right after the check
+        check_if_match(etag)
+        db.session.execute(update(User).where(User.id == test_user.id).values(tasks_version=User.tasks_version + 1))
+        db.session.commit()
+    check_if_match = task_views.check_if_match
+    monkeypatch.setattr(task_views, "check_if_match", check_then_lose_race)
+    response = test_client.patch(f"/tasks/{new_task.id}", json={"title": "Lost update"},
+                                 headers=headers | {"If-Match": etag})
+    assert response.status_code == 412, "Update should not overwrite the concurrent one"
+    assert db.session.scalar(select(Task.title).where(Task.id == new_task.id)) == "Test Task"
+
+def test_get_all_tasks_streamed(test_client, test_user, test_admin):
+    """Admin can export all tasks as streamed JSON array or NDJSON"""
+    db.session.add_all([Task(title=f"Task {n}", description="", done=0, user_id=test_user.id) for n in range(5)])
+    db.session.commit()
+    test_client.application.config["STREAM_YIELD_PER"] = 2
+    headers = login_test_user(test_admin.id)
+
+    with max_queries(10) as statements:
+        response = test_client.get("/tasks?stream=1", headers=headers)
+        assert response.status_code == 200 and response.is_streamed
+        assert [task["title"] for task in response.get_json()] == [f"Task {n}" for n in range(5)]
+    pages = [statement for statement in statements if "FROM task" in statement and "LIMIT" in statement]
+    assert len(pages) == 3, "Rows should be fetched in pages of STREAM_YIELD_PER rows"
+
+    response = test_client.get("/tasks?done=0", headers=headers | {"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["title"] for line in lines] == [f"Task {n}" for n in range(5)]
+
+    response = test_client.get("/tasks?stream=1", headers=login_test_user(test_user.id))
+    assert response.status_code == 403, "Common user should cannot export all tasks"
+
+def test_task_endpoints_query_budget(test_client, test_user, new_task):
+    """Main task endpoints should run a fixed, small number of SQL statements"""
+    headers = login_test_user(test_user.id)
+    task_id, user_id = new_task.id, test_user.id
+    test_client.get(f"/tasks/user/{user_id}", headers=headers)  # first token check also loads revoked tokens
+    task_data = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+
+    with max_queries(3):
+        assert test_client.get(f"/tasks/{task_id}", headers=headers).status_code == 200
+    with max_queries(2):
+        assert test_client.get(f"/tasks/user/{user_id}", headers=headers).status_code == 200
+    with max_queries(4):
+        assert test_client.post("/tasks", json=task_data, headers=headers).status_code == 200
+    with max_queries(5):  # owner, update, version bump, new version and task for response
+        assert test_client.put(f"/tasks/{task_id}", json=task_data, headers=headers).status_code == 200
+
+def test_task_changes_sync(test_client, test_user):
+    """Delta sync should return only tasks changed or deleted since the token"""
+    from flask import current_app
+    current_app.config["TASK_SYNC_MARGIN"] = 0
+    headers = login_test_user(test_user.id)
+    task_data = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    task_ids = [test_client.post("/tasks", json=task_data, headers=headers).get_json()["id"] for _ in range(3)]
+
+    first_sync = test_client.get(f"/tasks/user/{test_user.id}/changes", headers=headers).get_json()
+    assert [task["id"] for task in first_sync["changed"]] == task_ids and first_sync["deleted"] == []
+
+    test_client.patch(f"/tasks/{task_ids[0]}", json={"done": 1}, headers=headers)
+    test_client.delete(f"/tasks/{task_ids[1]}", headers=headers)
+    test_client.delete("/tasks/batch", json=[task_ids[2]], headers=headers)
+    new_id = test_client.post("/tasks", json=task_data, headers=headers).get_json()["id"]
+
+    changes = test_client.get(f"/tasks/user/{test_user.id}/changes?since={first_sync['next_token']}",
+                              headers=headers).get_json()
+    changed = {task["id"]: task for task in changes["changed"]}
+    assert set(changed) == {task_ids[0], new_id} and changed[task_ids[0]]["done"] is True
+    assert set(changes["deleted"]) == {task_ids[1], task_ids[2]} - {new_id}  # SQLite may reuse deleted id
+
+    nothing = test_client.get(f"/tasks/user/{test_user.id}/changes?since={changes['next_token']}",
+                              headers=headers).get_json()
+    assert nothing["changed"] == [] and nothing["deleted"] == []
+    assert test_client.get(f"/tasks/user/{test_user.id}/changes?since=bad", headers=headers).status_code == 400
+    old_token = encode_cursor([datetime(2000, 1, 1)])
+    assert test_client.get(f"/tasks/user/{test_user.id}/changes?since={old_token}", headers=headers).status_code == 410
+
+def test_task_changes_pages(test_client, test_user):
+    """Changes should come in pages of limited size, changed tasks first and deleted ones after them"""
+    from flask import current_app
+    current_app.config["TASK_SYNC_MARGIN"] = 0
+    headers = login_test_user(test_user.id)
+    task_data = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    first_sync = test_client.get(f"/tasks/user/{test_user.id}/changes", headers=headers).get_json()
+    task_ids = [test_client.post("/tasks", json=task_data, headers=headers).get_json()["id"] for _ in range(6)]
+    test_client.delete("/tasks/batch", json=task_ids[:3], headers=headers)
+
+    pages, cursor = [], None
+    while True:
+        params = {"since": first_sync["next_token"], "limit": 2, **({"after": cursor} if cursor else {})}
+        page = test_client.get(f"/tasks/user/{test_user.id}/changes", query_string=params, headers=headers).get_json()
+        assert len(page["changed"]) + len(page["deleted"]) <= 2
+        assert page["next_token"] == (pages or [page])[0]["next_token"], "Sync time should be kept by the cursor"
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if not page["has_more"]:
+            break
+    assert [task["id"] for page in pages for task in page["changed"]] == task_ids[3:]
+    assert sorted(task_id for page in pages for task_id in page["deleted"]) == task_ids[:3]
+    assert len(pages) == 3  # deleted tasks fill the rest of the last page of changed ones
+    invalid_cursors = [[2, datetime(2025, 1, 1), 1, datetime(2025, 1, 1)], ["0", None, None, datetime(2025, 1, 1)],
+                       [0, "yesterday", 1, datetime(2025, 1, 1)], [0, datetime(2025, 1, 1), None, datetime(2025, 1, 1)],
+                       [1, None, None, None], [0, None, None]]
+    for values in invalid_cursors:
+        params = {"since": first_sync["next_token"], "after": encode_cursor(values)}
+        response = test_client.get(f"/tasks/user/{test_user.id}/changes", query_string=params, headers=headers)
+        assert response.status_code == 400, f"Cursor {values} with unknown phase or malformed key should be rejected"
+
+def test_search_tasks(test_client, test_user, test_user2):
+    """Search should rank matching tasks of user and follow every write of tasks"""
+    headers = login_test_user(test_user.id)
+    def add_task(title, description, user_headers=headers):
+        task = {"title": title, "description": description, "due_date": "2025-03-20T12:00", "done": 0}
+        return test_client.post("/tasks", json=task, headers=user_headers).get_json()["id"]
+    def search(query, **params):
+        response = test_client.get(f"/tasks/user/{test_user.id}/search", query_string={"q": query, **params},
+                                   headers=headers)
+        return response.get_json()
+
+    in_description = add_task("Shopping", "Buy milk and bread")
+    in_title = add_task("Milk delivery", "Call the dairy")
+    add_task("Cleaning", "Kitchen")
+    add_task("Milk", "Not visible to other users", login_test_user(test_user2.id))
+    test_client.post("/tasks/batch", json=[{"title": "Milkshake", "description": "Blend MILK with fruit",
+                                            "due_date": "2025-03-20T12:00", "done": 0}], headers=headers)
+
+    results = search("milk")
+    assert len(results["items"]) == 3 and "rank" not in results["items"][0]
+    assert results["items"][0]["id"] == in_title, "Matches in title should rank higher"
+    first_page = search("milk", limit=2)
+    second_page = search("milk", limit=2, after=first_page["next_cursor"])
+    assert [task["id"] for task in first_page["items"] + second_page["items"]] == \
+        [task["id"] for task in results["items"]] and second_page["next_cursor"] is None
+
+    test_client.patch(f"/tasks/{in_title}", json={"title": "Cheese delivery"}, headers=headers)
+    test_client.delete(f"/tasks/{in_description}", headers=headers)
+    assert [task["title"] for task in search("milk")["items"]] == ["Milkshake"]
+    assert [task["id"] for task in search("cheese DELIVERY")["items"]] == [in_title]
+    assert search("dairy bread")["items"] == []
+    response = test_client.get(f"/tasks/user/{test_user.id}/search?q=%20*", headers=headers)
+    assert response.status_code == 400
+
+def test_mysql_search_query_skips_unindexed_words():
+    """Required words MySQL does not index (stopwords, short words) would make every search empty"""
+    assert mysql_boolean_query(["The", "milk", "of", "ox", "farm"]) == "+milk +farm"
+    assert mysql_boolean_query(["the", "an"]) == ""
+
+def test_task_stats(test_client, test_user, test_user2, test_admin):
+    """Task counters should follow every write and match a recount from scratch"""
+    headers = login_test_user(test_user.id)
+    def add_task(due_date, done=0, user_headers=headers):
+        task = {"title": "Task", "description": "", "due_date": due_date, "done": done}
+        return test_client.post("/tasks", json=task, headers=user_headers).get_json()["id"]
+    def get_stats(path=f"/tasks/user/{test_user.id}/stats", user_headers=headers):
+        return test_client.get(path, query_string={"now": "2025-03-20T12:00"}, headers=user_headers).get_json()
+
+    overdue = add_task("2025-03-19T12:00")
+    add_task("2025-03-20T18:00")
+    done_today = add_task("2025-03-20T08:00", done=1)
+    add_task("2025-03-25T12:00", user_headers=login_test_user(test_user2.id))
+    batch = [{"title": "Batch", "description": "", "due_date": "2025-04-01T12:00", "done": done} for done in (0, 1)]
+    batch_ids = [result["task"]["id"] for result in
+                 test_client.post("/tasks/batch", json=batch, headers=headers).get_json()["results"]]
+    assert get_stats() == {"total": 5, "done": 2, "open": 3, "overdue": 1, "due_today": 1}
+
+    test_client.patch(f"/tasks/{overdue}", json={"done": 1}, headers=headers)
+    test_client.patch(f"/tasks/{overdue}", json={"done": 1}, headers=headers)  # no change of counters
+    test_client.patch("/tasks/batch", json=[{"id": batch_ids[0], "done": 1}, {"id": batch_ids[1], "done": 0}],
+                      headers=headers)
+    test_client.delete(f"/tasks/{done_today}", headers=headers)
+    test_client.delete("/tasks/batch", json=[batch_ids[0]], headers=headers)
+    with max_queries(1):
+        stats = get_stats()
+    assert stats == {"total": 3, "done": 1, "open": 2, "overdue": 0, "due_today": 1}
+
+    admin_stats = get_stats("/tasks/stats", login_test_user(test_admin.id))
+    assert admin_stats == {"total": 4, "done": 1, "open": 3, "overdue": 0, "due_today": 1}
+    assert test_client.get("/tasks/stats", headers=headers).status_code == 403
+    stats_now = test_client.get(f"/tasks/user/{test_user.id}/stats", headers=headers).get_json()
+    assert (stats_now["overdue"], stats_now["due_today"]) == (2, 0), "Without now due dates are compared with UTC"
+
+    db.session.execute(update(User).values(tasks_total=0, tasks_done=0))
+    db.session.commit()
+    assert rebuild_task_stats() == 3  # users with and without tasks
+    assert get_stats() == stats
+
+def test_import_export_tasks(test_client, test_user, test_user2):
+    """Tasks should be imported in chunks with errors per line and exported back as NDJSON or CSV"""
+    test_client.application.config["IMPORT_CHUNK_SIZE"] = 2
+    headers = login_test_user(test_user.id)
+    lines = [json.dumps({"title": f"Task {n}", "description": "Imported", "due_date": "2025-03-20T12:00:00",
+                         "done": n % 2}) for n in range(5)]
+    lines[1] = '{"title": "Broken"'
+    lines[3] = json.dumps({"title": "", "description": "", "due_date": "2025-03-20T12:00", "done": 0})
+    response = test_client.post("/tasks/import", data="\n".join(lines) + "\n\n", headers=headers,
+                                content_type="application/x-ndjson")
+    assert response.get_json() == {"imported": 3, "failed": 2, "errors": [
+        {"line": 2, "error": "Invalid JSON."}, {"line": 4, "error": "Task title is required."}]}
+
+    response = test_client.get(f"/tasks/user/{test_user.id}/export", headers=headers)
+    assert response.is_streamed and response.mimetype == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [task["title"] for task in exported] == ["Task 0", "Task 2", "Task 4"]
+    assert test_client.get(f"/tasks/user/{test_user.id}/search?q=imported", headers=headers).get_json()["items"]
+
+    response = test_client.get(f"/tasks/user/{test_user.id}/export?format=csv", headers=headers)
+    assert response.mimetype == "text/csv" and "tasks-" in response.headers["Content-Disposition"]
+    csv_data = response.get_data()
+    assert csv_data.splitlines()[0] == b"id,title,description,due_date,done"
+
+    # Export of one user can be imported by another, with ids of tasks left out
+    headers2 = login_test_user(test_user2.id)
+    response = test_client.post("/tasks/import", data=csv_data, headers=headers2, content_type="text/csv")
+    assert response.get_json() == {"imported": 3, "failed": 0, "errors": []}
+    tasks = test_client.get(f"/tasks/user/{test_user2.id}", headers=headers2).get_json()["items"]
+    assert [(task["title"], task["done"], task["due_date"]) for task in tasks] == \
+        [(task["title"], task["done"], task["due_date"]) for task in exported]
+    stats = test_client.get(f"/tasks/user/{test_user2.id}/stats", headers=headers2).get_json()
+    assert (stats["total"], stats["done"]) == (3, 0)
+    assert test_client.get(f"/tasks/user/{test_user2.id}/export", headers=headers).status_code == 403
@@ -0,0 +1,48 @@
+from conftest import login_test_user
+from app import create_app
+from models import RevokedToken, db
+import sqlite3
+from werkzeug.security import generate_password_hash
+
+# Schema created by the first version of the app
+FIRST_VERSION_SCHEMA = """
+CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(20) NOT NULL, email VARCHAR(120) NOT NULL,
+    role VARCHAR(13), password VARCHAR(162) NOT NULL, PRIMARY KEY (id), UNIQUE (username), UNIQUE (email));
+CREATE TABLE task (id INTEGER NOT NULL, title VARCHAR(100) NOT NULL, description TEXT, done BOOLEAN,
+    due_date DATETIME, user_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE revoked_token (jti VARCHAR(100) NOT NULL, PRIMARY KEY (jti));
+"""
+
+def test_upgrade_database_of_first_version(tmp_path, monkeypatch):
+    """Database created by the first version should get missing columns, indexes and counters at start"""
+    database = tmp_path / "todolist.db"
+    connection = sqlite3.connect(database)
+    connection.executescript(FIRST_VERSION_SCHEMA)
+    connection.execute("INSERT INTO user VALUES (1, 'admin', 'admin@example.pl', 'Administrator', ?)",
+                       (generate_password_hash("admin"),))
+    connection.executemany("INSERT INTO task VALUES (?, ?, 'Old task', ?, '2025-03-20 12:00:00.000000', 1)",
+                           [(1, "Buy milk", 1), (2, "Buy bread", 0)])
+    connection.execute("INSERT INTO revoked_token VALUES ('old-token')")
+    connection.commit()
+    connection.close()
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{database}")
+    monkeypatch.setenv("TODOLIST_HASHING_WORKERS", "0")
+
+    app = create_app()
+    with app.test_client() as client, app.app_context():
+        assert app.test_client().post("/login", json={"username": "admin", "password": "admin"}).status_code == 200
+        headers = login_test_user(1)
+        tasks = client.get("/tasks/user/1", headers=headers).get_json()["items"]
+        assert [task["title"] for task in tasks] == ["Buy milk", "Buy bread"]
+        assert client.get("/tasks/user/1/stats", headers=headers).get_json()["done"] == 1
+        assert len(client.get("/tasks/user/1/search?q=milk", headers=headers).get_json()["items"]) == 1
+        changes = client.get("/tasks/user/1/changes", headers=headers).get_json()
+        assert len(changes["changed"]) == 2
+        assert db.session.get(RevokedToken, "old-token").exp is not None
+        assert client.patch("/tasks/1", json={"done": 0}, headers=headers).status_code == 200
+
+    # The next start finds nothing to upgrade
+    app = create_app()
+    with app.app_context():
+        from upgrade import upgrade_database
+        assert upgrade_database() == []
@@ -1,5 +1,14 @@
+from app import create_app
 from conftest import login_test_user
+from datetime import timedelta
+from flask_jwt_extended import create_access_token
+from hashing import PasswordHasher
+import identity
+from identity import AuthVersionCache
 import json
+from models import db, Task, User
+from sqlalchemy import event, func, select, update
+from werkzeug.security import check_password_hash, generate_password_hash
 
 def test_create_user(test_client, test_user, test_admin):
     """New user registration test"""
@@ -73,6 +82,56 @@ def test_remove_user(test_client, test_user, test_user2, test_admin):
     response = test_client.delete(f"/users/{test_user2.id}", headers=admin_headers)
     assert response.status_code == 200, "Admin user should can remove other user account"
 
+def test_remove_user_with_tasks(test_client, test_user, test_user2, test_admin):
+    """Account with more tasks than one chunk should be deleted by a job with pollable status"""
+    test_client.application.extensions["user_deletions"].chunk_size = 2
+    user_id, other_user_id = test_user.id, test_user2.id
+    headers = login_test_user(user_id)
+    task = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    test_client.post("/tasks/batch", json=[task] * 5, headers=headers)
+    test_client.post("/tasks", json=task, headers=login_test_user(other_user_id))
+
+    response = test_client.delete(f"/users/{user_id}", headers=headers)
+    assert response.status_code == 202
+    status = test_client.get(response.headers["Location"], headers=headers).get_json()
+    assert status["status"] == "done" and status["tasks_deleted"] == 5, "Requester should see status of deleted account"
+    assert test_client.get(response.headers["Location"], headers=login_test_user(other_user_id)).status_code == 403
+    assert test_client.get(response.headers["Location"], headers=login_test_user(test_admin.id)).status_code == 200
+
+    assert db.session.scalar(select(func.count()).select_from(Task)) == 1, "Only tasks of other user should remain"
+    assert db.session.get(User, user_id) is None
+    response = test_client.delete(f"/users/{other_user_id}", headers=login_test_user(test_admin.id))
+    assert response.status_code == 200 and db.session.scalar(select(func.count()).select_from(Task)) == 0
+
+def test_user_deletion_takes_effect_in_other_processes(tmp_path, monkeypatch):
+    """Other processes, which still trust cached claims of a deleted user, should reject their writes and tokens"""
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'todolist.db'}")
+    monkeypatch.setenv("TODOLIST_HASHING_WORKERS", "0")
+    monkeypatch.setenv("TODOLIST_REVOKED_TOKENS_BLOOM_REFRESH", "0")
+    deleting_app, other_app = create_app(), create_app()
+    deleting, other = deleting_app.test_client(), other_app.test_client()
+    new_user = {"username": "gone", "email": "gone@example.com", "password": "password", "role": "User"}
+    user_id = deleting.post("/users", json=new_user).get_json()["id"]
+    with deleting_app.app_context():
+        headers = login_test_user(user_id)
+    task = {"title": "Task", "description": "", "due_date": "2025-03-20T12:00", "done": 0}
+    assert other.post("/tasks", json=task, headers=headers).status_code == 200  # caches version and revocations
+
+    assert deleting.delete(f"/users/{user_id}", headers=headers).status_code == 200
+    assert deleting.get(f"/tasks/user/{user_id}", headers=headers).status_code == 401
+    response = other.post("/tasks", json=task, headers=headers)
+    assert response.status_code == 401, "Write for deleted user should fail even before the revocation is seen"
+    with other_app.app_context():
+        assert db.session.scalar(select(func.count()).select_from(Task)) == 0, "No task should be left without owner"
+    other_app.extensions["revoked_tokens"]._entries.clear()  # negative entries expired
+    assert other.get(f"/tasks/user/{user_id}", headers=headers).status_code == 401
+
+    assert deleting.post("/users", json=new_user).get_json()["id"] == user_id  # SQLite reuses the last id
+    with other_app.app_context():
+        new_headers = {"Authorization": f"Bearer {create_access_token(str(user_id), expires_delta=timedelta(hours=1))}"}
+    assert other.get(f"/tasks/user/{user_id}", headers=new_headers).status_code == 200, \
+        "Tokens of a new user with the same id should not be revoked"
+
 def test_login(test_client, test_user):
     """User login test"""
 
@@ -130,3 +189,111 @@ def test_user_logout(test_client, test_user):
     assert response.status_code == 200, "Logged user should can logout"
     response = test_client.get(f"/logout", headers=headers)
     assert response.status_code == 401, "Token should be revoked after logout"
+
+def test_authorization_uses_token_claims(test_client, test_user, test_admin):
+    """Role from token claims should be used until user's authorization version changes"""
+    response = test_client.post("/login", data=json.dumps({"username": "testuser", "password": "testpass"}),
+                                content_type="application/json")
+    headers = {"Authorization": f"Bearer {test_client.get_cookie('access_token_cookie').value}"}
+    test_client.delete_cookie("access_token_cookie")  # use only header tokens in this test
+
+    user_queries = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "user.role" in statement:
+            user_queries.append(statement)
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        test_client.get(f"/tasks/user/{test_user.id}", headers=headers)  # first request learns current version
+        user_queries.clear()
+        response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
+        assert response.status_code == 200
+        assert user_queries == [], "Authorization should not load user when token claims are current"
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+
+    response = test_client.get("/users", headers=headers)
+    assert response.status_code == 403
+
+    # Role change bumps authorization version, so claims from the old token are not trusted anymore
+    admin_headers = login_test_user(test_admin.id) | {"Content-Type": "application/json"}
+    response = test_client.patch(f"/users/{test_user.id}", data=json.dumps({"role": "Administrator"}), headers=admin_headers)
+    assert response.status_code == 200
+    response = test_client.get("/users", headers=headers)
+    assert response.status_code == 200, "Role change should take effect for already issued tokens"
+
+    # Removed user cannot use their token anymore
+    response = test_client.delete(f"/users/{test_user.id}", headers=admin_headers)
+    assert response.status_code == 200
+    response = test_client.get(f"/tasks/user/{test_user.id}", headers=headers)
+    assert response.status_code == 401, "Token of removed user should not be accepted"
+
+def test_admin_claims_trusted_for_shorter_time(monkeypatch):
+    """Authorization version should be trusted for tokens claiming administrator role only for the admin TTL"""
+    now = [1000.0]
+    monkeypatch.setattr(identity.time, "monotonic", lambda: now[0])
+    cache = AuthVersionCache(ttl=60, admin_ttl=5)
+    cache.set(1, 3)
+    now[0] += 10
+    assert cache.get(1) == 3
+    assert cache.get(1, admin=True) is None, "Demoted administrator should be checked in the database sooner"
+    now[0] += 60
+    assert cache.get(1) is None
+
+def test_user_etags(test_client, test_user):
+    """User data should support conditional GET and conditional update"""
+    headers = login_test_user(test_user.id) | {"Content-Type": "application/json"}
+    response = test_client.get(f"/users/{test_user.id}", headers=headers)
+    etag = response.headers["ETag"]
+    response = test_client.get(f"/users/{test_user.id}", headers=headers | {"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = test_client.patch(f"/users/{test_user.id}", data=json.dumps({"email": "new@example.com"}),
+                                 headers=headers | {"If-Match": etag})
+    assert response.status_code == 200
+    response = test_client.patch(f"/users/{test_user.id}", data=json.dumps({"email": "old@example.com"}),
+                                 headers=headers | {"If-Match": etag})
+    assert response.status_code == 412, "Update based on stale version should be rejected"
+
+def test_user_update_loses_race_with_same_etag(test_client, test_user, monkeypatch):
+    """Of two updates holding the same ETag, the one checked before the other committed should fail"""
+    import user_views
+    headers = login_test_user(test_user.id) | {"Content-Type": "application/json"}
+    etag = test_client.get(f"/users/{test_user.id}", headers=headers).headers["ETag"]
+    def check_then_lose_race(etag):  # the other client commits its update right after the check
+        check_if_match(etag)
+        db.session.execute(update(User).where(User.id == test_user.id).values(version=User.version + 1))
+        db.session.commit()
+    check_if_match = user_views.check_if_match
+    monkeypatch.setattr(user_views, "check_if_match", check_then_lose_race)
+    response = test_client.patch(f"/users/{test_user.id}", data=json.dumps({"email": "new@example.com"}),
+                                 headers=headers | {"If-Match": etag})
+    assert response.status_code == 412, "Update should not overwrite the concurrent one"
+    assert db.session.scalar(select(User.email).where(User.id == test_user.id)) == "test@example.com"
+
+def test_login_rehashes_password(test_client):
+    """Password hashed with outdated method should be rehashed with configured one on login"""
+    user = User(username="olduser", email="old@example.com", role="User",
+                password=generate_password_hash("oldpass", "pbkdf2:sha256:1000"))
+    db.session.add(user)
+    db.session.commit()
+    response = test_client.post("/login", data=json.dumps({"username": "olduser", "password": "oldpass"}),
+                                content_type="application/json")
+    assert response.status_code == 200
+    db.session.refresh(user)
+    assert user.password.startswith("scrypt:"), "Password should be rehashed with configured method"
+    assert check_password_hash(user.password, "oldpass")
+
+def test_login_when_hashing_queue_is_full(test_client, test_user):
+    """Login should fail fast with Retry-After when too many passwords are being hashed"""
+    test_client.application.extensions["password_hasher"] = PasswordHasher("scrypt", workers=0, max_pending=0, retry_after=3)
+    response = test_client.post("/login", data=json.dumps({"username": "testuser", "password": "testpass"}),
+                                content_type="application/json")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+
+def test_password_hasher_process_pool():
+    """Hashes computed in worker processes should be verifiable"""
+    hasher = PasswordHasher("pbkdf2:sha256:1000", workers=1, max_pending=2, retry_after=1)
+    password_hash = hasher.hash("secret")
+    assert hasher.verify(password_hash, "secret") and not hasher.verify(password_hash, "wrong")
+    assert not hasher.needs_rehash(password_hash)
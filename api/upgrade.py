@@ -0,0 +1,90 @@
+from datetime import datetime
+from flask import current_app
+import logging
+from models import RevokedToken, db, utc_now
+from search import rebuild_search_index
+from sqlalchemy import column, inspect, table, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn
+from task_views import rebuild_task_stats
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🧱 DATABASE UPGRADE
+# ============================================================
+# db.create_all() creates missing tables, but never changes tables which already
+# exist. upgrade_database() brings a database created by an older version of the
+# app to the current models: it adds missing columns (filled in for existing
+# rows), missing indexes and the search index, and recounts task counters when
+# they are new. It runs at start of the app, before anything reads the tables,
+# and does nothing on a current database. Columns are only ever added, so
+# processes of the previous version keep working during a rolling deployment.
+
+
+def upgrade_database():
+    """Add columns and indexes missing in tables of the primary database; return descriptions of changes."""
+    changes = []
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for model_table in db.metadata.sorted_tables:
+        if model_table.name not in existing_tables:
+            continue  # created by create_all, complete
+        existing_columns = {column_info["name"] for column_info in inspector.get_columns(model_table.name)}
+        for model_column in model_table.columns:
+            if model_column.name not in existing_columns and _add_column(model_table, model_column):
+                changes.append(f"column {model_table.name}.{model_column.name}")
+        existing_indexes = {index_info["name"] for index_info in inspector.get_indexes(model_table.name)}
+        for index in model_table.indexes:
+            ddl_if = index._ddl_if  # indexes of other databases (FULLTEXT) are not created
+            dialects = (None, db.engine.dialect.name)
+            if index.name not in existing_indexes and (ddl_if is None or ddl_if.dialect in dialects):
+                with db.engine.begin() as connection:
+                    index.create(connection, checkfirst=True)
+                changes.append(f"index {index.name}")
+
+    if db.engine.dialect.name == "sqlite" and "task" in existing_tables and "task_fts" not in existing_tables:
+        rebuild_search_index()  # FTS5 table and triggers are created only together with the task table
+        changes.append("search index")
+    if {"column user.tasks_total", "column user.tasks_done"} & set(changes):
+        rebuild_task_stats()
+        changes.append("task counters")
+    for change in changes:
+        logger.info("Database upgraded: added %s", change)
+    return changes
+
+
+def _add_column(model_table, model_column):
+    """Add column to existing table and fill it in; return False if another process has just added it."""
+    try:
+        with db.engine.begin() as connection:
+            dialect = connection.dialect
+            preparer = dialect.identifier_preparer
+            table_name, column_name = preparer.format_table(model_table), preparer.quote(model_column.name)
+            # Added as nullable and filled in, as SQLite cannot add a NOT NULL column without a constant default
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} "
+                                    f"{model_column.type.compile(dialect=dialect)}"))
+            # Lightweight table, so onupdate defaults of other (maybe still missing) columns are not applied
+            connection.execute(update(table(model_table.name, column(model_column.name)))
+                               .values({model_column.name: _get_fill_value(model_column)}))
+            if not model_column.nullable and dialect.name == "mysql":
+                connection.execute(text(f"ALTER TABLE {table_name} MODIFY "
+                                        f"{CreateColumn(model_column).compile(dialect=dialect)}"))
+    except DBAPIError:
+        columns = {column_info["name"] for column_info in inspect(db.engine).get_columns(model_table.name)}
+        if model_column.name not in columns:
+            raise
+        return False
+    return True
+
+
+def _get_fill_value(model_column):
+    # Value of new column in existing rows: its default, e.g. 0 of version counters or now for updated_at
+    if model_column is RevokedToken.__table__.c.exp:
+        # Expiration of tokens revoked before it was stored is unknown: the longest token lifetime from now
+        expires = current_app.config["JWT_ACCESS_TOKEN_EXPIRES"]
+        return utc_now() + expires if expires else datetime(9999, 12, 31)
+    default = model_column.default
+    if default is None:
+        return None
+    return default.arg(None) if default.is_callable else default.arg
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import logging
+from models import Task, TaskTombstone, User, UserDeletion, db, delete_chunk, utc_now
+from per_process import PerProcess
+from revocation import revoke_user_tokens
+from shards import use_user_shard
+from sqlalchemy import delete, select, update
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🗑️ USER ACCOUNT DELETION
+# ============================================================
+# An account is deleted by set-based DELETEs of its tasks (and records of deleted
+# tasks) in chunks of CHUNK_SIZE rows, each in its own short transaction, and
+# then of the user row. Accounts with more tasks than one chunk are deleted by
+# a background thread of the process, while the client polls the job status.
+# Jobs are stored in the database, so any server process can report their
+# status, and jobs interrupted by a restart are finished when the server starts
+# again (or by the resume-user-deletions command).
+
+
+class UserDeletions:
+    def __init__(self, chunk_size, background=True):
+        self.chunk_size = chunk_size
+        self.background = background  # False runs jobs in the calling thread
+        # One thread, started on first use in every process (threads do not survive fork of server workers)
+        self._executor = PerProcess(lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-deletion"))
+
+    def delete_user(self, user_id, requested_by, tasks_count):
+        """Delete account and return None, or return job of background deletion for large account."""
+        if tasks_count <= self.chunk_size:
+            self._delete_user_row(user_id)
+            return None
+        deletion = db.session.scalar(select(UserDeletion).where(UserDeletion.user_id == user_id,
+                                                                UserDeletion.status.in_(("pending", "running"))))
+        if deletion is not None:  # deletion was already requested
+            return deletion
+        deletion = UserDeletion(user_id=user_id, requested_by=requested_by)
+        db.session.add(deletion)
+        db.session.commit()
+        self.submit(deletion.id)
+        return deletion
+
+    def submit(self, deletion_id):
+        if not self.background:
+            self.run(deletion_id)
+            return
+        app = current_app._get_current_object()  # the job runs outside of request, in its own app context
+        self._executor.get().submit(self._run_in_app_context, app, deletion_id)
+
+    def _run_in_app_context(self, app, deletion_id):
+        with app.app_context():
+            self.run(deletion_id)
+
+    def run(self, deletion_id):
+        deletion = db.session.get(UserDeletion, deletion_id)
+        deletion.status = "running"
+        db.session.commit()
+        use_user_shard(deletion.user_id)
+        try:
+            while True:
+                deleted_tasks = delete_chunk(db.session, Task, Task.user_id == deletion.user_id, self.chunk_size)
+                if not deleted_tasks:
+                    break
+                deletion.tasks_deleted += deleted_tasks
+                db.session.commit()
+            while delete_chunk(db.session, TaskTombstone, TaskTombstone.user_id == deletion.user_id, self.chunk_size):
+                db.session.commit()
+            deletion.tasks_deleted += self._delete_user_row(deletion.user_id)
+            deletion.status = "done"
+        except Exception as error:
+            logger.exception("Deletion of user %s failed", deletion.user_id)
+            db.session.rollback()
+            deletion.status, deletion.error = "failed", str(error)[:200]
+        deletion.finished_at = utc_now()
+        db.session.commit()
+
+    def _delete_user_row(self, user_id):
+        """Delete user with tasks left (e.g. created during deletion) in one transaction; return their number."""
+        use_user_shard(user_id)
+        # Locking user row first makes writers of user's tasks wait until the user is gone
+        db.session.execute(update(User).where(User.id == user_id).values(tasks_version=User.tasks_version + 1),
+                           execution_options={"synchronize_session": False})
+        deleted_tasks = db.session.execute(delete(Task).where(Task.user_id == user_id),
+                                           execution_options={"synchronize_session": False}).rowcount
+        db.session.execute(delete(TaskTombstone).where(TaskTombstone.user_id == user_id),
+                           execution_options={"synchronize_session": False})
+        db.session.execute(delete(User).where(User.id == user_id))  # also marks User object in session as deleted
+        # Other processes may still trust the user's token claims (auth versions cache)
+        revocation = revoke_user_tokens(user_id)
+        db.session.commit()
+        current_app.extensions["revoked_tokens"].add(revocation.jti, revocation.exp)
+        return deleted_tasks
+
+
+def get_unfinished_deletion_ids():
+    """Return ids of deletion jobs which are not finished, e.g. interrupted by restart."""
+    return db.session.scalars(select(UserDeletion.id).where(
+        UserDeletion.status.in_(("pending", "running"))).order_by(UserDeletion.id)).all()
+
+
+def resume_user_deletions(deletions):
+    """Run unfinished deletion jobs (e.g. interrupted by restart) in this thread and return their number."""
+    deletion_ids = get_unfinished_deletion_ids()
+    for deletion_id in deletion_ids:
+        deletions.run(deletion_id)
+    return len(deletion_ids)
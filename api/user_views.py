@@ -1,9 +1,16 @@
-from flask import Blueprint, jsonify, request, abort
+from etags import check_if_match, check_version_bumped, get_expected_version, is_not_modified, make_etag, \
+    not_modified_response, with_etag
+from flask import Blueprint, current_app, g, jsonify, request, abort
 from flask_jwt_extended import create_access_token, set_access_cookies, jwt_required, \
 verify_jwt_in_request, get_jwt_identity, unset_jwt_cookies, get_jwt
-from models import User, db, RevokedToken
+from models import User, UserDeletion, db, RevokedToken, row_to_dict
+from pagination import paginated_response
+from replicas import use_primary
+from revocation import token_expiration
+from shards import place_new_user
+from streaming import stream_requested, streamed_response
 import os
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import generate_password_hash
 
 user_bp = Blueprint('user_bp', __name__)
 
@@ -15,18 +22,26 @@ user_bp = Blueprint('user_bp', __name__)
 @jwt_required()
 def get_all_users():
     admin_required(get_jwt_identity()) # only admin can get all users details
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    users = db.select(*User.get_serialized_columns())
+    if stream_requested():  # export of the whole table
+        return streamed_response(users, row_to_dict, [User.id])
+    return paginated_response(users, row_to_dict, [User.id])
 
 
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
 @jwt_required()
 def get_user(user_id):
     validate_access(user_id) # check if user tries to read other user account details
-    user = db.session.get(User, user_id)
+    version = db.session.scalar(db.select(User.version).where(User.id == user_id))
+    if version is None:
+        abort(404, "User not found.")
+    etag = make_etag("user", user_id, version)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    user = db.session.execute(db.select(*User.get_serialized_columns()).where(User.id == user_id)).first()
     if user is None:
         abort(404, "User not found.")
-    return jsonify(user.to_dict())
+    return with_etag(jsonify(row_to_dict(user)), etag)
 
 
 @user_bp.route('/users', methods=['POST'])
@@ -36,9 +51,10 @@ def create_user():
     if new_user_role == "Administrator":
         verify_jwt_in_request()
         admin_required(get_jwt_identity(), message="Access denied. Only administrators can create admin accounts.")
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = current_app.extensions["password_hasher"].hash(data['password'])
     user = User(username=data['username'], email=data['email'], password=hashed_password, role=new_user_role)
     db.session.add(user)
+    place_new_user(user)
     db.session.commit()
     return jsonify(user.to_dict()), 201
 
@@ -62,27 +78,60 @@ def edit_user(user_id):
     user_to_update = db.session.get(User, user_id)
     if user_to_update is None:
         abort(404, "User not found.")
+    version = user_to_update.version
+    check_if_match(make_etag("user", user_id, version))
+    new_values = {}
     for field_name in editable_fields:
         requested_value = request_data.get(field_name)
         if requested_value is None:
             continue
-        new_value = generate_password_hash(requested_value) \
+        new_values[field_name] = current_app.extensions["password_hasher"].hash(requested_value) \
             if field_name == 'password' else requested_value
+    # Version is bumped by the database first (it locks the row), only if it is still the compared one
+    version_bump = db.update(User).where(User.id == user_id).values(version=User.version + 1)
+    expected_version = get_expected_version(version)
+    if expected_version is not None:
+        version_bump = version_bump.where(User.version == expected_version)
+    result = db.session.execute(version_bump, execution_options={"synchronize_session": False})
+    if expected_version is not None:
+        check_version_bumped(result.rowcount)
+    for field_name, new_value in new_values.items():
+        if field_name == 'role' and new_value != user_to_update.role:
+            user_to_update.auth_version += 1 # invalidate role claims in issued tokens
         setattr(user_to_update, field_name, new_value)
-    db.session.commit()
-    return jsonify(user_to_update.to_dict())
+    db.session.commit()  # expires the user, so the response reads the bumped version
+    current_app.extensions["auth_versions"].set(user_id, user_to_update.auth_version)
+    return with_etag(jsonify(user_to_update.to_dict()), make_etag("user", user_id, user_to_update.version))
 
 
 @user_bp.route('/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
 def remove_user(user_id):
     validate_access(user_id) # Only admin can remove other users accounts
-    user_to_delete = db.session.get(User, user_id)
-    if user_to_delete is None:
+    tasks_count = db.session.scalar(db.select(User.tasks_total).where(User.id == user_id))
+    if tasks_count is None:
         abort(404, "User not found.")
-    db.session.delete(user_to_delete)
-    db.session.commit()
-    return jsonify({"msg": "User removed successfully."})
+    # Tasks are deleted by set-based statements, large accounts in background
+    deletion = current_app.extensions["user_deletions"].delete_user(user_id, int(get_jwt_identity()), tasks_count)
+    current_app.extensions["auth_versions"].discard(user_id)
+    if deletion is None:
+        return jsonify({"msg": "User removed successfully."})
+    response = jsonify(deletion.to_dict())
+    response.status_code = 202
+    response.headers["Location"] = f"/users/deletions/{deletion.id}"
+    return response
+
+
+@user_bp.route('/users/deletions/<int:deletion_id>', methods=['GET'])
+@jwt_required()
+def get_user_deletion(deletion_id):
+    deletion = db.session.get(UserDeletion, deletion_id)
+    if deletion is None:
+        abort(404, "User deletion not found.")
+    # Requester may poll even when their own account is already gone
+    if deletion.requested_by != int(get_jwt_identity()):
+        admin_required(get_jwt_identity())
+    return jsonify(deletion.to_dict())
 
 
 @user_bp.route('/login', methods=['POST'])
@@ -97,8 +146,14 @@ def user_login():
     else:
         abort(401, "User failed login")
     
-    if password_hash and check_password_hash(password_hash, password):
-        access_token = create_access_token(identity=str(user_from_db.id))
+    password_hasher = current_app.extensions["password_hasher"]
+    if password_hash and password_hasher.verify(password_hash, password):
+        if password_hasher.needs_rehash(password_hash):
+            # Hashing method or work factor was changed since the password was set
+            user_from_db.password = password_hasher.hash(password)
+            db.session.commit()
+        claims = {"role": user_from_db.role, "auth_version": user_from_db.auth_version}
+        access_token = create_access_token(identity=str(user_from_db.id), additional_claims=claims)
         response = jsonify({"msg": "User logged in successfully.", "user_id": user_from_db.id})
         set_access_cookies(response, access_token)
         return response
@@ -109,10 +164,11 @@ def user_login():
 @user_bp.route('/logout', methods=['GET'])
 @jwt_required()
 def user_logout():
-    jti = get_jwt()["jti"]
-    revoked_token = RevokedToken(jti=jti)
+    jwt_payload = get_jwt()
+    revoked_token = RevokedToken(jti=jwt_payload["jti"], exp=token_expiration(jwt_payload))
     db.session.add(revoked_token)
     db.session.commit()
+    current_app.extensions["revoked_tokens"].add(revoked_token.jti, revoked_token.exp)
     response = jsonify({"msg": "User logged out successfully."})
     unset_jwt_cookies(response)
     return response
@@ -123,19 +179,47 @@ def user_logout():
 # ============================================================
 
 def admin_required(user_id, message='Access denied.'):
-    user = db.session.get(User, user_id)
-    if user is None or user.role != "Administrator":
+    if int(user_id) == int(get_jwt_identity()):
+        role = get_logged_user_role()
+    else:
+        user = db.session.get(User, user_id)
+        role = user.role if user is not None else None
+    if role != "Administrator":
         abort(403, message)
 
 
 def validate_access(owner_id, message='Access denied.'):
     # Check if user try to access or edit resource that does not belong to them 
     logged_user_id = int(get_jwt_identity())
-    logged_user_role = db.session.get(User, logged_user_id).role
+    logged_user_role = get_logged_user_role()
     if logged_user_role != "Administrator" and logged_user_id != owner_id:
         abort(403, message)
 
 
+def get_logged_user_role():
+    """Return role of logged user, trusting token claims while their authorization version is current."""
+    claims = get_jwt()
+    cached = g.get("logged_user_role")
+    if cached is not None and cached[0] == claims["jti"]:  # already resolved in this request
+        return cached[1]
+    logged_user_id = int(get_jwt_identity())
+    auth_versions = current_app.extensions["auth_versions"]
+    role = claims.get("role")
+    known_version = auth_versions.get(logged_user_id, admin=role == "Administrator")
+    if role is None or known_version is None or known_version != claims.get("auth_version"):
+        # Token without claims, or version unknown or changed since token was issued. Read from the primary,
+        # a lagging replica could still have the role and version from before the change
+        with use_primary():
+            user = db.session.get(User, logged_user_id, populate_existing=True)
+        if user is None:
+            auth_versions.discard(logged_user_id)
+            abort(401, "User no longer exists.")
+        auth_versions.set(logged_user_id, user.auth_version)
+        role = user.role
+    g.logged_user_role = (claims["jti"], role)
+    return role
+
+
 def init_db():
     """Create default admin account if database is empty"""
     with db.session.begin():
@@ -143,7 +227,7 @@ def init_db():
             admin_username = os.getenv("TODOLIST_ADMIN_USERNAME", "admin")
             admin_email = os.getenv("TODOLIST_ADMIN_EMAIL", "admin@example.pl")
             admin_password = os.getenv("TODOLIST_ADMIN_PASSWORD", "admin")
-            hashed_password = generate_password_hash(admin_password)
+            hashed_password = generate_password_hash(admin_password, current_app.config["PASSWORD_HASH_METHOD"])
             admin = User(username=admin_username, email=admin_email, password=hashed_password, role='Administrator')
             db.session.add(admin)
             db.session.commit()
@@ -1,9 +1,71 @@
 import api from "./api"
 
-// Get user tasks
-export const getUserTasks = async (userId: number) => {
-  const response = await api.get(`/tasks/user/${userId}`);
-  return response.data;
+const API_URL = import.meta.env.VITE_API_URL || "http://localhost:5173";
+
+export interface TaskFilters {
+  done?: 0 | 1;
+  due_before?: string;
+  due_after?: string;
+  sort?: "id" | "due_date" | "-due_date";
+}
+
+// Get user tasks (API filters them and returns in pages linked by cursor)
+export const getUserTasks = async (userId: number, filters: TaskFilters = {}) => {
+  const tasks = [];
+  let cursor: string | null = null;
+  do {
+    const params: TaskFilters & { after?: string } = cursor ? { ...filters, after: cursor } : filters;
+    const response = await api.get(`/tasks/user/${userId}`, { params });
+    tasks.push(...response.data.items);
+    cursor = response.data.next_cursor;
+  } while (cursor);
+  return tasks;
+};
+
+export interface SyncedTask {
+  id: number;
+  title: string;
+  description: string;
+  due_date: string;
+  done: boolean;
+}
+
+// Sync local copy of user tasks: only tasks changed or deleted since the token are downloaded, in pages.
+// Without token (first sync) all tasks are downloaded. Returns updated tasks and token for the next sync.
+export const syncUserTasks = async <T extends SyncedTask>(userId: number, tasks: T[], token: string | null): Promise<{ tasks: T[]; token: string }> => {
+  const changed = new Map<number, T>(); // a task updated during the sync may come again on a later page
+  const deleted: number[] = [];
+  let cursor: string | null = null;
+  let nextToken: string;
+  do {
+    const params: { since?: string; after?: string } = {};
+    if (token) params.since = token;
+    if (cursor) params.after = cursor;
+    const response = await api.get(`/tasks/user/${userId}/changes`, { params, validateStatus: (status) => status < 400 || status === 410 });
+    if (response.status === 410) {
+      return syncUserTasks(userId, tasks, null); // token too old, download everything again
+    }
+    const page = response.data as { changed: T[]; deleted: number[]; next_cursor: string | null; next_token: string };
+    page.changed.forEach((task) => changed.set(task.id, task));
+    deleted.push(...page.deleted);
+    cursor = page.next_cursor;
+    nextToken = page.next_token;
+  } while (cursor);
+  deleted.forEach((id) => changed.delete(id)); // deleted after it was sent on an earlier page
+  const removedIds = new Set<number>([...deleted, ...changed.keys()]);
+  const synced = token ? tasks.filter((task) => !removedIds.has(task.id)) : [];
+  synced.push(...changed.values());
+  synced.sort((a, b) => a.id - b.id);
+  return { tasks: synced, token: nextToken };
+};
+
+// Listen to task events of user (pushed by server after every change), returns function closing the stream
+export const subscribeTaskEvents = (userId: number, onChange: () => void) => {
+  const events = new EventSource(`${API_URL}/tasks/user/${userId}/events`, { withCredentials: true });
+  for (const type of ["task.created", "task.updated", "task.deleted", "task.imported", "evicted"]) {
+    events.addEventListener(type, onChange);
+  }
+  return () => events.close();
 };
 
 // Create new task
@@ -18,7 +18,24 @@ export const updateUser = async (
   return response.data;
 };
 
+const MAX_DELETION_POLLS = 300; // about 5 minutes
+
+// Large accounts are deleted in background (202 Accepted): wait until the deletion job finishes
 export const deleteUser = async (userId: number) => {
     const response = await api.delete(`/users/${userId}`);
-    return response.data;
+    if (response.status !== 202) {
+      return response.data;
+    }
+    let deletion = response.data;
+    for (let polls = 0; deletion.status === "pending" || deletion.status === "running"; polls++) {
+      if (polls === MAX_DELETION_POLLS) {
+        throw new Error("Account deletion is still in progress, check again later.");
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      deletion = (await api.get(`/users/deletions/${deletion.id}`)).data;
+    }
+    if (deletion.status === "failed") {
+      throw new Error(deletion.error);
+    }
+    return deletion;
   };
\ No newline at end of file
@@ -1,6 +1,6 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { getUserTasks, createTask, deleteTask } from "../api/tasks";
+import { syncUserTasks, subscribeTaskEvents, createTask, deleteTask } from "../api/tasks";
 import { logout } from "../api/auth";
 import api from "../api/api";
 import Cookies from "js-cookie";
@@ -20,6 +20,8 @@ const Tasks = () => {
   const [newTask, setNewTask] = useState({ title: "", description: "", due_date: "", done: false });
   const [editingTaskId, setEditingTaskId] = useState<number | null>(null);
   const [editedTask, setEditedTask] = useState<Partial<Task>>({});  
+  const tasksRef = useRef<Task[]>([]);
+  const syncToken = useRef<string | null>(null);
   const navigate = useNavigate();
   const userId = Number(Cookies.get("user_id"))
 
@@ -29,18 +31,31 @@ const Tasks = () => {
       return;
     }
 
+    // First sync downloads all tasks, next ones (e.g. when user comes back to the tab) only the changes
     const fetchTasks = async () => {
       try {
-        const tasksData = await getUserTasks(userId);
-        setTasks(tasksData);
+        const synced = await syncUserTasks(userId, tasksRef.current, syncToken.current);
+        syncToken.current = synced.token;
+        setTasks(synced.tasks);
       } catch (error) {
         console.error("Error during tasks fetching:", error);
       }
     };
 
     fetchTasks();
+    // Changes made in other tabs or devices arrive as events, instead of polling
+    const closeEvents = subscribeTaskEvents(userId, fetchTasks);
+    window.addEventListener("focus", fetchTasks);
+    return () => {
+      closeEvents();
+      window.removeEventListener("focus", fetchTasks);
+    };
   }, [userId]);
 
+  useEffect(() => {
+    tasksRef.current = tasks;
+  }, [tasks]);
+
   const handleLogout = async () => {
     await logout();
     navigate("/login");